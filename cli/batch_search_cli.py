@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import argparse
+from pathlib import Path
+import sys
+
+# Add project root to path to allow imports to work when running as script
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+  sys.path.insert(0, str(project_root))
+
+from cli.lib.search_utils import DEFAULT_NPROBE, QUANTIZATIONS
+
+# command modules are imported by their case below, so a command only pays
+# for numpy, the indexes or the model when it uses them
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Batch Search CLI: runs every query of a file, one per line, and writes JSONL results")
+  subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+  def add_io_arguments(subparser: argparse.ArgumentParser) -> None:
+    subparser.add_argument("queries", type=str, help="File with one query per line, - for stdin")
+    subparser.add_argument("--output", type=str, help="JSONL file to write, one line per query (default: stdout)")
+    subparser.add_argument("--limit", type=int, default=5, help="Results per query (default: 5)")
+
+  def add_semantic_arguments(subparser: argparse.ArgumentParser, engines: bool) -> None:
+    if engines:
+      subparser.add_argument("--engine", choices=["exact", "ivf"], default="exact", help="Score every chunk, or only the closest IVF lists (default: exact)")
+      subparser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help=f"IVF lists scanned per query (default: {DEFAULT_NPROBE})")
+    subparser.add_argument("--quantization", choices=QUANTIZATIONS, help="Search compressed embeddings, rescoring a shortlist exactly")
+
+  bm25_parser = subparsers.add_parser("bm25", help="BM25 keyword search, all queries scored together with the matrix engine")
+  add_io_arguments(bm25_parser)
+
+  semantic_parser = subparsers.add_parser("semantic", help="Semantic search over movie embeddings, queries embedded in one batch")
+  add_io_arguments(semantic_parser)
+  add_semantic_arguments(semantic_parser, engines=False)
+
+  chunked_parser = subparsers.add_parser("chunked", help="Semantic search over chunk embeddings, queries embedded in one batch")
+  add_io_arguments(chunked_parser)
+  add_semantic_arguments(chunked_parser, engines=True)
+
+  hybrid_parser = subparsers.add_parser("hybrid", help="Weighted keyword and semantic search")
+  add_io_arguments(hybrid_parser)
+  hybrid_parser.add_argument("--alpha", type=float, default=0.5, help="Weight of the keyword score against the semantic one (default: 0.5)")
+  add_semantic_arguments(hybrid_parser, engines=True)
+
+  args = parser.parse_args()
+
+  match args.command:
+    case "bm25":
+      from cli.lib.batch_search import bm25_batch_cmd
+      bm25_batch_cmd(args.queries, args.output, args.limit)
+      pass
+    case "semantic":
+      from cli.lib.batch_search import semantic_batch_cmd
+      semantic_batch_cmd(args.queries, args.output, args.limit, args.quantization)
+      pass
+    case "chunked":
+      from cli.lib.batch_search import chunked_batch_cmd
+      chunked_batch_cmd(args.queries, args.output, args.limit, args.engine, args.nprobe, args.quantization)
+      pass
+    case "hybrid":
+      from cli.lib.batch_search import hybrid_batch_cmd
+      hybrid_batch_cmd(args.queries, args.output, args.alpha, args.limit, args.engine, args.nprobe, args.quantization)
+      pass
+    case _:
+      parser.print_help()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import argparse
+from pathlib import Path
+import sys
+
+# Add project root to path to allow imports to work when running as script 
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+  sys.path.insert(0, str(project_root))
+
+from cli.lib.benchmarks import build_benchmark_cmd, chunk_benchmark_cmd, startup_benchmark_cmd, tokenize_benchmark_cmd
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Benchmarks CLI")
+  subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+  tokenize_parser = subparsers.add_parser("tokenize", help="Compare tokenize_text and Tokenizer throughput on the movies corpus")
+  tokenize_parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, best time is kept (default: 3)")
+
+  build_parser = subparsers.add_parser("build", help="Time the sharded index build for several worker counts")
+  build_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to try (default: 1 2 4)")
+  build_parser.add_argument("--scale", type=int, default=1, help="Replicate the movies corpus this many times (default: 1)")
+
+  chunk_parser = subparsers.add_parser("chunk", help="Time sentence chunking of the descriptions for several worker counts")
+  chunk_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to try (default: 1 2 4)")
+  chunk_parser.add_argument("--scale", type=int, default=1, help="Replicate the movies corpus this many times (default: 1)")
+
+  startup_parser = subparsers.add_parser("startup", help="Time a run of every CLI subcommand in a fresh interpreter, against the built indexes")
+  startup_parser.add_argument("--repeat", type=int, default=5, help="Runs per command, best time is kept (default: 5)")
+
+  args = parser.parse_args()
+
+  match args.command:
+    case "tokenize":
+      tokenize_benchmark_cmd(args.repeat)
+      pass
+    case "build":
+      build_benchmark_cmd(args.workers, args.scale)
+      pass
+    case "chunk":
+      chunk_benchmark_cmd(args.workers, args.scale)
+      pass
+    case "startup":
+      startup_benchmark_cmd(args.repeat)
+      pass
+    case _:
+      parser.print_help()
+
+
+if __name__ == "__main__":
+  main()
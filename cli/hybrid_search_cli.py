@@ -9,7 +9,10 @@ project_root = Path(__file__).resolve().parent.parent
 if str(project_root) not in sys.path:
   sys.path.insert(0, str(project_root))
 
-from cli.lib.hybrid_search import normalize_cmd,  weighted_search_cmd
+from cli.lib.search_utils import DEFAULT_NPROBE, QUANTIZATIONS
+
+# command modules are imported by their case below, so a command only pays
+# for numpy, the indexes or the model when it uses them
 
 def main() -> None:
   parser = argparse.ArgumentParser(description="Hybrid Search CLI")
@@ -25,19 +28,24 @@ def main() -> None:
   weighted_search_parser.add_argument("query", type=str, help="Input query to search for")
   weighted_search_parser.add_argument("--alpha", type=float, default=0.5, help="Dynamically control the weighting between the two scores (default: 0.5)")
   weighted_search_parser.add_argument("--limit", type=int, default=5, help="Number of results to show (default: 5)")
+  weighted_search_parser.add_argument("--engine", choices=["exact", "ivf"], default="exact", help="Semantic side: score every chunk, or only the closest IVF lists (default: exact)")
+  weighted_search_parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help=f"IVF lists scanned per query (default: {DEFAULT_NPROBE})")
+  weighted_search_parser.add_argument("--quantization", choices=QUANTIZATIONS, help="Semantic side: search compressed chunk embeddings, rescoring a shortlist exactly")
   
   args = parser.parse_args()
 
   match args.command:
     case "normalize":
+      from cli.lib.hybrid_search import normalize_cmd
       inputs = args.inputs
       normalize_cmd(inputs)
       pass
     case "weighted-search":
+      from cli.lib.hybrid_search import weighted_search_cmd
       query = args.query
       alpha = args.alpha
       limit = args.limit
-      weighted_search_cmd(query, alpha, limit)
+      weighted_search_cmd(query, alpha, limit, args.engine, args.nprobe, args.quantization)
       pass
     case _:
       parser.print_help()
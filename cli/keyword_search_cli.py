@@ -12,17 +12,35 @@ project_root = Path(__file__).resolve().parent.parent
 if str(project_root) not in sys.path:
   sys.path.insert(0, str(project_root))
 
-from cli.lib.search_utils import BM25_B, BM25_K1
-from cli.lib.search_keyword import bm25_search_cmd, bm25idf_cmd, bm25tf_cmd, build_cmd, inverse_document_frequency_cmd, search_cmd, term_frequency_cmd, tf_idf_cmd
+from cli.lib.search_utils import BM25_B, BM25_K1, DEFAULT_FIELD_WEIGHTS, DEFAULT_SEARCH_LIMIT
+
+# command modules are imported by their case below, so a command only pays
+# for numpy, the indexes or the model when it uses them
 
 def main() -> None:
   parser = argparse.ArgumentParser(description="Keyword Search CLI")
   subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-  search_parser = subparsers.add_parser("search", help="Search movies using BM25")
-  search_parser.add_argument("query", type=str, help="Search query")
+  search_parser = subparsers.add_parser("search", help="Search movies matching a Boolean query (AND, OR, NOT, parentheses, \"phrases\")")
+  search_parser.add_argument("query", type=str, help="Search query, adjacent terms are ANDed")
+  search_parser.add_argument("limit", type=int, nargs='?', default=DEFAULT_SEARCH_LIMIT, help="Limit the num of results")
+
+  autocomplete_parser = subparsers.add_parser("autocomplete", help="Suggest title words and top movie titles for partially typed input")
+  autocomplete_parser.add_argument("prefix", type=str, help="Typed input, its last word may be incomplete")
+  autocomplete_parser.add_argument("limit", type=int, nargs='?', default=DEFAULT_SEARCH_LIMIT, help="Limit the num of suggestions")
+
+  build_parser = subparsers.add_parser("build", help="build project inverted index")
+  build_parser.add_argument("--workers", type=int, default=1, help="Processes to tokenize and index with (default: 1)")
+  build_parser.add_argument("--positions", action="store_true", help="Record token positions, needed for phrase search")
+  subparsers.add_parser("convert", help="convert the legacy pickled index to the binary format")
+
+  ingest_parser = subparsers.add_parser("ingest", help="Add or replace movies from a JSON file without rebuilding")
+  ingest_parser.add_argument("path", type=str, help="JSON file with a list of movies or {\"movies\": [...]}")
 
-  subparsers.add_parser("build", help="build project inverted index")
+  delete_parser = subparsers.add_parser("delete", help="Remove movies from the index by ID")
+  delete_parser.add_argument("doc_ids", type=int, nargs="+", help="Document IDs to remove")
+
+  subparsers.add_parser("compact", help="Merge ingested segments and deletions into the base index")
   
   tf_parser = subparsers.add_parser("tf", help="Print term frequency at certain doc")
   tf_parser.add_argument("doc_id", type=int, help="Document Id")
@@ -49,18 +67,59 @@ def main() -> None:
   bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
   bm25search_parser.add_argument("query", type=str, help="Search query")
   bm25search_parser.add_argument("limit", type=int, nargs='?', default=5, help="Limit the num of results")
+  bm25search_parser.add_argument(
+    "--engine",
+    choices=["wand", "exhaustive", "matrix"],
+    default="wand",
+    help="Scoring engine: WAND pruning, every posting, or NumPy CSR matrix (default: wand)"
+  )
+  bm25search_parser.add_argument("--fuzzy", action="store_true", help="Also search likely corrections of unknown (misspelled) terms")
+  bm25search_parser.add_argument("--stats", action="store_true", help="Print how many postings were scored")
+
+  bm25fsearch_parser = subparsers.add_parser("bm25fsearch", help="Search movies using BM25F, weighting title and description hits")
+  bm25fsearch_parser.add_argument("query", type=str, help="Search query")
+  bm25fsearch_parser.add_argument("limit", type=int, nargs='?', default=5, help="Limit the num of results")
+  bm25fsearch_parser.add_argument(
+    "--title-weight", type=float, default=DEFAULT_FIELD_WEIGHTS["title"], help="Weight of title matches"
+  )
+  bm25fsearch_parser.add_argument(
+    "--description-weight", type=float, default=DEFAULT_FIELD_WEIGHTS["description"], help="Weight of description matches"
+  )
+  bm25fsearch_parser.add_argument("--stats", action="store_true", help="Print how many postings were scored")
+
+  phrase_parser = subparsers.add_parser("phrase", help="Search movies containing an exact phrase, ranked by BM25")
+  phrase_parser.add_argument("phrase", type=str, help="Phrase to search for")
+  phrase_parser.add_argument("limit", type=int, nargs='?', default=5, help="Limit the num of results")
+  phrase_parser.add_argument("--slop", type=int, default=0, help="Extra tokens allowed between the phrase terms (default: 0)")
+  phrase_parser.add_argument("--stats", action="store_true", help="Print how many candidates were checked")
   args = parser.parse_args()
 
   match args.command:
     case "search":
+      from cli.lib.boolean_query import QueryError
+      from cli.lib.search_keyword import search_cmd
       query = args.query
       print(f"Searching for: {query}")
-      results = search_cmd(query)
+      try:
+        results = search_cmd(query, args.limit)
+      except QueryError as e:
+        print(f"Error: {e}")
+        results = []
       
       for i, movie in enumerate(results,1):
         print(f"{i}. {movie["title"]} ID:{movie["id"]}")
       pass
+    case "autocomplete":
+      from cli.lib.search_keyword import autocomplete_cmd
+      words, results = autocomplete_cmd(args.prefix, args.limit)
+
+      if words:
+        print(f"Words: {", ".join(words)}")
+      for i, doc in enumerate(results,1):
+        print(f"{i}. {doc["movie"]["title"]} ID:{doc["id"]}")
+      pass
     case "tf":
+      from cli.lib.search_keyword import term_frequency_cmd
       doc_id = args.doc_id
       term = args.term
       # print(f"Searching for: {query}")
@@ -68,12 +127,14 @@ def main() -> None:
       print(result)
       pass
     case "idf":
+      from cli.lib.search_keyword import inverse_document_frequency_cmd
       term = args.term
       idf = inverse_document_frequency_cmd(term)
 
       print(f"Inverse document frequency of '{term}': {idf:.2f}")
       pass
     case "tfidf":
+      from cli.lib.search_keyword import tf_idf_cmd
       doc_id = args.doc_id
       term = args.term
       tf_idf = tf_idf_cmd(doc_id,term)
@@ -81,12 +142,14 @@ def main() -> None:
       print(f"TF-IDF score of '{term}' in document '{doc_id}': {tf_idf:.2f}")
       pass
     case "bm25idf":
+      from cli.lib.search_keyword import bm25idf_cmd
       term = args.term
       bm25idf = bm25idf_cmd(term)
 
       print(f"BM25 IDF score of '{term}': {bm25idf:.2f}")
       pass
     case "bm25tf":
+      from cli.lib.search_keyword import bm25tf_cmd
       doc_id = args.doc_id
       term = args.term
       k1 = args.k1
@@ -97,18 +160,68 @@ def main() -> None:
       pass
       
     case "bm25search":
+      from cli.lib.search_keyword import bm25_search_cmd
       query = args.query
       limit = args.limit
-      results = bm25_search_cmd(query, limit)
+      results, stats = bm25_search_cmd(query, limit, args.engine, args.fuzzy)
 
+      for term, corrections in stats["corrections"].items():
+        print(f"'{term}' is not in the index, also searching: {", ".join(corrections) or "(no close terms)"}")
       for i, doc in enumerate(results,1): 
         print(f"{i}. ({doc["id"]}) {doc["movie"]["title"]} - Score: {doc["score"]:.2f}")
+      
+      if args.stats:
+        print(f"Postings scored: {stats["postings_scored"]} of {stats["postings_total"]}")
+      pass
+    case "bm25fsearch":
+      from cli.lib.search_keyword import bm25f_search_cmd
+      field_weights = {"title": args.title_weight, "description": args.description_weight}
+      results, stats = bm25f_search_cmd(args.query, args.limit, field_weights)
+
+      for i, doc in enumerate(results,1): 
+        print(f"{i}. ({doc["id"]}) {doc["movie"]["title"]} - Score: {doc["score"]:.2f}")
+      
+      if args.stats:
+        print(f"Postings scored: {stats["postings_scored"]} of {stats["postings_total"]}")
+      pass
+    case "phrase":
+      from cli.lib.search_keyword import phrase_search_cmd
+      results, stats = phrase_search_cmd(args.phrase, args.limit, args.slop)
+
+      for i, doc in enumerate(results,1): 
+        print(f"{i}. ({doc["id"]}) {doc["movie"]["title"]} - Score: {doc["score"]:.2f}")
+      
+      if args.stats:
+        print(f"Candidates checked: {stats["candidates"]}, matches: {stats["matches"]}")
       pass
     case "build":
+      from cli.lib.search_keyword import build_cmd
       print("Building inverted index...")
-      build_cmd()
+      build_cmd(args.workers, args.positions)
       print("Inverted index built successfully.")
       pass
+    case "ingest":
+      from cli.lib.search_keyword import ingest_cmd
+      count = ingest_cmd(args.path)
+      print(f"Ingested {count} movies.")
+      pass
+    case "delete":
+      from cli.lib.search_keyword import delete_cmd
+      count = delete_cmd(args.doc_ids)
+      print(f"Deleted {count} movies.")
+      pass
+    case "compact":
+      from cli.lib.search_keyword import compact_cmd
+      print("Compacting index segments...")
+      compact_cmd()
+      print("Index compacted successfully.")
+      pass
+    case "convert":
+      from cli.lib.search_keyword import convert_cmd
+      print("Converting pickled index...")
+      convert_cmd()
+      print("Inverted index converted successfully.")
+      pass
     case _:
       parser.print_help()
 
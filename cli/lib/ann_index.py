@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+
+from .search_utils import CHUNK_EMBEDDINGS_PATH, CHUNK_IVF_PATH, DEFAULT_NPROBE
+
+KMEANS_ITERATIONS = 10
+# k-means trains on at most this many vectors per list
+TRAINING_SAMPLES_PER_LIST = 256
+# rows scored against the centroids at once while assigning
+ASSIGN_BATCH = 1 << 16
+
+
+def default_num_lists(num_vectors: int) -> int:
+  return max(1, min(num_vectors, int(4 * np.sqrt(num_vectors))))
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+  """Closest centroid (highest dot product) of each unit vector."""
+  lists = np.empty(len(vectors), dtype=np.int32)
+  for start in range(0, len(vectors), ASSIGN_BATCH):
+    block = vectors[start:start + ASSIGN_BATCH]
+    lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+  return lists
+
+
+def train_centroids(vectors: np.ndarray, num_lists: int, seed: int = 0) -> np.ndarray:
+  """
+  Spherical k-means: centroids are unit-length means of their members, so
+  the closest centroid of a unit vector is the one with the highest dot
+  product, the same similarity the search uses. Empty lists are reseeded
+  with a random vector.
+  """
+  rng = np.random.default_rng(seed)
+  sample_size = min(len(vectors), num_lists * TRAINING_SAMPLES_PER_LIST)
+  sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))].astype(np.float32)
+  centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+
+  for _ in range(KMEANS_ITERATIONS):
+    lists = assign(sample, centroids)
+    sums = np.zeros_like(centroids)
+    np.add.at(sums, lists, sample)
+    norms = np.linalg.norm(sums, axis=1, keepdims=True)
+    empty = norms[:, 0] == 0
+    centroids = sums / np.where(empty[:, None], 1, norms)
+    centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+  return centroids.astype(np.float32)
+
+
+class IVFIndex:
+  """
+  IVF-Flat index over unit-length chunk embeddings. k-means splits the
+  vectors into inverted lists around centroids; a query scans only the
+  nprobe lists whose centroids are closest to it and scores their vectors
+  exactly. Recall against exact search grows with nprobe.
+
+  Lists are stored CSR-style: the vector ids of list l are
+  vector_ids[indptr[l]:indptr[l + 1]].
+  """
+  def __init__(self, centroids: np.ndarray, indptr: np.ndarray, vector_ids: np.ndarray):
+    self.centroids = centroids
+    self.indptr = indptr
+    self.vector_ids = vector_ids
+
+  @property
+  def num_lists(self) -> int:
+    return len(self.centroids)
+
+  @classmethod
+  def train(cls, vectors: np.ndarray, num_lists: int | None = None) -> "IVFIndex":
+    if num_lists is None:
+      num_lists = default_num_lists(len(vectors))
+    centroids = train_centroids(vectors, num_lists)
+    lists = assign(vectors, centroids)
+
+    # stable, so ids within a list stay in increasing order
+    vector_ids = np.argsort(lists, kind="stable").astype(np.int32)
+    indptr = np.zeros(num_lists + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(lists, minlength=num_lists))
+    return cls(centroids, indptr, vector_ids)
+
+  @classmethod
+  def load_or_create(cls, vectors: np.ndarray) -> "IVFIndex":
+    """
+    Loads the index saved next to the chunk embeddings if it was trained on
+    the current file, otherwise trains and saves it.
+    """
+    stat = os.stat(CHUNK_EMBEDDINGS_PATH)
+    stamp = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    if os.path.exists(CHUNK_IVF_PATH):
+      with np.load(CHUNK_IVF_PATH) as f:
+        if np.array_equal(f["embeddings_stamp"], stamp):
+          return cls(f["centroids"], f["indptr"], f["vector_ids"])
+
+    index = cls.train(vectors)
+    with open(CHUNK_IVF_PATH, "wb") as f:
+      np.savez(
+        f,
+        centroids=index.centroids,
+        indptr=index.indptr,
+        vector_ids=index.vector_ids,
+        embeddings_stamp=stamp,
+      )
+    return index
+
+  def search(self, vectors: np.ndarray, query: np.ndarray, nprobe: int = DEFAULT_NPROBE) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (ids, scores) of the vectors in the nprobe lists closest to query,
+    scored exactly by dot product. nprobe is clamped to [1, num_lists].
+    """
+    nprobe = max(1, min(nprobe, self.num_lists))
+    probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+    ids = np.concatenate([self.vector_ids[self.indptr[l]:self.indptr[l + 1]] for l in probed])
+    return ids, vectors[ids].astype(np.float32, copy=False) @ query
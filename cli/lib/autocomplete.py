@@ -0,0 +1,239 @@
+import bisect
+import heapq
+import os
+
+import numpy as np
+
+from .search_utils import AUTOCOMPLETE_PATH, INDEX_PATH
+
+# documents carrying this field rank by it, highest first; without it (the
+# movies catalog has none) titles rank in catalog order
+PRIOR_FIELD = "popularity"
+# prefixes matching more words than this get their best titles and words
+# stored, so no lookup merges more than this many words' lists
+PREFIX_TABLE_MIN_WORDS = 16
+# titles and words stored per prefix, more than any suggestion list shows
+PREFIX_TOP = 50
+
+
+def document_prior(doc: dict) -> float:
+  """Query-independent weight of a document: its PRIOR_FIELD, 0 without one."""
+  return float(doc.get(PRIOR_FIELD) or 0)
+
+
+def _csr(lists: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+  indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+  indptr[1:] = np.cumsum([len(values) for values in lists])
+  values = np.fromiter((value for values in lists for value in values), dtype=np.int64, count=int(indptr[-1]))
+  return indptr, values
+
+
+def _word_range(words: list[str], prefix: str) -> tuple[int, int]:
+  lo = bisect.bisect_left(words, prefix)
+  # every word starting with prefix sorts below prefix + the last code point
+  hi = bisect.bisect_left(words, prefix + "\U0010ffff", lo)
+  return lo, hi
+
+
+class TitleCompleter:
+  """
+  Prefix dictionary over the words of movie titles (lowercased, punctuation
+  stripped, not stemmed so partial input still matches). Words are a sorted
+  array, so the words starting with a prefix are one contiguous range found
+  with two binary searches.
+
+  Titles are ranked once, by document_prior and then catalog order, and
+  referred to by rank: each word lists the ranks of the titles with it in
+  ascending order, so the best titles for a prefix are the smallest ranks
+  in its range's lists. Prefixes matching more than PREFIX_TABLE_MIN_WORDS
+  words store their PREFIX_TOP best titles and words, so a lookup reads a
+  table row or merges a few short lists. Words that must appear before the
+  prefix narrow the titles first, each title's sorted word ids then tell
+  whether it has a word in the prefix's range.
+  """
+  def __init__(
+    self,
+    words: list[str],
+    indptr: np.ndarray,
+    ranks: np.ndarray,
+    ordinals: np.ndarray,
+    priors: np.ndarray,
+    title_indptr: np.ndarray,
+    title_words: np.ndarray,
+    prefixes: list[str],
+    prefix_titles: np.ndarray,
+    prefix_words: np.ndarray,
+  ):
+    self.words = words
+    # ranks of the titles with each word
+    self.indptr = indptr
+    self.ranks = ranks
+    # ordinal and prior of the title at each rank
+    self.ordinals = ordinals
+    self.priors = priors
+    # sorted word ids of the title at each rank
+    self.title_indptr = title_indptr
+    self.title_words = title_words
+    # (prefixes, PREFIX_TOP) best title ranks and word ids, padded with -1
+    self.prefixes = prefixes
+    self.prefix_titles = prefix_titles
+    self.prefix_words = prefix_words
+
+  @classmethod
+  def compile(cls, idx) -> "TitleCompleter":
+    live = [ordinal for ordinal in range(len(idx.doc_ids)) if ordinal not in idx.deleted]
+    docs = [idx.documents[ordinal] for ordinal in live]
+    # stable, so equal priors stay in catalog order
+    order = sorted(range(len(live)), key=lambda i: -document_prior(docs[i]))
+    titles = [sorted(set(idx.tokenizer.words(docs[i]["title"]))) for i in order]
+
+    words = sorted({word for title in titles for word in title})
+    word_ids = {word: i for i, word in enumerate(words)}
+    word_titles = [[] for _ in words]
+    for rank, title in enumerate(titles):
+      for word in title:
+        word_titles[word_ids[word]].append(rank)
+    indptr, ranks = _csr(word_titles)
+    # titles' words are sorted, so are their ids
+    title_indptr, title_words = _csr([[word_ids[word] for word in title] for title in titles])
+
+    counts = np.diff(indptr)
+    prefixes, prefix_titles, prefix_words = [], [], []
+    for prefix in sorted({word[:length] for word in words for length in range(1, len(word) + 1)}):
+      lo, hi = _word_range(words, prefix)
+      if hi - lo <= PREFIX_TABLE_MIN_WORDS:
+        continue
+      prefixes.append(prefix)
+      prefix_titles.append(np.unique(ranks[indptr[lo]:indptr[hi]])[:PREFIX_TOP])
+      ids = np.arange(lo, hi)
+      prefix_words.append(ids[np.lexsort((ids, -counts[lo:hi]))][:PREFIX_TOP])
+
+    def padded(rows: list[np.ndarray]) -> np.ndarray:
+      table = np.full((len(rows), PREFIX_TOP), -1, dtype=np.int64)
+      for i, row in enumerate(rows):
+        table[i, :len(row)] = row
+      return table
+
+    return cls(
+      words,
+      indptr,
+      ranks,
+      np.array([live[i] for i in order], dtype=np.int64),
+      np.array([document_prior(docs[i]) for i in order], dtype=np.float64),
+      title_indptr,
+      title_words,
+      prefixes,
+      padded(prefix_titles),
+      padded(prefix_words),
+    )
+
+  @classmethod
+  def load_or_create(cls, idx) -> "TitleCompleter":
+    """
+    Loads the cached dictionary if it was built from the current index.bin,
+    otherwise builds it. Segmented indexes are built in memory only, since
+    they change with every ingest.
+    """
+    if idx.segmented or not os.path.exists(INDEX_PATH):
+      return cls.compile(idx)
+
+    stat = os.stat(INDEX_PATH)
+    stamp = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    if os.path.exists(AUTOCOMPLETE_PATH):
+      with np.load(AUTOCOMPLETE_PATH) as f:
+        if np.array_equal(f["index_stamp"], stamp):
+          arrays = {name: f[name] for name in f.files if name not in ("words", "prefixes", "index_stamp")}
+          return cls(f["words"].tolist(), prefixes=f["prefixes"].tolist(), **arrays)
+
+    completer = cls.compile(idx)
+    with open(AUTOCOMPLETE_PATH, "wb") as f:
+      np.savez(
+        f,
+        words=np.array(completer.words, dtype=str),
+        indptr=completer.indptr,
+        ranks=completer.ranks,
+        ordinals=completer.ordinals,
+        priors=completer.priors,
+        title_indptr=completer.title_indptr,
+        title_words=completer.title_words,
+        prefixes=np.array(completer.prefixes, dtype=str),
+        prefix_titles=completer.prefix_titles,
+        prefix_words=completer.prefix_words,
+        index_stamp=stamp,
+      )
+    return completer
+
+  def word_range(self, prefix: str) -> tuple[int, int]:
+    return _word_range(self.words, prefix)
+
+  def complete_words(self, prefix: str, limit: int) -> list[str]:
+    """Title words starting with prefix, those in the most titles first."""
+    row = self.__table_row(prefix, limit)
+    if row is not None:
+      return [self.words[i] for i in self.prefix_words[row, :limit].tolist() if i >= 0]
+
+    lo, hi = self.word_range(prefix)
+    counts = self.indptr[lo + 1:hi + 1] - self.indptr[lo:hi]
+    best = heapq.nsmallest(limit, range(hi - lo), key=lambda i: (-counts[i], i))
+    return [self.words[lo + i] for i in best]
+
+  def complete(self, words: list[str], limit: int) -> list[tuple[int, float]]:
+    """
+    Best limit (ordinal, prior) titles containing words[:-1] as whole words
+    and a word starting with words[-1].
+    """
+    if len(words) == 0 or limit <= 0:
+      return []
+    if len(words) == 1:
+      ranks = self.__top_ranks(words[0], limit)
+    else:
+      ranks = self.__ranks_with(words[:-1], words[-1], limit)
+    return self.__results(ranks)
+
+  def match_any(self, prefixes: list[str], limit: int) -> list[tuple[int, float]]:
+    """Best limit titles with a word starting with any of prefixes."""
+    ranks = set()
+    for prefix in prefixes:
+      ranks.update(self.__top_ranks(prefix, limit))
+    return self.__results(sorted(ranks)[:limit])
+
+  def __results(self, ranks: list[int]) -> list[tuple[int, float]]:
+    return [(int(self.ordinals[rank]), float(self.priors[rank])) for rank in ranks]
+
+  def __table_row(self, prefix: str, limit: int) -> int | None:
+    """Row of prefix in the prefix table, if it has one that covers limit."""
+    i = bisect.bisect_left(self.prefixes, prefix)
+    if limit <= PREFIX_TOP and i < len(self.prefixes) and self.prefixes[i] == prefix:
+      return i
+    return None
+
+  def __top_ranks(self, prefix: str, limit: int) -> list[int]:
+    row = self.__table_row(prefix, limit)
+    if row is not None:
+      return [rank for rank in self.prefix_titles[row, :limit].tolist() if rank >= 0]
+
+    # at most PREFIX_TABLE_MIN_WORDS lists, unless limit is beyond the table
+    lo, hi = self.word_range(prefix)
+    return np.unique(self.ranks[self.indptr[lo]:self.indptr[hi]])[:limit].tolist()
+
+  def __titles_with(self, word: str) -> np.ndarray:
+    lo, hi = self.word_range(word)
+    if lo == hi or self.words[lo] != word:
+      return np.zeros(0, dtype=np.int64)
+    return self.ranks[self.indptr[lo]:self.indptr[lo + 1]]
+
+  def __ranks_with(self, required: list[str], prefix: str, limit: int) -> list[int]:
+    candidates = self.__titles_with(required[0])
+    for word in required[1:]:
+      candidates = np.intersect1d(candidates, self.__titles_with(word), assume_unique=True)
+
+    lo, hi = self.word_range(prefix)
+    found = []
+    for rank in candidates.tolist():
+      title_words = self.title_words[self.title_indptr[rank]:self.title_indptr[rank + 1]]
+      i = np.searchsorted(title_words, lo)
+      if i < len(title_words) and title_words[i] < hi:
+        found.append(rank)
+        if len(found) == limit:
+          break
+    return found
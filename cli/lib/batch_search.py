@@ -0,0 +1,128 @@
+import json
+import sys
+import time
+
+from cli.lib.ann_index import DEFAULT_NPROBE
+from cli.lib.chunked_semantic_search import ChunkedSemanticSearch
+from cli.lib.doc_store import load_documents
+from cli.lib.hybrid_search import HybridSearch
+from cli.lib.search_keyword import InvertedIndex
+from cli.lib.semantic_search import SemanticSearch
+
+
+def read_queries(path: str) -> list[str]:
+  """One query per line, blank lines skipped; "-" reads stdin."""
+  f = sys.stdin if path == "-" else open(path, "r")
+  try:
+    return [line.strip() for line in f if len(line.strip()) > 0]
+  finally:
+    if f is not sys.stdin:
+      f.close()
+
+
+def write_jsonl(path: str | None, queries: list[str], batch: list[list[dict]]) -> None:
+  """One {"query", "results"} object per line, to stdout without a path."""
+  f = sys.stdout if path is None else open(path, "w")
+  try:
+    for query, results in zip(queries, batch):
+      f.write(json.dumps({"query": query, "results": results}, ensure_ascii=False) + "\n")
+  finally:
+    if f is not sys.stdout:
+      f.close()
+
+
+def _report(queries: list[str], elapsed: float, ss: SemanticSearch | None = None) -> None:
+  # on stderr, so the JSONL can go to stdout
+  print(f"{len(queries)} queries in {elapsed:.2f}s ({len(queries) / max(elapsed, 1e-9):,.0f} queries/s)", file=sys.stderr)
+  if ss is not None:
+    print(f"Query cache: {ss.query_cache.stats()}", file=sys.stderr)
+
+
+def bm25_batch_cmd(queries_path: str, output_path: str | None, limit: int) -> None:
+  queries = read_queries(queries_path)
+  idx = InvertedIndex()
+  idx.load()
+
+  start = time.perf_counter()
+  batch = idx.bm25_search_many(queries, limit)
+  elapsed = time.perf_counter() - start
+
+  write_jsonl(output_path, queries, [
+    [{"rank": rank, "id": r["id"], "title": r["movie"]["title"], "score": r["score"]} for rank, r in enumerate(results, 1)]
+    for results in batch
+  ])
+  _report(queries, elapsed)
+
+
+def semantic_batch_cmd(queries_path: str, output_path: str | None, limit: int, quantization: str | None = None) -> None:
+  queries = read_queries(queries_path)
+  ss = SemanticSearch(quantization)
+  documents = load_documents()
+  ss.load_or_create_embeddings(documents)
+
+  start = time.perf_counter()
+  batch = ss.search_many(queries, limit)
+  elapsed = time.perf_counter() - start
+
+  write_jsonl(output_path, queries, [
+    [{"rank": rank, "id": documents[r["doc_id"]]["id"], "title": r["title"], "score": r["score"]} for rank, r in enumerate(results, 1)]
+    for results in batch
+  ])
+  _report(queries, elapsed, ss)
+
+
+def chunked_batch_cmd(
+  queries_path: str,
+  output_path: str | None,
+  limit: int,
+  engine: str = "exact",
+  nprobe: int = DEFAULT_NPROBE,
+  quantization: str | None = None,
+) -> None:
+  queries = read_queries(queries_path)
+  css = ChunkedSemanticSearch(quantization)
+  documents = load_documents()
+  css.load_or_create_chunk_embeddings(documents)
+
+  start = time.perf_counter()
+  batch = css.search_chunks_many(queries, limit, engine, nprobe)
+  elapsed = time.perf_counter() - start
+
+  write_jsonl(output_path, queries, [
+    [{"rank": rank, "id": documents[r["doc_id"]]["id"], "title": r["title"], "score": r["score"]} for rank, r in enumerate(results, 1)]
+    for results in batch
+  ])
+  _report(queries, elapsed, css)
+
+
+def hybrid_batch_cmd(
+  queries_path: str,
+  output_path: str | None,
+  alpha: float,
+  limit: int,
+  engine: str = "exact",
+  nprobe: int = DEFAULT_NPROBE,
+  quantization: str | None = None,
+) -> None:
+  queries = read_queries(queries_path)
+  hs = HybridSearch(load_documents(), quantization)
+
+  start = time.perf_counter()
+  batch = hs.weighted_search_many(queries, alpha, limit, engine, nprobe)
+  elapsed = time.perf_counter() - start
+
+  write_jsonl(output_path, queries, [
+    [
+      {
+        "rank": rank,
+        "doc_id": r["doc_id"],
+        "title": r["title"],
+        "hybrid_score": r["hybrid_score"],
+        "keyword_score": r["keyword_score"],
+        "semantic_score": r["semantic_score"],
+      }
+      for rank, r in enumerate(results, 1)
+    ]
+    for results in batch
+  ])
+  _report(queries, elapsed, hs.semantic_search)
@@ -0,0 +1,159 @@
+import os
+import subprocess
+import sys
+import time
+
+from cli.lib.chunking import iter_chunks
+from cli.lib.index_build import build_postings
+from cli.lib.search_keyword import tokenize_text
+from cli.lib.search_utils import PROJECT_ROOT, load_movies, load_stop_words
+from cli.lib.tokenizer import Tokenizer
+
+# a run of a command that needs neither the indexes nor the model should
+# stay well under this; the others go over it by what their imports, opening
+# the index or loading the model cost
+STARTUP_BUDGET_MS = 100
+# modules worth seconds (torch) or a good part of the budget (numpy)
+HEAVY_MODULES = ("numpy", "torch", "sentence_transformers")
+STARTUP_TEXT = "The first sentence. A second one! And a third?"
+STARTUP_QUERY = "space"
+STARTUP_DOC_ID = "1"
+# argv run per CLI subcommand, against the built indexes and embeddings. The
+# batch commands read STARTUP_QUERY from stdin. Commands that write the
+# indexes or embeddings are left out, and phrase, which needs an index built
+# with positions; one --help run times the keyword CLI's imports and parsing
+# alone
+STARTUP_COMMANDS = {
+  "keyword_search_cli.py": [
+    ["build", "--help"],
+    ["search", STARTUP_QUERY],
+    ["autocomplete", STARTUP_QUERY[0]],
+    ["tf", STARTUP_DOC_ID, STARTUP_QUERY],
+    ["idf", STARTUP_QUERY],
+    ["tfidf", STARTUP_DOC_ID, STARTUP_QUERY],
+    ["bm25idf", STARTUP_QUERY],
+    ["bm25tf", STARTUP_DOC_ID, STARTUP_QUERY],
+    ["bm25search", STARTUP_QUERY],
+    ["bm25fsearch", STARTUP_QUERY],
+  ],
+  "semantic_search_cli.py": [
+    ["chunk", STARTUP_TEXT, "--chunk-size", "3"],
+    ["semantic_chunk", STARTUP_TEXT, "--max-chunk-size", "2", "--overlap", "1"],
+    ["query_cache"],
+    ["verify"],
+    ["embed_text", STARTUP_TEXT],
+    ["embedquery", STARTUP_QUERY],
+    ["search", STARTUP_QUERY],
+    ["search_chunked", STARTUP_QUERY],
+  ],
+  "hybrid_search_cli.py": [["normalize", "0.5", "1", "2"], ["weighted-search", STARTUP_QUERY]],
+  "batch_search_cli.py": [[command, "-"] for command in ("bm25", "semantic", "chunked", "hybrid")],
+}
+
+
+def _timed(fn, *args):
+  start = time.perf_counter()
+  result = fn(*args)
+  return result, time.perf_counter() - start
+
+
+def tokenize_benchmark_cmd(repeat: int) -> None:
+  movies = load_movies()
+  texts = [f"{movie['title']} {movie['description']}" for movie in movies]
+  print(f"Tokenizing {len(texts)} movies, best of {repeat} runs")
+
+  def legacy():
+    stop_words = load_stop_words()
+    return [tokenize_text(text, stop_words) for text in texts]
+
+  legacy_time = float("inf")
+  for _ in range(repeat):
+    expected, elapsed = _timed(legacy)
+    legacy_time = min(legacy_time, elapsed)
+
+  # a fresh Tokenizer per run so the stem memo starts cold, like a build does
+  cold_time = float("inf")
+  for _ in range(repeat):
+    tokenizer = Tokenizer()
+    tokens, elapsed = _timed(tokenizer.tokenize_many, texts)
+    cold_time = min(cold_time, elapsed)
+
+  # queries reuse the process-wide tokenizer, so measure a warm memo as well
+  warm_time = float("inf")
+  for _ in range(repeat):
+    tokens, elapsed = _timed(tokenizer.tokenize_many, texts)
+    warm_time = min(warm_time, elapsed)
+
+  if tokens != expected:
+    raise ValueError("Tokenizer output differs from tokenize_text.")
+
+  total_tokens = sum(len(t) for t in tokens)
+  for name, elapsed in [("tokenize_text", legacy_time), ("Tokenizer (cold)", cold_time), ("Tokenizer (warm)", warm_time)]:
+    print(
+      f"{name:<18} {elapsed:8.3f}s  {total_tokens / elapsed:12,.0f} tokens/s"
+      f"  {legacy_time / elapsed:6.1f}x"
+    )
+  print(f"Stem cache: {tokenizer.cache_info()}")
+
+
+def build_benchmark_cmd(workers: list[int], scale: int) -> None:
+  movies = load_movies()
+  docs = [(movie["title"], movie["description"]) for movie in movies] * scale
+  print(f"Indexing {len(docs)} documents ({scale}x movies) on {os.cpu_count()} cores")
+
+  base_time = None
+  expected = None
+  for n in workers:
+    result, elapsed = _timed(build_postings, docs, n)
+    if expected is None:
+      expected = result
+    elif result != expected:
+      raise ValueError(f"Index built with {n} workers differs from the first run.")
+
+    if base_time is None:
+      base_time = elapsed * n
+    print(f"workers={n:<3} {elapsed:8.3f}s  {len(docs) / elapsed:10,.0f} docs/s  efficiency {base_time / (elapsed * n):5.0%}")
+
+
+def chunk_benchmark_cmd(workers: list[int], scale: int) -> None:
+  movies = load_movies() * scale
+  print(f"Chunking {len(movies)} descriptions ({scale}x movies) on {os.cpu_count()} cores")
+
+  expected = None
+  for n in workers:
+    chunks, elapsed = _timed(lambda: list(iter_chunks(movies, 4, 1, workers=n)))
+    if expected is None:
+      expected = chunks
+    elif chunks != expected:
+      raise ValueError(f"Chunks made with {n} workers differ from the first run.")
+
+    total_chunks = sum(len(c) for _, c in chunks)
+    print(f"workers={n:<3} {elapsed:8.3f}s  {total_chunks / elapsed:12,.0f} chunks/s  {len(movies) / elapsed:10,.0f} docs/s")
+
+
+def _heavy_imports(argv: list[str]) -> list[str]:
+  """HEAVY_MODULES imported by a run of argv, from python -X importtime."""
+  run = subprocess.run([sys.executable, "-X", "importtime"] + argv, input=STARTUP_QUERY, capture_output=True, text=True)
+  imported = {line.rsplit("|", 1)[-1].strip() for line in run.stderr.splitlines() if line.startswith("import time:")}
+  return [name for name in HEAVY_MODULES if name in imported]
+
+
+def startup_benchmark_cmd(repeat: int) -> None:
+  def best_ms(argv: list[str]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+      _, elapsed = _timed(lambda: subprocess.run([sys.executable] + argv, input=STARTUP_QUERY, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, text=True, check=True))
+      best = min(best, elapsed)
+    return best * 1000
+
+  print(f"Python itself: {best_ms(['-c', 'pass']):.1f}ms, budget {STARTUP_BUDGET_MS}ms, best of {repeat} runs")
+  slow = 0
+  for script, commands in STARTUP_COMMANDS.items():
+    path = os.path.join(PROJECT_ROOT, "cli", script)
+    for argv in commands:
+      ms = best_ms([path] + argv)
+      slow += ms >= STARTUP_BUDGET_MS
+      heavy = ", ".join(_heavy_imports([path] + argv)) or "-"
+      name = f"{argv[0]} --help" if "--help" in argv else argv[0]
+      print(f"{script:<23} {name:<20} {ms:8.1f}ms  {'ok' if ms < STARTUP_BUDGET_MS else 'SLOW':<4}  imports {heavy}")
+  print(f"{slow} commands over {STARTUP_BUDGET_MS}ms")
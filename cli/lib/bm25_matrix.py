@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+
+from .search_utils import BM25_K1, BM25_MATRIX_PATH, INDEX_PATH
+
+# upper bound on the (queries x docs) score block scored at once
+MAX_BATCH_CELLS = 1 << 24
+
+
+class BM25Matrix:
+  """
+  Term-document matrix of precomputed BM25 weights in CSR form: row r holds
+  the ordinals of the docs containing term r and idf * tf-saturation for each.
+  A query is a gather of its rows plus a weighted bincount, so scoring a
+  batch of queries is a handful of NumPy calls.
+
+  Weights are computed with the same float operations as InvertedIndex and
+  summed in query-term order, so scores equal the postings engines' scores.
+  """
+  def __init__(self, terms: list[str], indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, num_docs: int, excluded: np.ndarray):
+    self.terms = terms
+    self.rows = {term: row for row, term in enumerate(terms)}
+    self.indptr = indptr
+    self.indices = indices
+    self.data = data
+    self.num_docs = num_docs
+    # ordinals that must never be returned (tombstoned documents)
+    self.excluded = excluded
+
+  @classmethod
+  def compile(cls, idx) -> "BM25Matrix":
+    length_norms = np.asarray(idx.length_norms, dtype=np.float64)
+    terms = list(idx.postings)
+
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    indices_parts = []
+    data_parts = []
+    for row, term in enumerate(terms):
+      ordinals, tfs = idx.postings[term]
+      ordinals = np.asarray(ordinals, dtype=np.int32)
+      tfs = np.asarray(tfs, dtype=np.float64)
+      bm25tf = (tfs * (BM25_K1 + 1)) / (tfs + length_norms[ordinals])
+      indices_parts.append(ordinals)
+      data_parts.append(idx.idf[term] * bm25tf)
+      indptr[row + 1] = indptr[row] + len(ordinals)
+
+    indices = np.concatenate(indices_parts) if indices_parts else np.zeros(0, dtype=np.int32)
+    data = np.concatenate(data_parts) if data_parts else np.zeros(0, dtype=np.float64)
+    excluded = np.array(sorted(idx.deleted), dtype=np.int64)
+    return cls(terms, indptr, indices, data, len(idx.doc_ids), excluded)
+
+  @classmethod
+  def load_or_create(cls, idx) -> "BM25Matrix":
+    """
+    Loads the cached matrix if it was compiled from the current index.bin,
+    otherwise compiles it. Indexes with delta segments are compiled in memory
+    only, since they change with every ingest.
+    """
+    if idx.segmented or not os.path.exists(INDEX_PATH):
+      return cls.compile(idx)
+
+    stat = os.stat(INDEX_PATH)
+    stamp = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    if os.path.exists(BM25_MATRIX_PATH):
+      with np.load(BM25_MATRIX_PATH) as f:
+        if np.array_equal(f["index_stamp"], stamp):
+          return cls(f["terms"].tolist(), f["indptr"], f["indices"], f["data"], int(f["num_docs"]), f["excluded"])
+
+    matrix = cls.compile(idx)
+    with open(BM25_MATRIX_PATH, "wb") as f:
+      np.savez(
+        f,
+        terms=np.array(matrix.terms, dtype=str),
+        indptr=matrix.indptr,
+        indices=matrix.indices,
+        data=matrix.data,
+        num_docs=matrix.num_docs,
+        excluded=matrix.excluded,
+        index_stamp=stamp,
+      )
+    return matrix
+
+  def score_many(self, queries: list[list[tuple[str, float]]]) -> np.ndarray:
+    """
+    Scores every document for each query, given as (term, weight) pairs.
+    Returns a (queries, docs) array.
+    """
+    cells = []
+    weights = []
+    for q, terms in enumerate(queries):
+      offset = q * self.num_docs
+      for t, weight in terms:
+        row = self.rows.get(t)
+        if row is None:
+          continue
+        start, end = self.indptr[row], self.indptr[row + 1]
+        cells.append(self.indices[start:end].astype(np.int64) + offset)
+        weights.append(self.data[start:end] if weight == 1.0 else weight * self.data[start:end])
+
+    size = len(queries) * self.num_docs
+    if len(cells) == 0:
+      return np.zeros((len(queries), self.num_docs), dtype=np.float64)
+    # bincount adds weights in input order, i.e. in query-term order per doc
+    scores = np.bincount(np.concatenate(cells), weights=np.concatenate(weights), minlength=size)
+    return scores.reshape(len(queries), self.num_docs)
+
+  def top_k(self, scores: np.ndarray, limit: int) -> list[tuple[int, float]]:
+    """
+    Best limit (ordinal, score) pairs of one score row, ties broken by lower
+    ordinal like the postings engines (so zero scores pad in ordinal order).
+    """
+    scores = scores.copy()
+    scores[self.excluded] = -np.inf
+    limit = min(limit, self.num_docs - len(self.excluded))
+    if limit <= 0:
+      return []
+
+    if limit < self.num_docs:
+      kth = scores[np.argpartition(-scores, limit - 1)[limit - 1]]
+      candidates = np.flatnonzero(scores >= kth)
+    else:
+      candidates = np.arange(self.num_docs)
+
+    order = np.lexsort((candidates, -scores[candidates]))[:limit]
+    return [(int(o), float(scores[o])) for o in candidates[order]]
+
+  def search_many(self, queries: list[list[tuple[str, float]]], limit: int) -> list[list[tuple[int, float]]]:
+    batch_size = max(1, MAX_BATCH_CELLS // max(1, self.num_docs))
+    results = []
+    for start in range(0, len(queries), batch_size):
+      scores = self.score_many(queries[start:start + batch_size])
+      results.extend(self.top_k(row, limit) for row in scores)
+    return results
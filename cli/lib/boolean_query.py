@@ -0,0 +1,144 @@
+"""
+Boolean queries over the postings, e.g.
+
+  dark knight                   both terms (adjacent words are ANDed)
+  batman OR superman            either term
+  (alien OR predator) NOT space
+  "dark knight" gotham          a phrase, needs an index built with positions
+
+NOT binds tighter than AND, which binds tighter than OR. Words go through the
+index tokenizer, so stop words drop out of the query.
+
+A query compiles to a tree of lazy cursors (see postings), which yields
+matching ordinals in increasing order without materializing postings lists.
+"""
+import re
+
+from .postings import (
+  AllCursor,
+  IntersectionCursor,
+  ListCursor,
+  PhraseCursor,
+  UnionCursor,
+)
+from .tokenizer import Tokenizer
+
+OPERATORS = ("AND", "OR", "NOT")
+
+_QUERY_TOKEN = re.compile(r'"[^"]*"?|\(|\)|[^\s()"]+')
+
+
+class QueryError(ValueError):
+  """A query that does not parse, with a message fit to show the user."""
+
+
+def lex_query(query: str) -> list[str]:
+  return _QUERY_TOKEN.findall(query)
+
+
+class QueryParser:
+  """
+  Recursive descent parser producing nested tuples:
+  ("term", token), ("phrase", tokens), ("and", children), ("or", children)
+  and ("not", child). Parts made only of stop words parse to None.
+  """
+  def __init__(self, tokenizer: Tokenizer):
+    self.tokenizer = tokenizer
+
+  def parse(self, query: str):
+    self.tokens = lex_query(query)
+    self.pos = 0
+    node = self.__or_expression()
+    if self.pos < len(self.tokens):
+      raise QueryError(f"Invalid query: unexpected '{self.tokens[self.pos]}'.")
+    return node
+
+  def __peek(self) -> str | None:
+    return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+  def __or_expression(self):
+    children = [self.__and_expression()]
+    while self.__peek() == "OR":
+      self.pos += 1
+      children.append(self.__and_expression())
+    return _combine("or", children)
+
+  def __and_expression(self):
+    children = [self.__unary()]
+    while self.__peek() not in (None, "OR", ")"):
+      if self.__peek() == "AND":
+        self.pos += 1
+      children.append(self.__unary())
+    return _combine("and", children)
+
+  def __unary(self):
+    if self.__peek() == "NOT":
+      self.pos += 1
+      child = self.__unary()
+      return ("not", child) if child is not None else None
+    return self.__primary()
+
+  def __primary(self):
+    token = self.__peek()
+    if token is None or token in OPERATORS or token == ")":
+      raise QueryError(f"Invalid query: expected a term, got '{token or 'end of query'}'.")
+    self.pos += 1
+
+    if token == "(":
+      node = self.__or_expression()
+      if self.__peek() != ")":
+        raise QueryError("Invalid query: missing ')'.")
+      self.pos += 1
+      return node
+
+    if token.startswith('"'):
+      terms = self.tokenizer.tokenize(token.strip('"'))
+      if len(terms) == 0:
+        return None
+      return ("phrase", terms) if len(terms) > 1 else ("term", terms[0])
+
+    terms = self.tokenizer.tokenize(token)
+    return _combine("and", [("term", t) for t in terms])
+
+
+def _combine(operator: str, children: list):
+  children = [c for c in children if c is not None]
+  if len(children) == 0:
+    return None
+  if len(children) == 1:
+    return children[0]
+  return (operator, children)
+
+
+def compile_query(node, open_cursor, num_docs: int, with_positions: bool):
+  """
+  Cursor over the documents of one postings source matching node.
+  open_cursor(term) returns a term's cursor or None if it has no postings.
+  Without positions, phrases degrade to AND of their terms.
+  """
+  match node:
+    case ("term", term):
+      return open_cursor(term) or ListCursor([], [])
+    case ("phrase", terms):
+      cursors = {t: open_cursor(t) for t in dict.fromkeys(terms)}
+      if any(c is None for c in cursors.values()):
+        return ListCursor([], [])
+      if not with_positions:
+        return IntersectionCursor(list(cursors.values()))
+      return PhraseCursor(cursors, terms)
+    case ("and", children):
+      included = [c for c in children if c[0] != "not"]
+      excluded = [c[1] for c in children if c[0] == "not"]
+      compile_child = lambda child: compile_query(child, open_cursor, num_docs, with_positions)
+      return IntersectionCursor(
+        [compile_child(c) for c in included] or [AllCursor(num_docs)],
+        [compile_child(c) for c in excluded],
+      )
+    case ("or", children):
+      return UnionCursor([compile_query(c, open_cursor, num_docs, with_positions) for c in children])
+    case ("not", child):
+      return IntersectionCursor(
+        [AllCursor(num_docs)],
+        [compile_query(child, open_cursor, num_docs, with_positions)],
+      )
+  raise ValueError(f"Invalid query node: {node!r}")
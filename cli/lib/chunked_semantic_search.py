@@ -1,100 +1,232 @@
-import json
 import os
-import re
+import random
 import textwrap
+import time
+from array import array
+from collections.abc import Iterator, Sequence
 
 import numpy as np
-from cli.lib.search_utils import CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH, load_movies
-from cli.lib.semantic_search import SemanticSearch, cosine_similarity
+from cli.lib.ann_index import DEFAULT_NPROBE, IVFIndex
+from cli.lib.chunking import CHUNK_WORKERS, iter_chunks
+from cli.lib.doc_store import load_documents
+from cli.lib.embedding_file import EmbeddingFile
+from cli.lib.encoders import DEFAULT_ENCODER, Encoder, make_encoder
+from cli.lib.quantization import RESCORE_FACTOR, QuantizedEmbeddings, rescore
+from cli.lib.search_utils import CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH, EMBEDDINGS_PATH, QUANTIZATIONS
+from cli.lib.semantic_search import (
+  SemanticSearch,
+  build_embeddings_file,
+  dot_rows,
+  load_embeddings,
+  modified_since,
+  score_rows,
+  score_rows_many,
+  top_k_indices,
+)
+
+# descriptions are embedded in chunks of this many sentences, overlapping by
+# CHUNK_OVERLAP sentences
+CHUNK_MAX_SENTENCES = 4
+CHUNK_OVERLAP = 1
+# part of each chunk's content key, so changing the chunking re-embeds
+CHUNK_PARAMS = f"semantic_chunk:{CHUNK_MAX_SENTENCES}:{CHUNK_OVERLAP}"
+
+
+class ChunkMetadata:
+  """
+  Where each chunk embedding comes from, as int32 arrays: the movie, the
+  chunk's number within the movie's description and the movie's number of
+  chunks. Chunks are sorted by movie, so the chunks of a movie are one run
+  and per-movie reductions are segmented reductions over those runs.
+  """
+  def __init__(self, movie_idx: np.ndarray, chunk_idx: np.ndarray, total_chunks: np.ndarray):
+    self.movie_idx = movie_idx
+    self.chunk_idx = chunk_idx
+    self.total_chunks = total_chunks
+    # first chunk of each run, and the movie of the run
+    self.starts = run_starts(movie_idx)
+    self.movies = movie_idx[self.starts]
+
+  def __len__(self) -> int:
+    return len(self.movie_idx)
+
+  @classmethod
+  def load(cls, path: str) -> tuple["ChunkMetadata", str]:
+    """The metadata saved at path, with the chunking params it was made with."""
+    with np.load(path) as f:
+      return cls(f["movie_idx"], f["chunk_idx"], f["total_chunks"]), str(f["chunking"])
+
+  def save(self, path: str, chunking: str) -> None:
+    with open(path, "wb") as f:
+      np.savez(
+        f,
+        movie_idx=self.movie_idx,
+        chunk_idx=self.chunk_idx,
+        total_chunks=self.total_chunks,
+        chunking=np.array(chunking),
+      )
+
+
+def run_starts(values: np.ndarray) -> np.ndarray:
+  """Indices where a run of equal values begins in a sorted array."""
+  if len(values) == 0:
+    return np.zeros(0, dtype=np.int64)
+  return np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
 
 
 class ChunkedSemanticSearch(SemanticSearch): 
-  def __init__(self) -> None:
-    super().__init__()
+  def __init__(self, quantization: str | None = None, encoder: Encoder | None = None) -> None:
+    super().__init__(quantization, encoder)
+    # unit-length rows memory-mapped like the movie embeddings
     self.chunk_embeddings = None
-    self.chunk_metadata = None
+    self.quantized_chunks: QuantizedEmbeddings | None = None
+    self.chunk_metadata: ChunkMetadata | None = None
+    self.__ivf_index: IVFIndex | None = None
     
-  def build_chunk_embeddings(self, documents):
+  def build_chunk_embeddings(self, documents, float16: bool = False, workers: int = CHUNK_WORKERS):
+    """
+    Chunks and embeds the descriptions, encoding only the chunks whose text
+    is not already in the chunk embeddings file. The descriptions are
+    chunked once, by a process pool with several workers, and the chunks
+    stream into build_embeddings_file as they come back, which hashes and
+    encodes them (and makes an interrupted build resume) while the workers
+    split the next descriptions. The metadata is recorded on the way.
+    """
     self.documents = documents
-    for doc in documents:
-      self.document_map[doc["id"]] = doc
     
-    chunks = []
-    chunks_metadata = []
-    for doc_index, doc in enumerate(self.documents):
-      description = doc["description"].strip()
-      if len(description) > 0:
-        desc_chunks = semantic_chunk(description, 4, 1)
-        chunks.extend(desc_chunks)
-        for chunk_index, _ in enumerate(desc_chunks):
-          chunks_metadata.append({
-            "movie_idx": doc_index,
-            "chunk_idx": chunk_index,
-            "total_chunks": len(desc_chunks)
-          })
-          
-          
-    print(f"total_chunks: {len(chunks)}")      
-    self.chunk_embeddings = self.model.encode(chunks, show_progress_bar=True)
-    self.chunk_metadata = chunks_metadata
-        
-    with open(CHUNK_EMBEDDINGS_PATH, 'wb') as f:
-      np.save(f, self.chunk_embeddings)
+    # in movie order, which keeps the metadata sorted by movie
+    movie_idx, chunk_idx, total_chunks = array("i"), array("i"), array("i")
+    def chunk_texts() -> Iterator[str]:
+      for doc_index, desc_chunks in iter_description_chunks(documents, workers=workers):
+        movie_idx.extend([doc_index] * len(desc_chunks))
+        chunk_idx.extend(range(len(desc_chunks)))
+        total_chunks.extend([len(desc_chunks)] * len(desc_chunks))
+        yield from desc_chunks
+    
+    start = time.perf_counter()
+    encoded = build_embeddings_file(CHUNK_EMBEDDINGS_PATH, self.encoder, chunk_texts(), CHUNK_PARAMS, np.float16 if float16 else np.float32)
+    elapsed = time.perf_counter() - start
+    self.chunk_metadata = ChunkMetadata(
+      np.frombuffer(movie_idx, dtype=np.int32),
+      np.frombuffer(chunk_idx, dtype=np.int32),
+      np.frombuffer(total_chunks, dtype=np.int32),
+    )
+    rows = len(self.chunk_metadata)
+    print(f"total_chunks: {rows}")
+    print(f"Encoded {encoded} new or changed chunks, reused {rows - encoded}")
+    print(f"Chunked and embedded in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} chunks/s, {workers} chunking workers)")
+    self.chunk_embeddings = EmbeddingFile(CHUNK_EMBEDDINGS_PATH).vectors
     
-    with open(CHUNK_METADATA_PATH, 'w') as f:
-      json.dump({"chunks": self.chunk_metadata, "total_chunks": len(chunks)}, f, indent=2)
+    # movie_idx can move with unchanged chunks, the metadata is always rewritten
+    self.chunk_metadata.save(CHUNK_METADATA_PATH, CHUNK_PARAMS)
       
     return self.chunk_embeddings
         
         
-  def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
+  def load_or_create_chunk_embeddings(self, documents: Sequence[dict], float16: bool = False, workers: int = CHUNK_WORKERS) -> np.ndarray:
     self.documents = documents
-    for doc in documents:
-      self.document_map[doc["id"]] = doc
     
-    if os.path.exists(CHUNK_EMBEDDINGS_PATH) and os.path.exists(CHUNK_METADATA_PATH):
-      with open(CHUNK_EMBEDDINGS_PATH, 'rb') as f:
-        self.chunk_embeddings = np.load(f)
+    self.chunk_embeddings = None
+    if os.path.exists(CHUNK_METADATA_PATH) and not modified_since(documents, CHUNK_EMBEDDINGS_PATH):
+      self.chunk_metadata, chunking = ChunkMetadata.load(CHUNK_METADATA_PATH)
+      if chunking == CHUNK_PARAMS:
+        self.chunk_embeddings = load_embeddings(CHUNK_EMBEDDINGS_PATH, len(self.chunk_metadata), self.encoder.name, float16)
 
-      with open(CHUNK_METADATA_PATH, 'r') as f:
-        data = json.load(f)
-        self.chunk_metadata = data.get("chunks", [])
-      
-      return self.chunk_embeddings
-      
+    if self.chunk_embeddings is None:
+      self.build_chunk_embeddings(documents, float16, workers)
     
-    return self.build_chunk_embeddings(documents)
+    if self.quantization is not None:
+      self.quantized_chunks = QuantizedEmbeddings.load_or_create(self.quantization, CHUNK_EMBEDDINGS_PATH, self.chunk_embeddings)
+    return self.chunk_embeddings
   
-  def search_chunks(self, query: str, limit: int = 10):
-    query_embedding = self.generate_embedding(query)
-        
-    scores = []
-    for i, chunk_embedding in enumerate(self.chunk_embeddings):
-      similarity_score = cosine_similarity(query_embedding,chunk_embedding)
-      chunk_meta = self.chunk_metadata[i]
-      scores.append({
-          "chunk_idx": chunk_meta["chunk_idx"],
-          "movie_idx": chunk_meta["movie_idx"],
-          "score": similarity_score
-      })
-    
-    movies_score_dic = {}
+  def ivf_index(self) -> IVFIndex:
+    if self.__ivf_index is None:
+      self.__ivf_index = IVFIndex.load_or_create(self.chunk_embeddings)
+    return self.__ivf_index
+
+  def search_chunks(self, query: str, limit: int = 10, engine: str = "exact", nprobe: int = DEFAULT_NPROBE):
+    """
+    Movies ranked by their best matching chunk. engine "exact" scores every
+    chunk (or with a quantization, the chunks of a shortlist of movies found
+    on the codes), "ivf"
+    only the chunks in the nprobe closest lists of the IVF index (see
+    ann_index), which may miss some of the exact results.
+    """
+    query_embedding = self.embed_query(query)
+    return self.__movie_results(self.__score_chunks(query_embedding, limit, engine, nprobe), limit)
+
+  def search_chunks_many(self, queries: list[str], limit: int = 10, engine: str = "exact", nprobe: int = DEFAULT_NPROBE) -> list[list[dict]]:
+    """
+    search_chunks for each of queries, embedded in one batch. The exact
+    engine scores them against the chunks by matrix products.
+    """
+    if len(queries) == 0:
+      return []
+    query_embeddings = self.embed_queries(queries)
+    if engine == "exact" and self.quantized_chunks is None:
+      scored = score_rows_many(self.chunk_embeddings, None, query_embeddings, limit)
+    else:
+      scored = (self.__score_chunks(query_embedding, limit, engine, nprobe) for query_embedding in query_embeddings)
+    return [self.__movie_results(scored_chunks, limit) for scored_chunks in scored]
+
+  def __score_chunks(self, query_embedding: np.ndarray, limit: int, engine: str, nprobe: int) -> tuple[np.ndarray, np.ndarray]:
+    match engine:
+      case "exact":
+        if self.quantized_chunks is not None:
+          return self.__shortlist_movies(query_embedding, limit)
+        return score_rows(self.chunk_embeddings, None, query_embedding, limit)
+      case "ivf":
+        return self.ivf_index().search(self.chunk_embeddings, query_embedding, nprobe)
+    raise ValueError(f"Unknown search engine '{engine}'.")
+
+  def __shortlist_movies(self, query_embedding: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Every chunk of the RESCORE_FACTOR * limit movies with the best
+    approximate scores, rescored. The shortlist is counted in movies, not
+    chunks, so it holds limit movies whenever the exact scan would.
+    """
+    metadata = self.chunk_metadata
+    if len(metadata) == 0:
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    approximate = self.quantized_chunks.approximate_scores(query_embedding)
+    runs = np.sort(top_k_indices(np.maximum.reduceat(approximate, metadata.starts), limit * RESCORE_FACTOR))
     
-    for score_item in scores:
-      movie_idx = score_item["movie_idx"]
-      chunk_score = score_item["score"]
-      if movie_idx not in movies_score_dic:
-        movies_score_dic[movie_idx] = chunk_score
-      elif chunk_score > movies_score_dic[movie_idx]:
-        movies_score_dic[movie_idx] = chunk_score
+    # the chunk ids of the chosen runs, ascending
+    starts = metadata.starts[runs]
+    lengths = np.append(metadata.starts[1:], len(metadata))[runs] - starts
+    ids = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return ids, rescore(self.chunk_embeddings, ids, query_embedding)
+
+  def __movie_scores(self, scored_chunks: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """
+    A movie scores as its best scored chunk; movies without one stay at
+    -inf. The chunks of a movie are adjacent once sorted by id, so the
+    maxima are one np.maximum.reduceat over the runs.
+    """
+    chunk_ids, chunk_scores = scored_chunks
+    movie_scores = np.full(len(self.documents), -np.inf, dtype=np.float32)
+    if len(chunk_ids) == 0:
+      return movie_scores
     
-    # Sort by value (score) in descending order
-    movies_sorted_by_score = sorted(movies_score_dic.items(), key=lambda item: item[1], reverse=True)
+    if len(chunk_ids) == len(self.chunk_metadata) and chunk_ids[0] == 0 and np.all(chunk_ids[1:] > chunk_ids[:-1]):
+      # every chunk in order, the runs are known
+      starts, movies = self.chunk_metadata.starts, self.chunk_metadata.movies
+    else:
+      order = np.argsort(chunk_ids)
+      chunk_scores = chunk_scores[order]
+      chunk_movies = self.chunk_metadata.movie_idx[chunk_ids[order]]
+      starts = run_starts(chunk_movies)
+      movies = chunk_movies[starts]
+    movie_scores[movies] = np.maximum.reduceat(chunk_scores, starts)
+    return movie_scores
+
+  def __movie_results(self, scored_chunks: tuple[np.ndarray, np.ndarray], limit: int) -> list[dict]:
+    movie_scores = self.__movie_scores(scored_chunks)
+    limit = min(limit, np.count_nonzero(movie_scores > -np.inf))
     
     results = []
-    for item in movies_sorted_by_score[:limit]:
-      movie_idx = item[0]
-      movie_score = item[1]
+    for movie_idx in top_k_indices(movie_scores, limit).tolist():
+      movie_score = float(movie_scores[movie_idx])
       doc = self.documents[movie_idx] 
       results.append({
         "score": movie_score,
@@ -104,54 +236,55 @@ class ChunkedSemanticSearch(SemanticSearch):
       })
       
     return results    
+
+  def ann_recall(self, queries: list[str], limit: int, nprobe: int) -> tuple[float, float, float]:
+    """
+    Mean fraction of the exact top limit movies the IVF engine also returns,
+    with the mean exact and IVF search times in seconds.
+    """
+    self.ivf_index()
+    recall = exact_time = ivf_time = 0.0
+    for query in queries:
+      query_embedding = self.embed_query(query)
+      start = time.perf_counter()
+      exact = self.__movie_results(self.__score_chunks(query_embedding, limit, "exact", nprobe), limit)
+      exact_time += time.perf_counter() - start
+      start = time.perf_counter()
+      found = self.__movie_results(self.__score_chunks(query_embedding, limit, "ivf", nprobe), limit)
+      ivf_time += time.perf_counter() - start
+      
+      expected = {r["doc_id"] for r in exact}
+      if len(expected) > 0:
+        recall += len(expected & {r["doc_id"] for r in found}) / len(expected)
+    return recall / len(queries), exact_time / len(queries), ivf_time / len(queries)
         
         
-def semantic_chunk(text: str, max_chunk_size: int, overlap: int):
-  # print(f"Semantically chunking {len(text)} characters")
-  
-  # remove leading and trailing whitespace
-  text = text.strip()
-  if len(text) == 0:
-    return []
-  
-  
-  raw_list_of_sentences = re.split(r"(?<=[.!?])\s+", text)
-  list_of_sentences = []
-  for s in raw_list_of_sentences:
-    # remove leading and trailing whitespace
-    sentence = s.strip()
-    if len(sentence) > 0:
-      list_of_sentences.append(sentence)
-  
-  chunks = []
-  if len(list_of_sentences) > 0:
-    chunk = " ".join(list_of_sentences[0:max_chunk_size])
-    chunks.append(chunk)
-    
-  start = max_chunk_size - overlap
-  while start+overlap < len(list_of_sentences):
-    end = start + max_chunk_size
-    chunk = " ".join(list_of_sentences[start:end])
-    chunks.append(chunk)
-    start = end - overlap
-    
-  return chunks
+def iter_description_chunks(documents: Sequence[dict], start: int = 0, workers: int = 1) -> Iterator[tuple[int, list[str]]]:
+  """(index, chunks) of each document from start whose description has chunks."""
+  return iter_chunks(documents, CHUNK_MAX_SENTENCES, CHUNK_OVERLAP, start, workers)
     
 
-def embed_chunks_cmd():
-  css = ChunkedSemanticSearch()
-  documents = load_movies()  
-  embeddings = css.load_or_create_chunk_embeddings(documents)
+def embed_chunks_cmd(float16: bool = False, workers: int = CHUNK_WORKERS, encoder: str = DEFAULT_ENCODER):
+  css = ChunkedSemanticSearch(encoder=make_encoder(encoder))
+  documents = load_documents()
+  embeddings = css.load_or_create_chunk_embeddings(documents, float16, workers)
 
-  print(f"Generated {len(embeddings)} chunked embeddings")
+  print(f"Generated {len(embeddings)} chunked embeddings ({embeddings.dtype})")
   
   
-def search_chunked_cmd(query: str, limit: int):
-  css = ChunkedSemanticSearch()
-  documents = load_movies()  
+def search_chunked_cmd(
+  query: str,
+  limit: int,
+  engine: str = "exact",
+  nprobe: int = DEFAULT_NPROBE,
+  quantization: str | None = None,
+  encoder: str = DEFAULT_ENCODER,
+):
+  css = ChunkedSemanticSearch(quantization, make_encoder(encoder))
+  documents = load_documents()
   css.load_or_create_chunk_embeddings(documents)
   
-  results = css.search_chunks(query, limit)
+  results = css.search_chunks(query, limit, engine, nprobe)
   
   for i, result in enumerate(results, 1):
     print(f"{i}. {result["title"]} (score: {result["score"]:.4f})")
@@ -164,4 +297,53 @@ def search_chunked_cmd(query: str, limit: int):
 
     print(f"   {short_desc}")
     print()
-    
\ No newline at end of file
+
+
+def sample_queries(documents: Sequence[dict], num_queries: int) -> list[str]:
+  # titles of random movies stand in for real queries
+  rng = random.Random(0)
+  return [documents[i]["title"] for i in rng.sample(range(len(documents)), min(num_queries, len(documents)))]
+
+
+def ann_recall_cmd(num_queries: int, limit: int, nprobes: list[int]):
+  css = ChunkedSemanticSearch()
+  documents = load_documents()
+  css.load_or_create_chunk_embeddings(documents)
+  
+  queries = sample_queries(documents, num_queries)
+  index = css.ivf_index()
+  print(f"IVF index: {index.num_lists} lists over {len(css.chunk_embeddings)} chunks, {len(queries)} queries, top {limit}")
+  
+  for nprobe in nprobes:
+    recall, exact_time, ivf_time = css.ann_recall(queries, limit, nprobe)
+    print(
+      f"nprobe={nprobe:<4} recall@{limit} {recall:6.1%}  "
+      f"exact {exact_time * 1000:7.2f}ms  ivf {ivf_time * 1000:7.2f}ms  {exact_time / ivf_time:5.1f}x"
+    )
+
+
+def quantization_recall_cmd(num_queries: int, limit: int):
+  css = ChunkedSemanticSearch()
+  documents = load_documents()
+  css.load_or_create_embeddings(documents)
+  css.load_or_create_chunk_embeddings(documents)
+  
+  query_embeddings = [css.embed_query(q) for q in sample_queries(documents, num_queries)]
+  print(f"{len(query_embeddings)} queries, top {limit}, shortlist {limit * RESCORE_FACTOR} rescored")
+  
+  for name, vectors, path in [("movies", css.embeddings, EMBEDDINGS_PATH), ("chunks", css.chunk_embeddings, CHUNK_EMBEDDINGS_PATH)]:
+    print(f"{name}: {len(vectors)} x {vectors.shape[1]} {vectors.dtype}, {vectors.nbytes / 2**20:.1f} MiB")
+    for kind in QUANTIZATIONS:
+      quantized = QuantizedEmbeddings.load_or_create(kind, path, vectors)
+      recall = search_time = 0.0
+      for query_embedding in query_embeddings:
+        expected = set(top_k_indices(dot_rows(vectors, query_embedding), limit).tolist())
+        start = time.perf_counter()
+        ids, scores = score_rows(vectors, quantized, query_embedding, limit)
+        found = set(ids[top_k_indices(scores, limit)].tolist())
+        search_time += time.perf_counter() - start
+        recall += len(expected & found) / max(1, len(expected))
+      print(
+        f"  {kind:<5} {quantized.nbytes / 2**20:7.2f} MiB  {vectors.nbytes / quantized.nbytes:5.1f}x smaller  "
+        f"recall@{limit} {recall / len(query_embeddings):6.1%}  {search_time / len(query_embeddings) * 1000:7.2f}ms"
+      )
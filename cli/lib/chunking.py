@@ -0,0 +1,134 @@
+"""
+Sentence chunking of descriptions for the chunk embeddings.
+
+A description is split after each ., ! or ? followed by whitespace, and its
+sentences are grouped in windows of max_chunk_size sentences, consecutive
+windows sharing overlap sentences. The window bounds are arithmetic on the
+sentence count, so a chunk is one join of a slice.
+
+iter_chunks can spread the work over a process pool: documents go out in
+batches of CHUNK_BATCH_DOCS, at most a few batches per worker in flight,
+and come back in document order as they complete. The caller encodes the
+chunks of one batch while the workers split the next ones.
+
+The module imports neither numpy nor the model, so the chunk commands start
+fast.
+"""
+from collections import deque
+from collections.abc import Iterator, Sequence
+import os
+import re
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+# documents chunked per task sent to a worker
+CHUNK_BATCH_DOCS = 256
+# tasks queued per worker, bounds the chunks held ahead of the consumer
+BATCHES_PER_WORKER = 2
+# the encoder wants most cores, chunking keeps a few
+CHUNK_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+
+def split_sentences(text: str) -> list[str]:
+  text = text.strip()
+  if len(text) == 0:
+    return []
+  # the split consumes all whitespace at a boundary, so sentences need no strip
+  return SENTENCE_BOUNDARY.split(text)
+
+
+def sentence_windows(sentences: list[str], max_chunk_size: int, overlap: int) -> list[str]:
+  """
+  Windows of max_chunk_size sentences starting every max_chunk_size -
+  overlap sentences, until a window would only repeat the previous one's
+  overlap.
+  """
+  if overlap >= max_chunk_size:
+    raise ValueError("Overlap must be smaller than the chunk size")
+  if len(sentences) == 0:
+    return []
+  starts = range(0, max(1, len(sentences) - overlap), max_chunk_size - overlap)
+  return [" ".join(sentences[start:start + max_chunk_size]) for start in starts]
+
+
+def semantic_chunk(text: str, max_chunk_size: int, overlap: int) -> list[str]:
+  return sentence_windows(split_sentences(text), max_chunk_size, overlap)
+
+
+def chunk_batch(first_index: int, descriptions: list[str], max_chunk_size: int, overlap: int) -> list[tuple[int, list[str]]]:
+  """(index, chunks) of each description that has chunks, indices counted from first_index."""
+  batch = []
+  for index, description in enumerate(descriptions, first_index):
+    chunks = semantic_chunk(description, max_chunk_size, overlap)
+    if len(chunks) > 0:
+      batch.append((index, chunks))
+  return batch
+
+
+def iter_chunks(
+  documents: Sequence[dict],
+  max_chunk_size: int,
+  overlap: int,
+  start: int = 0,
+  workers: int = 1,
+) -> Iterator[tuple[int, list[str]]]:
+  """
+  (index, chunks) of each document from start whose description has
+  chunks, in document order, chunked serially or by a process pool.
+  """
+  batch_starts = range(start, len(documents), CHUNK_BATCH_DOCS)
+  def descriptions(batch_start: int) -> list[str]:
+    end = min(batch_start + CHUNK_BATCH_DOCS, len(documents))
+    return [documents[i]["description"] for i in range(batch_start, end)]
+
+  if workers <= 1 or len(batch_starts) <= 1:
+    for batch_start in batch_starts:
+      yield from chunk_batch(batch_start, descriptions(batch_start), max_chunk_size, overlap)
+    return
+
+  # only builds get here, keep it out of the chunk commands' startup
+  from concurrent.futures import ProcessPoolExecutor
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    pending = deque()
+    for batch_start in batch_starts:
+      pending.append(pool.submit(chunk_batch, batch_start, descriptions(batch_start), max_chunk_size, overlap))
+      if len(pending) >= workers * BATCHES_PER_WORKER:
+        yield from pending.popleft().result()
+    while len(pending) > 0:
+      yield from pending.popleft().result()
+
+
+def chunk_text(text: str, chunk_size: int, overlap: int):
+  if overlap > chunk_size:
+    raise ValueError("Overlap cannot be greater than the chunk_size")
+  
+  print(f"Chunking {len(text)} characters")
+  
+  list_of_words = text.rsplit()
+  
+  chunks = []
+  if len(list_of_words) > 0:
+    chunk = " ".join(list_of_words[0:chunk_size])
+    chunks.append(chunk)
+    
+  start = chunk_size - overlap
+  while start+overlap < len(list_of_words):
+    end = start + chunk_size
+    chunk = " ".join(list_of_words[start:end])
+    chunks.append(chunk)
+    start = end - overlap
+
+  for i, w in enumerate(chunks,1):
+    print(f"{i}. {w}")
+    
+    
+def semantic_chunk_text(text: str, max_chunk_size: int, overlap: int):
+  print(f"Semantically chunking {len(text)} characters")
+  
+  chunks = semantic_chunk(text, max_chunk_size, overlap)
+
+  for i, w in enumerate(chunks,1):
+    print(f"{i}. {w}")
+    
+  return chunks
@@ -0,0 +1,112 @@
+"""
+Document store: movie records in one file, fetched by ordinal on demand.
+
+Layout, every section 8-byte aligned:
+
+  header    magic, version, num_docs
+  offsets   uint64[num_docs+1] offsets of each record into records
+  records   one utf-8 JSON object per document
+
+Opening a store maps the file and parses the header, so startup and resident
+memory do not grow with the catalog: a record is sliced out of the map and
+decoded only when a result is displayed.
+"""
+from array import array
+from collections.abc import Sequence
+import bisect
+import json
+import mmap
+import os
+import struct
+
+from .search_utils import DATA_PATH, DOCS_PATH, load_movies
+
+MAGIC = b"HDOC"
+VERSION = 1
+
+HEADER = struct.Struct("<4sIQ")
+
+
+def write_doc_store(path: str, docs) -> None:
+  offsets = array("Q", [0])
+  records = bytearray()
+  for doc in docs:
+    records += json.dumps(doc, ensure_ascii=False).encode("utf-8")
+    offsets.append(len(records))
+
+  # write aside and swap, so processes that have the old file mapped keep it
+  tmp_path = path + ".tmp"
+  with open(tmp_path, "wb") as f:
+    f.write(HEADER.pack(MAGIC, VERSION, len(offsets) - 1))
+    f.write(b"\0" * (_align(HEADER.size) - HEADER.size))
+    f.write(offsets.tobytes())
+    f.write(records)
+  os.replace(tmp_path, path)
+
+
+def _align(position: int) -> int:
+  return (position + 7) & ~7
+
+
+class DocStore(Sequence):
+  """Read-only sequence of the records of a file written by write_doc_store."""
+  def __init__(self, path: str):
+    if not os.path.exists(path):
+      raise ValueError(f"Loading failed: '{path}' is missing.")
+
+    with open(path, "rb") as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(self.mm) < HEADER.size or self.mm[:4] != MAGIC:
+      raise ValueError(f"Loading failed: '{path}' is not a document store.")
+    _, version, num_docs = HEADER.unpack_from(self.mm)
+    if version != VERSION:
+      raise ValueError(f"Loading failed: '{path}' has version {version}, expected {VERSION}.")
+
+    self.path = path
+    self.num_docs = num_docs
+    start = _align(HEADER.size)
+    self.offsets = memoryview(self.mm)[start:start + 8 * (num_docs + 1)].cast("Q")
+    self.records_start = start + 8 * (num_docs + 1)
+
+  def __len__(self) -> int:
+    return self.num_docs
+
+  def __getitem__(self, ordinal: int) -> dict:
+    if not 0 <= ordinal < self.num_docs:
+      raise IndexError(ordinal)
+    start = self.records_start + self.offsets[ordinal]
+    end = self.records_start + self.offsets[ordinal + 1]
+    return json.loads(self.mm[start:end])
+
+
+class ChainedDocs(Sequence):
+  """Several stores read as one, ordinals running on from store to store."""
+  def __init__(self, stores: list[Sequence]):
+    self.stores = stores
+    self.starts = [0]
+    for store in stores:
+      self.starts.append(self.starts[-1] + len(store))
+
+  def __len__(self) -> int:
+    return self.starts[-1]
+
+  def __getitem__(self, ordinal: int) -> dict:
+    if not 0 <= ordinal < len(self):
+      raise IndexError(ordinal)
+    number = bisect.bisect_right(self.starts, ordinal) - 1
+    return self.stores[number][ordinal - self.starts[number]]
+
+
+def load_documents() -> DocStore:
+  """
+  The movies of movies.json as a document store, ordinals in file order.
+  The store is rebuilt whenever movies.json is newer than it.
+  """
+  stale = os.path.exists(DATA_PATH) and (
+    not os.path.exists(DOCS_PATH) or os.path.getmtime(DOCS_PATH) < os.path.getmtime(DATA_PATH)
+  )
+  if stale:
+    os.makedirs(os.path.dirname(DOCS_PATH), exist_ok=True)
+    write_doc_store(DOCS_PATH, load_movies())
+  return DocStore(DOCS_PATH)
@@ -0,0 +1,147 @@
+"""
+Embedding matrices on disk, opened with mmap.
+
+Layout:
+
+  header   magic, version, dtype code, dims, rows, model name length
+  model    utf-8 name of the model that produced the embeddings
+  vectors  float32 or float16[rows, dims], row-major, 64-byte aligned
+  keys     uint64[rows] content key of each row, 64-byte aligned
+
+Opening a file parses the header and maps the vectors read-only, so it
+costs the same whatever the number of rows, processes share the pages
+through the OS page cache, and a file made by another model or for another
+catalog is told apart without reading the vectors.
+
+The keys hash what a row was encoded from (see semantic_search.content_keys),
+so a rebuild only encodes rows whose key is new. Version 1 files have no
+keys section.
+
+Arrays are written in native byte order.
+"""
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"HEMB"
+VERSION = 2
+
+HEADER = struct.Struct("<4sIIIQI")
+
+DTYPE_CODES = {np.dtype(np.float32): 1, np.dtype(np.float16): 2}
+DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+
+# rows converted and written at once
+WRITE_BLOCK_ROWS = 1 << 16
+
+
+def _align(position: int) -> int:
+  return (position + 63) & ~63
+
+
+def is_embedding_file(path: str) -> bool:
+  with open(path, "rb") as f:
+    return f.read(4) == MAGIC
+
+
+def write_embeddings(path: str, vectors: np.ndarray, keys: np.ndarray, model_name: str, dtype=np.float32) -> None:
+  rows, dims = vectors.shape
+  if len(keys) != rows:
+    raise ValueError(f"Got {len(keys)} keys for {rows} embeddings.")
+
+  # write aside and swap, so processes that have the old file mapped keep it
+  tmp_path = path + ".tmp"
+  writer = EmbeddingWriter(tmp_path, dims, model_name, dtype)
+  for start in range(0, rows, WRITE_BLOCK_ROWS):
+    writer.append(vectors[start:start + WRITE_BLOCK_ROWS])
+  writer.finish(keys)
+  os.replace(tmp_path, path)
+
+
+class EmbeddingWriter:
+  """
+  Writes an embeddings file whose number of rows is not known up front.
+  Vectors are appended in row order, and finish(keys) writes the keys
+  after them and the row count into the header; until then the header
+  says 0 rows. With rows, an unfinished file is reopened keeping the
+  vectors of its first rows.
+  """
+  def __init__(self, path: str, dims: int, model_name: str, dtype=np.float32, rows: int = 0):
+    self.dtype = np.dtype(dtype)
+    if self.dtype not in DTYPE_CODES:
+      raise ValueError(f"Unsupported embeddings dtype '{self.dtype}', expected float32 or float16.")
+    self.dims = dims
+    self.model = model_name.encode("utf-8")
+    self.vectors_offset = _align(HEADER.size + len(self.model))
+    self.rows = 0
+
+    if rows == 0:
+      self.__file = open(path, "wb")
+      self.__write_header()
+      self.__file.write(self.model)
+    else:
+      self.__file = open(path, "r+b")
+    self.truncate(rows)
+
+  def append(self, vectors: np.ndarray) -> None:
+    self.__file.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+    self.rows += len(vectors)
+
+  def truncate(self, rows: int) -> None:
+    """Drops the rows from rows on, the next append writes row rows."""
+    end = self.vectors_offset + rows * self.dims * self.dtype.itemsize
+    self.__file.truncate(end)
+    self.__file.seek(end)
+    self.rows = rows
+
+  def flush(self) -> None:
+    """Makes the rows appended so far durable."""
+    self.__file.flush()
+    os.fsync(self.__file.fileno())
+
+  def finish(self, keys: np.ndarray) -> None:
+    if len(keys) != self.rows:
+      raise ValueError(f"Got {len(keys)} keys for {self.rows} embeddings.")
+    self.__file.seek(_align(self.__file.tell()))
+    self.__file.write(np.ascontiguousarray(keys, dtype=np.uint64).tobytes())
+    self.__file.seek(0)
+    self.__write_header()
+    self.__file.close()
+
+  def close(self) -> None:
+    """Closes the file unfinished."""
+    self.__file.close()
+
+  def __write_header(self) -> None:
+    self.__file.write(HEADER.pack(MAGIC, VERSION, DTYPE_CODES[self.dtype], self.dims, self.rows, len(self.model)))
+
+
+class EmbeddingFile:
+  """Header of an embeddings file plus its vectors as a read-only memmap."""
+  def __init__(self, path: str):
+    with open(path, "rb") as f:
+      header = f.read(HEADER.size)
+      if len(header) < HEADER.size or header[:4] != MAGIC:
+        raise ValueError(f"Loading failed: '{path}' is not an embeddings file.")
+      _, version, dtype_code, dims, rows, model_length = HEADER.unpack(header)
+      if version not in (1, VERSION):
+        raise ValueError(f"Loading failed: '{path}' has version {version}, expected {VERSION}.")
+      if dtype_code not in DTYPES:
+        raise ValueError(f"Loading failed: '{path}' has an unknown dtype code {dtype_code}.")
+      self.model_name = f.read(model_length).decode("utf-8")
+
+    self.path = path
+    self.dtype = DTYPES[dtype_code]
+    self.dims = dims
+    self.rows = rows
+    offset = _align(HEADER.size + model_length)
+    keys_offset = _align(offset + rows * dims * self.dtype.itemsize)
+    # mmap cannot map zero bytes
+    if rows == 0:
+      self.vectors = np.zeros((0, dims), dtype=self.dtype)
+      self.keys = np.zeros(0, dtype=np.uint64) if version > 1 else None
+    else:
+      self.vectors = np.memmap(path, dtype=self.dtype, mode="r", offset=offset, shape=(rows, dims))
+      self.keys = np.memmap(path, dtype=np.uint64, mode="r", offset=keys_offset, shape=(rows,)) if version > 1 else None
+
@@ -0,0 +1,210 @@
+"""
+Text encoders behind the semantic search, all with the SentenceTransformer
+calls the search uses: encode(text or texts) and
+get_sentence_embedding_dimension().
+
+  sentence-transformers  the model as is, one process
+  pool                   the same model in POOL_WORKERS processes, large
+                         encode calls split between them, small ones
+                         encoded in this process
+  int8                   the model with its linear layers dynamically
+                         quantized to int8, faster on CPU with slightly
+                         different embeddings
+  hash                   a deterministic bag of hashed words needing no
+                         model, a stand-in for tests and tries
+
+An encoder's name identifies the embeddings it makes: it is part of the
+content keys and written in embedding files and the query cache, so
+embeddings of different encoders are never mixed. pool makes the same
+embeddings as the model it runs, and has its name.
+
+sentence_transformers (and with it torch) is imported and the model loaded
+on the first encode, so searches answered from the query cache and
+commands that never encode do not pay seconds for them.
+"""
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import math
+import multiprocessing
+import os
+import re
+
+import numpy as np
+
+from cli.lib.search_utils import DEFAULT_ENCODER, ENCODERS, MODEL_NAME
+
+POOL_WORKERS = max(1, os.cpu_count() or 1)
+# encode calls with fewer texts are not worth shipping to the pool
+POOL_MIN_TEXTS = 64
+
+HASH_DIMS = 384
+WORD = re.compile(r"\w+")
+
+
+class Encoder:
+  name: str
+
+  def encode(self, texts: str | list[str]) -> np.ndarray:
+    """Embedding of a text, or one row per text of a list."""
+    raise NotImplementedError
+
+  def get_sentence_embedding_dimension(self) -> int:
+    raise NotImplementedError
+
+  def set_threads(self, threads: int) -> None:
+    """Caps the threads one encode call uses, where the backend has a say."""
+    pass
+
+
+class SentenceTransformerEncoder(Encoder):
+  def __init__(self, model_name: str = MODEL_NAME, device: str | None = None):
+    self.name = model_name
+    self.model_name = model_name
+    self.device = device
+    self.__model = None
+
+  @property
+  def model(self):
+    """The SentenceTransformer, loaded on first use."""
+    if self.__model is None:
+      self.__model = self._load_model()
+    return self.__model
+
+  def _load_model(self):
+    from sentence_transformers import SentenceTransformer
+
+    # downloads automatically the first time
+    return SentenceTransformer(self.model_name, device=self.device)
+
+  def encode(self, texts: str | list[str]) -> np.ndarray:
+    return self.model.encode(texts)
+
+  def get_sentence_embedding_dimension(self) -> int:
+    return self.model.get_sentence_embedding_dimension()
+
+  def set_threads(self, threads: int) -> None:
+    import torch
+
+    torch.set_num_threads(threads)
+
+
+class Int8Encoder(SentenceTransformerEncoder):
+  """
+  Linear layers quantized to int8 with dynamic activation scales, the bulk
+  of the transformer's CPU time. Embeddings are close to the float model's
+  but not equal, hence the own name.
+  """
+  def __init__(self, model_name: str = MODEL_NAME):
+    # quantized layers only run on CPU
+    super().__init__(model_name, "cpu")
+    self.name = f"{model_name}+int8"
+
+  def _load_model(self):
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(super()._load_model(), {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class HashEncoder(Encoder):
+  """
+  Sum of a signed one-hot vector per lowercased word, placed by a hash of
+  the word. Texts sharing words are similar, and the embeddings are the
+  same on every run and machine.
+  """
+  def __init__(self, dims: int = HASH_DIMS):
+    self.name = f"hash-{dims}"
+    self.dims = dims
+
+  def encode(self, texts: str | list[str]) -> np.ndarray:
+    if isinstance(texts, str):
+      return self.__encode_one(texts)
+    vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+    for row, text in enumerate(texts):
+      vectors[row] = self.__encode_one(text)
+    return vectors
+
+  def get_sentence_embedding_dimension(self) -> int:
+    return self.dims
+
+  def __encode_one(self, text: str) -> np.ndarray:
+    hashes = [
+      int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+      for word in WORD.findall(text.lower())
+    ]
+    positions = [h % self.dims for h in hashes]
+    signs = [1.0 if (h >> 32) & 1 else -1.0 for h in hashes]
+    return np.bincount(positions, weights=signs, minlength=self.dims).astype(np.float32)
+
+
+# the encoder of a pool worker process
+_worker_encoder: Encoder | None = None
+
+
+def _start_worker(make: Callable[..., Encoder], args: tuple, threads: int) -> None:
+  global _worker_encoder
+  _worker_encoder = make(*args)
+  _worker_encoder.set_threads(threads)
+
+
+def _encode_in_worker(texts: list[str]) -> np.ndarray:
+  return np.asarray(_worker_encoder.encode(texts), dtype=np.float32)
+
+
+class PoolEncoder(Encoder):
+  """
+  make(*args) run in each of workers processes, which split the cores
+  between them. Lists of at least POOL_MIN_TEXTS texts are cut into one
+  contiguous shard per worker and encoded in parallel; anything smaller
+  goes to an encoder in this process. Workers are spawned, not forked (a
+  forked torch can deadlock), on the first large call and load the model
+  once each.
+  """
+  def __init__(self, make: Callable[..., Encoder], args: tuple = (), workers: int = POOL_WORKERS):
+    self.make = make
+    self.args = args
+    self.workers = max(1, workers)
+    self.local = make(*args)
+    self.name = self.local.name
+    self.__pool: ProcessPoolExecutor | None = None
+
+  def encode(self, texts: str | list[str]) -> np.ndarray:
+    if isinstance(texts, str) or len(texts) < POOL_MIN_TEXTS or self.workers == 1:
+      return self.local.encode(texts)
+
+    shard_size = math.ceil(len(texts) / self.workers)
+    shards = [texts[start:start + shard_size] for start in range(0, len(texts), shard_size)]
+    # map keeps the shards in order
+    return np.concatenate(list(self.__get_pool().map(_encode_in_worker, shards)))
+
+  def get_sentence_embedding_dimension(self) -> int:
+    return self.local.get_sentence_embedding_dimension()
+
+  def close(self) -> None:
+    if self.__pool is not None:
+      self.__pool.shutdown()
+      self.__pool = None
+
+  def __get_pool(self) -> ProcessPoolExecutor:
+    if self.__pool is None:
+      threads = max(1, (os.cpu_count() or 1) // self.workers)
+      self.__pool = ProcessPoolExecutor(
+        max_workers=self.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_start_worker,
+        initargs=(self.make, self.args, threads),
+      )
+    return self.__pool
+
+
+def make_encoder(kind: str = DEFAULT_ENCODER, workers: int = POOL_WORKERS) -> Encoder:
+  match kind:
+    case "sentence-transformers":
+      return SentenceTransformerEncoder()
+    case "pool":
+      return PoolEncoder(SentenceTransformerEncoder, (MODEL_NAME,), workers)
+    case "int8":
+      return Int8Encoder()
+    case "hash":
+      return HashEncoder()
+  raise ValueError(f"Unknown encoder '{kind}', expected one of {', '.join(ENCODERS)}.")
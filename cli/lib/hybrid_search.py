@@ -1,39 +1,59 @@
 import os
 import textwrap
 
-from cli.lib.chunked_semantic_search import ChunkedSemanticSearch
-from cli.lib.search_keyword import InvertedIndex
-from cli.lib.search_utils import INDEX_PATH, load_movies
+from cli.lib.doc_store import load_documents
+from cli.lib.search_utils import DEFAULT_NPROBE, INDEX_PATH
 
 class HybridSearch:
-  def __init__(self, documents):
+  def __init__(self, documents, quantization: str | None = None):
+    # imported here rather than at the top, so `normalize` starts without
+    # numpy and the index code
+    from cli.lib.chunked_semantic_search import ChunkedSemanticSearch
+    from cli.lib.search_keyword import InvertedIndex
+
     self.documents = documents
-    self.semantic_search = ChunkedSemanticSearch()
+    self.semantic_search = ChunkedSemanticSearch(quantization)
     self.semantic_search.load_or_create_chunk_embeddings(documents)
 
     self.idx = InvertedIndex()
     if not os.path.exists(INDEX_PATH):
       self.idx.build()
       self.idx.save()
+    self.idx.load()
 
   def _bm25_search(self, query, limit):
-    self.idx.load()
     return self.idx.bm25_search(query, limit)
 
-  def weighted_search(self, query, alpha, limit=5):
+  def weighted_search(self, query, alpha, limit=5, engine="exact", nprobe=DEFAULT_NPROBE):
     search_limit = min(limit*500, len(self.documents))
     
     # print("search limit:" , search_limit)
   
     # keyword search
     keyword_results = self._bm25_search(query, search_limit)
+    # semantic search
+    semantic_results = self.semantic_search.search_chunks(query, search_limit, engine, nprobe)
+    return self.__combine(keyword_results, semantic_results, alpha, limit)
+
+  def weighted_search_many(self, queries: list[str], alpha, limit=5, engine="exact", nprobe=DEFAULT_NPROBE) -> list[list[dict]]:
+    """
+    weighted_search for each of queries: BM25 scores them together with
+    the matrix engine, the semantic side embeds them in one batch.
+    """
+    search_limit = min(limit*500, len(self.documents))
+    keyword_batch = self.idx.bm25_search_many(queries, search_limit)
+    semantic_batch = self.semantic_search.search_chunks_many(queries, search_limit, engine, nprobe)
+    return [
+      self.__combine(keyword_results, semantic_results, alpha, limit)
+      for keyword_results, semantic_results in zip(keyword_batch, semantic_batch)
+    ]
+
+  def __combine(self, keyword_results, semantic_results, alpha, limit):
     scores = [item["score"] for item in keyword_results]
     normalized_keyword_scores = normalize_scores(scores)
     for r, s in zip(keyword_results, normalized_keyword_scores):
       r["normalized_score"] = s
 
-    # semantic search
-    semantic_results = self.semantic_search.search_chunks(query, search_limit)
     scores = [item["score"] for item in semantic_results]
     normalized_semantic_scores = normalize_scores(scores)
     for r, s in zip(semantic_results, normalized_semantic_scores):
@@ -140,11 +160,11 @@ def hybrid_score(bm25_score, semantic_score, alpha=0.5):
 # allows you to adjust it as needed.
 
 
-def weighted_search_cmd(query: str, alpha: float, limit: int):
-  documents = load_movies()  
-  hs = HybridSearch(documents)
+def weighted_search_cmd(query: str, alpha: float, limit: int, engine: str = "exact", nprobe: int = DEFAULT_NPROBE, quantization: str | None = None):
+  documents = load_documents()
+  hs = HybridSearch(documents, quantization)
   
-  results = hs.weighted_search(query, alpha, limit)
+  results = hs.weighted_search(query, alpha, limit, engine, nprobe)
   
   for i, result in enumerate(results, 1):
     print(f"{i}. {result["title"]}")
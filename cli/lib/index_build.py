@@ -0,0 +1,123 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import itertools
+import math
+from typing import NamedTuple
+
+from .tokenizer import get_tokenizer
+
+# more shards than workers keeps the pool busy when shard costs differ
+SHARDS_PER_WORKER = 4
+
+
+class IndexData(NamedTuple):
+  """
+  What a build produces: doc lengths, term -> (sorted ordinals, tfs), optional
+  term -> token positions of each posting, and the title field's share of
+  both (title token counts and title tfs aligned with postings). Description
+  lengths and tfs are the totals minus the title's. Data merged from index
+  files written without fields has None for the title ones.
+  """
+  lengths: list[int]
+  postings: dict[str, tuple[list[int], list[int]]]
+  positions: dict[str, list[list[int]]] | None
+  title_lengths: list[int] | None
+  title_tfs: dict[str, list[int]] | None
+
+
+def build_shard(first_ordinal: int, docs: list[tuple[str, str]], with_positions: bool = False) -> IndexData:
+  """
+  Tokenizes a contiguous run of (title, description) documents into a partial
+  index with global ordinals. A document's tokens are its title tokens
+  followed by its description tokens, the same as tokenizing the two joined.
+  """
+  tokenizer = get_tokenizer()
+  lengths = []
+  title_lengths = []
+  postings: dict[str, tuple[list[int], list[int]]] = {}
+  title_tfs: dict[str, list[int]] = {}
+  positions: dict[str, list[list[int]]] | None = {} if with_positions else None
+  for ordinal, (title, description) in enumerate(docs, first_ordinal):
+    title_tokens = tokenizer.tokenize(title)
+    tokens = title_tokens + tokenizer.tokenize(description)
+    lengths.append(len(tokens))
+    title_lengths.append(len(title_tokens))
+    title_counts = Counter(title_tokens)
+    if with_positions:
+      term_positions: dict[str, list[int]] = {}
+      for position, term in enumerate(tokens):
+        term_positions.setdefault(term, []).append(position)
+      for term, token_positions in term_positions.items():
+        positions.setdefault(term, []).append(token_positions)
+      term_counts = ((term, len(p)) for term, p in term_positions.items())
+    else:
+      term_counts = Counter(tokens).items()
+
+    for term, tf in term_counts:
+      if term not in postings:
+        postings[term] = ([], [])
+        title_tfs[term] = []
+      postings[term][0].append(ordinal)
+      postings[term][1].append(tf)
+      title_tfs[term].append(title_counts[term])
+  return IndexData(lengths, postings, positions, title_lengths, title_tfs)
+
+
+def merge_shards(shards: list[IndexData]) -> IndexData:
+  """
+  k-way merge of shard results, which must be given in ordinal order. Terms
+  come out sorted, and because shards cover increasing ordinal ranges each
+  term's postings are the concatenation of its shard postings.
+  """
+  lengths = []
+  title_lengths = []
+  for shard in shards:
+    lengths.extend(shard.lengths)
+    title_lengths.extend(shard.title_lengths)
+  with_positions = all(shard.positions is not None for shard in shards)
+
+  sorted_terms = [
+    [(term, shard_number) for term in sorted(shard.postings)]
+    for shard_number, shard in enumerate(shards)
+  ]
+  postings: dict[str, tuple[list[int], list[int]]] = {}
+  title_tfs: dict[str, list[int]] = {}
+  positions: dict[str, list[list[int]]] | None = {} if with_positions else None
+  merged = heapq.merge(*sorted_terms)
+  for term, group in itertools.groupby(merged, key=lambda item: item[0]):
+    ordinals, tfs, term_title_tfs, term_positions = [], [], [], []
+    for _, shard_number in group:
+      shard = shards[shard_number]
+      shard_ordinals, shard_tfs = shard.postings[term]
+      ordinals.extend(shard_ordinals)
+      tfs.extend(shard_tfs)
+      term_title_tfs.extend(shard.title_tfs[term])
+      if with_positions:
+        term_positions.extend(shard.positions[term])
+    postings[term] = (ordinals, tfs)
+    title_tfs[term] = term_title_tfs
+    if with_positions:
+      positions[term] = term_positions
+  return IndexData(lengths, postings, positions, title_lengths, title_tfs)
+
+
+def build_postings(docs: list[tuple[str, str]], workers: int = 1, with_positions: bool = False) -> IndexData:
+  """
+  Builds the index data of (title, description) documents, serially or split
+  across a process pool. The result does not depend on the number of workers.
+  """
+  if workers <= 1:
+    return merge_shards([build_shard(0, docs, with_positions)])
+
+  shard_size = max(1, math.ceil(len(docs) / (workers * SHARDS_PER_WORKER)))
+  starts = list(range(0, len(docs), shard_size))
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    # map keeps submission order, which the merge relies on
+    shards = list(pool.map(
+      build_shard,
+      starts,
+      [docs[s:s + shard_size] for s in starts],
+      itertools.repeat(with_positions, len(starts)),
+    ))
+  return merge_shards(shards)
@@ -0,0 +1,472 @@
+"""
+Compact on-disk format for InvertedIndex, opened with mmap.
+
+Layout (version 3), every section 8-byte aligned:
+
+  header           magic, version, flags, num_docs, num_terms, avgdl, k1, b
+                   and the byte offset of each section below
+  doc_ids          int32[num_docs]    ordinal -> movie id
+  doc_lengths      int32[num_docs]    ordinal -> token count
+  length_norms     float64[num_docs]  ordinal -> k1 * (1 - b + b * dl/avgdl)
+  term_offsets     uint32[num_terms+1] offsets into term_blob
+  term_blob        utf-8 terms, sorted by their bytes
+  dfs              uint32[num_terms]
+  idfs             float64[num_terms]
+  max_impacts      float64[num_terms]
+  postings_offsets uint64[num_terms+1] offsets into postings
+  postings         per term: varint(ordinal delta), varint(tf) pairs
+  skip_offsets     uint64[num_terms+1] offsets into skips, in entries
+  skips            per term and per block of SKIP_INTERVAL postings after the
+                   first: uint32 pairs (last ordinal of the previous block,
+                   byte offset of the block in the term's postings)
+  positions_offsets uint64[num_terms+1] offsets into positions
+  positions        only with FLAG_POSITIONS, per term: uint32[df+1] offsets of
+                   each posting's entry, then per posting tf varint position
+                   deltas
+  title_lengths    int32[num_docs]    ordinal -> title token count
+  title_norms      float64[num_docs]  ordinal -> 1 - b + b * len/avglen of title
+  description_norms float64[num_docs] the same for the description
+  field_max_tfs    float64[2*num_terms] per term, max tf/norm in the title and
+                   in the description (BM25F upper bounds)
+  title_tfs_offsets uint64[num_terms+1] offsets into title_tfs
+  title_tfs        per term: varint(title tf) per posting
+
+The title_lengths to title_tfs sections are only filled with FLAG_FIELDS.
+
+Skips let a cursor jump to the block holding an ordinal and decode just that
+block, so intersections do not decode whole postings lists. Description tfs
+and lengths are the totals minus the title's.
+
+The header and the arrays are all in native byte order, so the sections are
+read in place as memoryview casts; the file is a cache for the machine that
+builds it.
+"""
+from array import array
+from collections.abc import Mapping
+import bisect
+import mmap
+import os
+import struct
+
+from .postings import gallop
+from .wand import END_OF_POSTINGS
+
+MAGIC = b"HPLX"
+VERSION = 3
+
+# the index records token positions (phrase queries)
+FLAG_POSITIONS = 1
+# the index records title/description statistics (BM25F)
+FLAG_FIELDS = 2
+
+# postings per skip block
+SKIP_INTERVAL = 64
+
+SECTIONS = (
+  "doc_ids",
+  "doc_lengths",
+  "length_norms",
+  "term_offsets",
+  "term_blob",
+  "dfs",
+  "idfs",
+  "max_impacts",
+  "postings_offsets",
+  "postings",
+  "skip_offsets",
+  "skips",
+  "positions_offsets",
+  "positions",
+  "title_lengths",
+  "title_norms",
+  "description_norms",
+  "field_max_tfs",
+  "title_tfs_offsets",
+  "title_tfs",
+)
+# native byte order like the arrays, standard sizes and no padding
+HEADER = struct.Struct(f"=4sIIIIddd{len(SECTIONS)}Q")
+# the two uint32 offsets of a posting's positions entry
+POSITIONS_ENTRY = struct.Struct("=II")
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+  while value >= 0x80:
+    out.append((value & 0x7F) | 0x80)
+    value >>= 7
+  out.append(value)
+
+
+def encode_postings(ordinals, tfs, skips: array | None = None) -> bytes:
+  """
+  Delta+varint encodes postings. When skips is given, a (previous ordinal,
+  byte offset) pair is appended to it at the start of every block but the
+  first.
+  """
+  out = bytearray()
+  previous = 0
+  for i, (ordinal, tf) in enumerate(zip(ordinals, tfs)):
+    if skips is not None and i > 0 and i % SKIP_INTERVAL == 0:
+      skips.append(previous)
+      skips.append(len(out))
+    encode_varint(ordinal - previous, out)
+    encode_varint(tf, out)
+    previous = ordinal
+  return bytes(out)
+
+
+def decode_varints(data) -> list[int]:
+  values = []
+  value = 0
+  shift = 0
+  for byte in data:
+    value |= (byte & 0x7F) << shift
+    if byte & 0x80:
+      shift += 7
+      continue
+    values.append(value)
+    value = 0
+    shift = 0
+  return values
+
+
+def decode_postings(data, previous: int = 0) -> tuple[array, array]:
+  ordinals = array("i")
+  tfs = array("i")
+  values = decode_varints(data)
+
+  ordinal = previous
+  for i in range(0, len(values), 2):
+    ordinal += values[i]
+    ordinals.append(ordinal)
+    tfs.append(values[i + 1])
+  return ordinals, tfs
+
+
+def encode_varints(values) -> bytes:
+  out = bytearray()
+  for value in values:
+    encode_varint(value, out)
+  return bytes(out)
+
+
+def encode_positions(position_lists: list[list[int]]) -> bytes:
+  offsets = array("I", [0])
+  data = bytearray()
+  for positions in position_lists:
+    previous = 0
+    for position in positions:
+      encode_varint(position - previous, data)
+      previous = position
+    offsets.append(len(data))
+  return offsets.tobytes() + bytes(data)
+
+
+def write_index(
+  path: str,
+  doc_ids: list[int],
+  doc_lengths: list[int],
+  length_norms: list[float],
+  avg_doc_length: float,
+  k1: float,
+  b: float,
+  postings: dict[str, tuple[list[int], list[int]]],
+  idf: dict[str, float],
+  max_impacts: dict[str, float],
+  positions: dict[str, list[list[int]]] | None = None,
+  title_lengths: list[int] | None = None,
+  title_norms: list[float] | None = None,
+  description_norms: list[float] | None = None,
+  title_tfs: dict[str, list[int]] | None = None,
+  field_max_tfs: dict[str, tuple[float, float]] | None = None,
+) -> None:
+  """
+  Writes an index file. positions and the title/description statistics
+  (title_lengths through field_max_tfs, all or none) are optional.
+  """
+  terms = sorted(postings, key=lambda t: t.encode("utf-8"))
+
+  term_offsets = array("I", [0])
+  term_blob = bytearray()
+  postings_offsets = array("Q", [0])
+  postings_blob = bytearray()
+  skip_offsets = array("Q", [0])
+  skips = array("I")
+  positions_offsets = array("Q", [0])
+  positions_blob = bytearray()
+  title_tfs_offsets = array("Q", [0])
+  title_tfs_blob = bytearray()
+  for term in terms:
+    term_blob += term.encode("utf-8")
+    term_offsets.append(len(term_blob))
+    postings_blob += encode_postings(*postings[term], skips)
+    postings_offsets.append(len(postings_blob))
+    skip_offsets.append(len(skips) // 2)
+    if positions is not None:
+      positions_blob += encode_positions(positions[term])
+    positions_offsets.append(len(positions_blob))
+    if title_tfs is not None:
+      title_tfs_blob += encode_varints(title_tfs[term])
+    title_tfs_offsets.append(len(title_tfs_blob))
+
+  sections = {
+    "doc_ids": array("i", doc_ids).tobytes(),
+    "doc_lengths": array("i", doc_lengths).tobytes(),
+    "length_norms": array("d", length_norms).tobytes(),
+    "term_offsets": term_offsets.tobytes(),
+    "term_blob": bytes(term_blob),
+    "dfs": array("I", [len(postings[t][0]) for t in terms]).tobytes(),
+    "idfs": array("d", [idf[t] for t in terms]).tobytes(),
+    "max_impacts": array("d", [max_impacts[t] for t in terms]).tobytes(),
+    "postings_offsets": postings_offsets.tobytes(),
+    "postings": bytes(postings_blob),
+    "skip_offsets": skip_offsets.tobytes(),
+    "skips": skips.tobytes(),
+    "positions_offsets": positions_offsets.tobytes(),
+    "positions": bytes(positions_blob),
+    "title_lengths": b"",
+    "title_norms": b"",
+    "description_norms": b"",
+    "field_max_tfs": b"",
+    "title_tfs_offsets": title_tfs_offsets.tobytes(),
+    "title_tfs": bytes(title_tfs_blob),
+  }
+  flags = FLAG_POSITIONS if positions is not None else 0
+  if title_tfs is not None:
+    flags |= FLAG_FIELDS
+    sections["title_lengths"] = array("i", title_lengths).tobytes()
+    sections["title_norms"] = array("d", title_norms).tobytes()
+    sections["description_norms"] = array("d", description_norms).tobytes()
+    sections["field_max_tfs"] = array("d", [m for t in terms for m in field_max_tfs[t]]).tobytes()
+
+  offsets = []
+  position = _align(HEADER.size)
+  for name in SECTIONS:
+    offsets.append(position)
+    position = _align(position + len(sections[name]))
+
+  # write aside and swap, so processes that have the old file mapped keep it
+  tmp_path = path + ".tmp"
+  with open(tmp_path, "wb") as f:
+    f.write(HEADER.pack(MAGIC, VERSION, flags, len(doc_ids), len(terms), avg_doc_length, k1, b, *offsets))
+    for name, offset in zip(SECTIONS, offsets):
+      f.write(b"\0" * (offset - f.tell()))
+      f.write(sections[name])
+  os.replace(tmp_path, path)
+
+
+def _align(position: int) -> int:
+  return (position + 7) & ~7
+
+
+class IndexFile:
+  """
+  Read-only view over an index written by write_index. Opening it only maps
+  the file and parses the header; the OS pages in term dictionary entries and
+  postings as queries touch them.
+  """
+  def __init__(self, path: str):
+    with open(path, "rb") as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(self.mm) < HEADER.size or self.mm[:4] != MAGIC:
+      raise ValueError(f"Loading failed: '{path}' is not an index file.")
+
+    _, version, flags, num_docs, num_terms, avg_doc_length, k1, b, *offsets = HEADER.unpack_from(self.mm)
+    if version != VERSION:
+      raise ValueError(f"Loading failed: '{path}' has version {version}, expected {VERSION}.")
+
+    self.num_docs = num_docs
+    self.num_terms = num_terms
+    self.avg_doc_length = avg_doc_length
+    self.k1 = k1
+    self.b = b
+    self.has_positions = bool(flags & FLAG_POSITIONS)
+    self.has_fields = bool(flags & FLAG_FIELDS)
+
+    view = memoryview(self.mm)
+    sizes = {
+      "doc_ids": 4 * num_docs,
+      "doc_lengths": 4 * num_docs,
+      "length_norms": 8 * num_docs,
+      "term_offsets": 4 * (num_terms + 1),
+      "dfs": 4 * num_terms,
+      "idfs": 8 * num_terms,
+      "max_impacts": 8 * num_terms,
+      "postings_offsets": 8 * (num_terms + 1),
+    }
+    formats = {"doc_ids": "i", "doc_lengths": "i", "length_norms": "d", "term_offsets": "I",
+               "dfs": "I", "idfs": "d", "max_impacts": "d", "postings_offsets": "Q"}
+    self.section_offsets = dict(zip(SECTIONS, offsets))
+    for name, size in sizes.items():
+      start = self.section_offsets[name]
+      setattr(self, name, view[start:start + size].cast(formats[name]))
+
+    start = self.section_offsets["skip_offsets"]
+    self.skip_offsets = view[start:start + 8 * (num_terms + 1)].cast("Q")
+    start = self.section_offsets["skips"]
+    self.skips = view[start:start + 8 * self.skip_offsets[num_terms]].cast("I")
+    start = self.section_offsets["positions_offsets"]
+    self.positions_offsets = view[start:start + 8 * (num_terms + 1)].cast("Q")
+    if self.has_fields:
+      sizes = {
+        "title_lengths": 4 * num_docs,
+        "title_norms": 8 * num_docs,
+        "description_norms": 8 * num_docs,
+        "field_max_tfs": 16 * num_terms,
+        "title_tfs_offsets": 8 * (num_terms + 1),
+      }
+      formats = {"title_lengths": "i", "title_norms": "d", "description_norms": "d",
+                 "field_max_tfs": "d", "title_tfs_offsets": "Q"}
+      for name, size in sizes.items():
+        start = self.section_offsets[name]
+        setattr(self, name, view[start:start + size].cast(formats[name]))
+      self.title_tfs = _TermMapping(self, self.title_tfs_at)
+      self.field_max_tf = _TermMapping(self, lambda i: (self.field_max_tfs[2 * i], self.field_max_tfs[2 * i + 1]))
+
+    self.terms = _TermList(self)
+    self.postings = _TermMapping(self, self.postings_at)
+    self.idf = _TermMapping(self, lambda i: self.idfs[i])
+    self.max_impact = _TermMapping(self, lambda i: self.max_impacts[i])
+    self.doc_freq = _TermMapping(self, lambda i: self.dfs[i])
+
+  def term_at(self, i: int) -> bytes:
+    start = self.section_offsets["term_blob"]
+    return self.mm[start + self.term_offsets[i]:start + self.term_offsets[i + 1]]
+
+  def find(self, term: str) -> int | None:
+    """Binary search of the sorted term dictionary."""
+    key = term.encode("utf-8")
+    i = bisect.bisect_left(self.terms, key)
+    if i < self.num_terms and self.term_at(i) == key:
+      return i
+    return None
+
+  def postings_at(self, i: int) -> tuple[array, array]:
+    start = self.section_offsets["postings"]
+    return decode_postings(self.mm[start + self.postings_offsets[i]:start + self.postings_offsets[i + 1]])
+
+  def title_tfs_at(self, i: int) -> list[int]:
+    start = self.section_offsets["title_tfs"]
+    return decode_varints(self.mm[start + self.title_tfs_offsets[i]:start + self.title_tfs_offsets[i + 1]])
+
+  def cursor(self, term: str) -> "BlockCursor | None":
+    i = self.find(term)
+    if i is None:
+      return None
+    return BlockCursor(self, i)
+
+  def positions_at(self, i: int, posting: int) -> list[int]:
+    """Token positions of the posting-th posting of term number i."""
+    if not self.has_positions:
+      raise ValueError("The index has no token positions, rebuild it with positions.")
+    start = self.section_offsets["positions"] + self.positions_offsets[i]
+    entry_start, entry_end = POSITIONS_ENTRY.unpack_from(self.mm, start + 4 * posting)
+    data_start = start + 4 * (self.dfs[i] + 1)
+    positions = decode_varints(self.mm[data_start + entry_start:data_start + entry_end])
+    for k in range(1, len(positions)):
+      positions[k] += positions[k - 1]
+    return positions
+
+
+class BlockCursor:
+  """
+  Cursor over one term's postings in an IndexFile. Only the current block of
+  SKIP_INTERVAL postings is decoded; seek gallops over the skip entries and
+  then within the block.
+  """
+  def __init__(self, index_file: IndexFile, i: int):
+    self.index_file = index_file
+    self.term_number = i
+    self.df = index_file.dfs[i]
+    postings_start = index_file.section_offsets["postings"]
+    self.start = postings_start + index_file.postings_offsets[i]
+    self.end = postings_start + index_file.postings_offsets[i + 1]
+
+    skips = index_file.skips[2 * index_file.skip_offsets[i]:2 * index_file.skip_offsets[i + 1]]
+    # block b > 0 starts after ordinal block_previous[b - 1]
+    self.block_previous = skips[0::2]
+    self.block_starts = [0] + skips[1::2].tolist() + [self.end - self.start]
+
+    self.block = -1
+    self.__load_block(0)
+
+  def tf(self) -> int:
+    return self.tfs[self.pos]
+
+  def positions(self) -> list[int]:
+    return self.index_file.positions_at(self.term_number, self.block * SKIP_INTERVAL + self.pos)
+
+  def next(self) -> None:
+    self.pos += 1
+    if self.pos == len(self.ordinals):
+      self.__load_block(self.block + 1)
+    else:
+      self.doc = self.ordinals[self.pos]
+
+  def seek(self, target) -> None:
+    if target <= self.doc:
+      return
+    if target > self.ordinals[-1]:
+      # first block whose ordinals reach target
+      block = gallop(self.block_previous, target, self.block)
+      self.__load_block(block)
+      if self.doc >= target:
+        return
+    self.pos = gallop(self.ordinals, target, self.pos)
+    if self.pos == len(self.ordinals):
+      self.__load_block(self.block + 1)
+    else:
+      self.doc = self.ordinals[self.pos]
+
+  def __load_block(self, block: int) -> None:
+    if block >= len(self.block_starts) - 1:
+      self.block = len(self.block_starts) - 1
+      self.ordinals = array("i")
+      self.tfs = array("i")
+      self.pos = 0
+      self.doc = END_OF_POSTINGS
+      return
+
+    if block != self.block:
+      previous = self.block_previous[block - 1] if block > 0 else 0
+      data = self.index_file.mm[self.start + self.block_starts[block]:self.start + self.block_starts[block + 1]]
+      self.ordinals, self.tfs = decode_postings(data, previous)
+      self.block = block
+    self.pos = 0
+    self.doc = self.ordinals[0]
+
+
+class _TermList:
+  # sequence of encoded terms so bisect can search the dictionary in place
+  def __init__(self, index_file: IndexFile):
+    self.index_file = index_file
+
+  def __len__(self) -> int:
+    return self.index_file.num_terms
+
+  def __getitem__(self, i: int) -> bytes:
+    return self.index_file.term_at(i)
+
+
+class _TermMapping(Mapping):
+  # read-only term -> value mapping backed by the term dictionary
+  def __init__(self, index_file: IndexFile, value_at):
+    self.index_file = index_file
+    self.value_at = value_at
+
+  def __getitem__(self, term: str):
+    i = self.index_file.find(term)
+    if i is None:
+      raise KeyError(term)
+    return self.value_at(i)
+
+  def __contains__(self, term) -> bool:
+    return isinstance(term, str) and self.index_file.find(term) is not None
+
+  def __iter__(self):
+    for i in range(self.index_file.num_terms):
+      yield self.index_file.term_at(i).decode("utf-8")
+
+  def __len__(self) -> int:
+    return self.index_file.num_terms
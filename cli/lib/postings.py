@@ -0,0 +1,212 @@
+from typing import Callable, NamedTuple
+import bisect
+
+from .wand import END_OF_POSTINGS
+
+
+class PostingsSource(NamedTuple):
+  """
+  One run of postings cursors can walk: the in-memory index, the index file
+  or a segment. Its local ordinals are shifted by offset into the global
+  ordinal space and deleted holds its tombstoned local ordinals.
+  """
+  open_cursor: Callable
+  offset: int
+  num_docs: int
+  deleted: set[int]
+
+
+def gallop(seq, target, lo: int = 0) -> int:
+  """
+  Index of the first item >= target at or after lo. Probes lo+1, lo+3, lo+7,
+  ... before a binary search, so short moves cost O(log distance) rather
+  than O(log len(seq)).
+  """
+  n = len(seq)
+  step = 1
+  hi = lo
+  while hi < n and seq[hi] < target:
+    lo = hi + 1
+    hi += step
+    step *= 2
+  return bisect.bisect_left(seq, target, lo, min(hi, n))
+
+
+class ListCursor:
+  """
+  Cursor over in-memory postings.
+
+  Args:
+    ordinals: Sorted doc ordinals containing the term
+    tfs: Term frequencies aligned with ordinals
+    positions: Token positions per posting, if the index recorded them
+  """
+  def __init__(self, ordinals, tfs, positions=None):
+    self.ordinals = ordinals
+    self.tfs = tfs
+    self.position_lists = positions
+    self.df = len(ordinals)
+    self.pos = 0
+    self.doc = ordinals[0] if self.df > 0 else END_OF_POSTINGS
+
+  def tf(self) -> int:
+    return self.tfs[self.pos]
+
+  def positions(self) -> list[int]:
+    return self.position_lists[self.pos]
+
+  def next(self) -> None:
+    self.pos += 1
+    self.__update_doc()
+
+  def seek(self, target) -> None:
+    if target > self.doc:
+      self.pos = gallop(self.ordinals, target, self.pos)
+      self.__update_doc()
+
+  def __update_doc(self) -> None:
+    if self.pos < self.df:
+      self.doc = self.ordinals[self.pos]
+    else:
+      self.doc = END_OF_POSTINGS
+
+
+class AllCursor:
+  """Every ordinal below num_docs, the operand of a top-level NOT."""
+  def __init__(self, num_docs: int):
+    self.num_docs = num_docs
+    self.df = num_docs
+    self.doc = 0 if num_docs > 0 else END_OF_POSTINGS
+
+  def next(self) -> None:
+    self.seek(self.doc + 1)
+
+  def seek(self, target) -> None:
+    if target > self.doc:
+      self.doc = target if target < self.num_docs else END_OF_POSTINGS
+
+
+class IntersectionCursor:
+  """
+  Leapfrog intersection: the rarest list proposes candidates and the others
+  gallop to them, so the work is bounded by the rarest list's length times a
+  logarithmic seek. Candidates found in any excluded cursor are skipped.
+  While on a document every included cursor is positioned on it.
+  """
+  def __init__(self, cursors, excluded=()):
+    self.cursors = sorted(cursors, key=lambda c: c.df)
+    self.excluded = list(excluded)
+    self.df = self.cursors[0].df
+    self.doc = -1
+    self.__settle()
+
+  def next(self) -> None:
+    self.cursors[0].next()
+    self.__settle()
+
+  def seek(self, target) -> None:
+    if target > self.doc:
+      self.cursors[0].seek(target)
+      self.__settle()
+
+  def __settle(self) -> None:
+    lead, others = self.cursors[0], self.cursors[1:]
+    while lead.doc != END_OF_POSTINGS:
+      target = lead.doc
+      ahead = next((c.doc for c in others if not _lands_on(c, target)), None)
+      if ahead is not None:
+        lead.seek(ahead)
+      elif any(_lands_on(c, target) for c in self.excluded):
+        lead.next()
+      else:
+        break
+    self.doc = lead.doc
+
+
+class UnionCursor:
+  def __init__(self, cursors):
+    self.cursors = cursors
+    self.df = sum(c.df for c in cursors)
+    self.doc = min(c.doc for c in cursors)
+
+  def next(self) -> None:
+    for cursor in self.cursors:
+      if cursor.doc == self.doc:
+        cursor.next()
+    self.doc = min(c.doc for c in self.cursors)
+
+  def seek(self, target) -> None:
+    if target > self.doc:
+      for cursor in self.cursors:
+        cursor.seek(target)
+      self.doc = min(c.doc for c in self.cursors)
+
+
+class PhraseCursor:
+  """
+  Documents where terms occur in order within slop extra tokens. cursors maps
+  each distinct term to its cursor; positions are only read for documents
+  the intersection of all of them lands on.
+  """
+  def __init__(self, cursors: dict, terms: list[str], slop: int = 0):
+    self.cursors = cursors
+    self.terms = terms
+    self.slop = slop
+    self.matches = IntersectionCursor(list(cursors.values()))
+    self.df = self.matches.df
+    self.__settle()
+
+  def next(self) -> None:
+    self.matches.next()
+    self.__settle()
+
+  def seek(self, target) -> None:
+    if target > self.doc:
+      self.matches.seek(target)
+      self.__settle()
+
+  def __settle(self) -> None:
+    while self.matches.doc != END_OF_POSTINGS:
+      position_lists = [self.cursors[t].positions() for t in self.terms]
+      if phrase_frequency(position_lists, self.slop) > 0:
+        break
+      self.matches.next()
+    self.doc = self.matches.doc
+
+
+def _lands_on(cursor, target) -> bool:
+  cursor.seek(target)
+  return cursor.doc == target
+
+
+def intersect(cursors):
+  """Yields each ordinal common to cursors, with every cursor on it."""
+  if len(cursors) == 0:
+    return
+  cursor = IntersectionCursor(cursors)
+  while cursor.doc != END_OF_POSTINGS:
+    yield cursor.doc
+    cursor.next()
+
+
+def phrase_frequency(position_lists: list[list[int]], slop: int = 0) -> int:
+  """
+  Number of positions where the terms occur in the given order with at most
+  slop extra tokens between first and last (slop 0 is an exact phrase).
+  """
+  count = 0
+  starts = [0] * len(position_lists)
+  for start in position_lists[0]:
+    last = start
+    for k in range(1, len(position_lists)):
+      # the earliest next occurrence gives the tightest span for this start
+      positions = position_lists[k]
+      starts[k] = gallop(positions, last + 1, starts[k])
+      if starts[k] == len(positions):
+        return count
+      last = positions[starts[k]]
+      if last - start - k > slop:
+        break
+    else:
+      count += 1
+  return count
@@ -0,0 +1,196 @@
+"""
+Compressed codes for unit-length embeddings, searched without decoding:
+
+  int8  one signed byte per dimension, scaled per dimension (4x smaller)
+  pq    product quantization, one byte per PQ_SUBSPACES-th of the vector
+        naming its closest of 256 trained sub-centroids (16x smaller at 384
+        dims)
+
+A query is scored against every code with an asymmetric distance (the query
+stays full precision, only the documents are compressed) using a lookup
+table built once per query. The best shortlist rows are then rescored with
+their full-precision vectors, which only need to be read for those rows.
+"""
+import os
+
+import numpy as np
+
+# rows rescored with full precision, per result asked for
+RESCORE_FACTOR = 10
+
+PQ_SUBSPACES = 96
+PQ_CENTROIDS = 256
+PQ_ITERATIONS = 15
+# k-means trains each subspace on at most this many vectors
+PQ_TRAINING_SAMPLES = 64 * PQ_CENTROIDS
+
+# rows encoded at once, bounds the float temporaries
+BLOCK_ROWS = 1 << 16
+# rows scored at once; small enough for the decoded block to stay in cache
+SCORE_BLOCK_ROWS = 4096
+
+
+class ScalarQuantizer:
+  """x is approximated by codes * scales, codes int8 in [-127, 127]."""
+  def __init__(self, scales: np.ndarray):
+    self.scales = scales
+
+  @classmethod
+  def train(cls, vectors: np.ndarray) -> "ScalarQuantizer":
+    scales = np.abs(vectors).max(axis=0).astype(np.float32) / 127
+    return cls(np.where(scales == 0, 1, scales).astype(np.float32))
+
+  def encode(self, vectors: np.ndarray) -> np.ndarray:
+    codes = np.empty(vectors.shape, dtype=np.int8)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+      block = vectors[start:start + BLOCK_ROWS] / self.scales
+      codes[start:start + len(block)] = np.clip(np.rint(block), -127, 127)
+    return codes
+
+  def lookup(self, query: np.ndarray) -> np.ndarray:
+    return query * self.scales
+
+  def scores(self, codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+      block = codes[start:start + SCORE_BLOCK_ROWS]
+      scores[start:start + len(block)] = block.astype(np.float32) @ table
+    return scores
+
+  def arrays(self) -> dict[str, np.ndarray]:
+    return {"scales": self.scales}
+
+
+class ProductQuantizer:
+  """
+  The vector is cut into PQ_SUBSPACES equal slices, and each slice is
+  replaced by the id of its nearest centroid, trained per subspace with
+  k-means. The dot product with a query is the sum over subspaces of the
+  query slice's dot product with the chosen centroid, read from a
+  (subspaces, centroids) table.
+
+  Codes are stored subspace-major, (subspaces, vectors), so scoring is one
+  contiguous gather per subspace.
+  """
+  def __init__(self, centroids: np.ndarray):
+    # (subspaces, centroids, subspace dims)
+    self.centroids = centroids
+
+  @classmethod
+  def train(cls, vectors: np.ndarray, subspaces: int = PQ_SUBSPACES, seed: int = 0) -> "ProductQuantizer":
+    if vectors.shape[1] % subspaces != 0:
+      raise ValueError(f"Cannot split {vectors.shape[1]} dimensions into {subspaces} subspaces.")
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), PQ_TRAINING_SAMPLES)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+    slices = sample.reshape(len(sample), subspaces, -1)
+    centroids = np.stack([_kmeans(slices[:, m], min(PQ_CENTROIDS, len(sample)), rng) for m in range(subspaces)])
+    return cls(centroids)
+
+  def encode(self, vectors: np.ndarray) -> np.ndarray:
+    subspaces = len(self.centroids)
+    codes = np.empty((subspaces, len(vectors)), dtype=np.uint8)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+      slices = np.asarray(vectors[start:start + BLOCK_ROWS]).reshape(-1, subspaces, self.centroids.shape[2])
+      for m in range(subspaces):
+        codes[m, start:start + len(slices)] = _nearest(slices[:, m], self.centroids[m])
+    return codes
+
+  def lookup(self, query: np.ndarray) -> np.ndarray:
+    return np.einsum("mkd,md->mk", self.centroids, query.reshape(len(self.centroids), -1))
+
+  def scores(self, codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+    scores = np.zeros(codes.shape[1], dtype=np.float32)
+    for m in range(len(table)):
+      scores += table[m].take(codes[m])
+    return scores
+
+  def arrays(self) -> dict[str, np.ndarray]:
+    return {"centroids": self.centroids}
+
+
+def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+  # argmin |p - c|^2 = argmax p.c - |c|^2 / 2
+  return np.argmax(points @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+
+def _kmeans(points: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+  centroids = points[rng.choice(len(points), k, replace=False)].astype(np.float32)
+  for _ in range(PQ_ITERATIONS):
+    assigned = _nearest(points, centroids)
+    counts = np.bincount(assigned, minlength=k)
+    sums = np.zeros_like(centroids)
+    np.add.at(sums, assigned, points)
+    empty = counts == 0
+    centroids = sums / np.maximum(counts, 1)[:, None]
+    centroids[empty] = points[rng.choice(len(points), int(empty.sum()))]
+  return centroids.astype(np.float32)
+
+
+QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
+
+
+def quantized_path(embeddings_path: str, kind: str) -> str:
+  """Where the codes of an embeddings file are saved, e.g. chunk_embeddings.pq.npz."""
+  return f"{os.path.splitext(embeddings_path)[0]}.{kind}.npz"
+
+
+class QuantizedEmbeddings:
+  """Codes of an embeddings matrix plus the quantizer that decodes them."""
+  def __init__(self, kind: str, quantizer, codes: np.ndarray):
+    self.kind = kind
+    self.quantizer = quantizer
+    self.codes = codes
+
+  @property
+  def nbytes(self) -> int:
+    return self.codes.nbytes
+
+  @classmethod
+  def compress(cls, kind: str, vectors: np.ndarray) -> "QuantizedEmbeddings":
+    if kind not in QUANTIZERS:
+      raise ValueError(f"Unknown quantization '{kind}', expected one of {', '.join(QUANTIZERS)}.")
+    quantizer = QUANTIZERS[kind].train(vectors)
+    return cls(kind, quantizer, quantizer.encode(vectors))
+
+  @classmethod
+  def load_or_create(cls, kind: str, embeddings_path: str, vectors: np.ndarray) -> "QuantizedEmbeddings":
+    """
+    Loads the codes saved next to embeddings_path if they were made from
+    the current file, otherwise trains the quantizer, encodes and saves.
+    """
+    path = quantized_path(embeddings_path, kind)
+    stat = os.stat(embeddings_path)
+    stamp = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    if os.path.exists(path):
+      with np.load(path) as f:
+        if np.array_equal(f["embeddings_stamp"], stamp):
+          arrays = {name: f[name] for name in f.files if name not in ("codes", "embeddings_stamp")}
+          return cls(kind, QUANTIZERS[kind](**arrays), f["codes"])
+
+    quantized = cls.compress(kind, vectors)
+    with open(path, "wb") as f:
+      np.savez(f, codes=quantized.codes, embeddings_stamp=stamp, **quantized.quantizer.arrays())
+    return quantized
+
+  def search(self, vectors: np.ndarray, query: np.ndarray, shortlist: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (ids, exact scores) of the shortlist rows with the best approximate
+    scores. vectors are only read at those rows, so they can stay on disk.
+    """
+    approximate = self.approximate_scores(query)
+    shortlist = min(shortlist, len(approximate))
+    if shortlist <= 0:
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    # sorted, so a memory-mapped matrix is read front to back
+    ids = np.sort(np.argpartition(-approximate, shortlist - 1)[:shortlist])
+    return ids, rescore(vectors, ids, query)
+
+  def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+    """The query's dot product with every row, estimated from the codes."""
+    return self.quantizer.scores(self.codes, self.quantizer.lookup(query))
+
+
+def rescore(vectors: np.ndarray, ids: np.ndarray, query: np.ndarray) -> np.ndarray:
+  """Exact scores of the rows at ids, which should be sorted."""
+  return vectors[ids].astype(np.float32, copy=False) @ query
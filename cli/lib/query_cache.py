@@ -0,0 +1,259 @@
+"""
+Cache of search query embeddings, in two tiers:
+
+  memory  an LRU of the last memory_entries queries embedded or read in this
+          process
+  disk    shared by every process and run, one set of files per model
+          (see query_cache_path). query_embeddings.<model>.bin is a header
+          (magic, version, dims, model name) followed by one float32[dims]
+          record per query, appended as queries are embedded;
+          query_embeddings.<model>.keys holds the uint64 key of each
+          record, so opening the cache reads 8 bytes per entry to index it
+
+Queries are keyed by a hash of their lowercased, whitespace-collapsed text:
+the model is uncased, so those spellings have the same embedding. The disk
+tier holds at most disk_entries records: once full it is rewritten with the
+newest half. When the files were written for another model, opening them
+leaves them alone and this instance only caches in memory; only clear()
+and that rewrite remove records. Files that are not a cache at all, or
+that a crash left half written, are recreated by the next append.
+
+Appends take an exclusive lock on the .lock file, so processes can
+share the files. A process does not see records appended after it opened
+the cache; it embeds those queries again and appends them once more, the
+newest record of a key wins.
+"""
+from collections import OrderedDict
+import fcntl
+import hashlib
+import os
+import re
+import struct
+
+import numpy as np
+
+from .search_utils import QUERY_CACHE_PATH
+
+MAGIC = b"HQRY"
+VERSION = 1
+
+HEADER = struct.Struct("<4sIII")
+
+MEMORY_ENTRIES = 4096
+# 384 float32 dimensions are 1.5 KiB a query, so at most about 75 MiB
+DISK_ENTRIES = 50_000
+
+
+def query_cache_path(model_name: str) -> str:
+  """Disk file of the queries embedded by model_name, the name made safe for a file name."""
+  return QUERY_CACHE_PATH.format(name=re.sub(r"[^\w.+-]", "_", model_name))
+
+
+def query_key(query: str) -> int:
+  text = " ".join(query.lower().split())
+  return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class QueryEmbeddingCache:
+  def __init__(
+    self,
+    model_name: str,
+    path: str | None = None,
+    memory_entries: int = MEMORY_ENTRIES,
+    disk_entries: int = DISK_ENTRIES,
+  ):
+    self.model_name = model_name
+    self.path = path if path is not None else query_cache_path(model_name)
+    base = os.path.splitext(self.path)[0]
+    self.keys_path = base + ".keys"
+    self.lock_path = base + ".lock"
+    self.memory_entries = memory_entries
+    self.disk_entries = disk_entries
+
+    self.memory_hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+
+    self.__memory: OrderedDict[int, np.ndarray] = OrderedDict()
+    # key -> record number in the disk file
+    self.__rows: dict[int, int] = {}
+    self.__file = None
+    self.__dims = 0
+    self.__records_start = 0
+    # off while the files belong to another model
+    self.disk_enabled = True
+    self.__open()
+
+  @property
+  def disk_size(self) -> int:
+    return len(self.__rows)
+
+  def stats(self) -> dict:
+    return {
+      "memory_hits": self.memory_hits,
+      "disk_hits": self.disk_hits,
+      "misses": self.misses,
+      "memory_entries": len(self.__memory),
+      "disk_entries": len(self.__rows),
+    }
+
+  def get(self, query: str) -> np.ndarray | None:
+    key = query_key(query)
+    embedding = self.__memory.get(key)
+    if embedding is not None:
+      self.__memory.move_to_end(key)
+      self.memory_hits += 1
+      return embedding
+
+    row = self.__rows.get(key)
+    if row is not None:
+      embedding = self.__read(row)
+      self.disk_hits += 1
+      self.__remember(key, embedding)
+      return embedding
+
+    self.misses += 1
+    return None
+
+  def put(self, query: str, embedding: np.ndarray) -> None:
+    key = query_key(query)
+    embedding = np.asarray(embedding, dtype=np.float32)
+    self.__remember(key, embedding)
+    if self.disk_entries > 0 and self.disk_enabled:
+      self.__append(key, embedding)
+
+  def clear(self) -> None:
+    self.__memory.clear()
+    self.__rows = {}
+    if self.__file is not None:
+      self.__file.close()
+      self.__file = None
+    for path in (self.path, self.keys_path):
+      if os.path.exists(path):
+        os.remove(path)
+    self.disk_enabled = True
+
+  def __remember(self, key: int, embedding: np.ndarray) -> None:
+    self.__memory[key] = embedding
+    self.__memory.move_to_end(key)
+    while len(self.__memory) > self.memory_entries:
+      self.__memory.popitem(last=False)
+
+  def __record_size(self) -> int:
+    return 4 * self.__dims
+
+  def __locked(self):
+    os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+    lock = open(self.lock_path, "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+  def __open(self) -> None:
+    with self.__locked():
+      self.__load()
+
+  def __load(self) -> None:
+    """
+    Opens the disk file and indexes its keys, under the lock. The disk tier
+    is turned off if the file is another model's; if it is missing or
+    broken, no file is opened and the next append creates one.
+    """
+    if self.__file is not None:
+      self.__file.close()
+    self.__file = None
+    self.__rows = {}
+    self.disk_enabled = True
+    if not os.path.exists(self.path):
+      return
+
+    f = open(self.path, "rb")
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+      f.close()
+      return
+    magic, version, dims, model_length = HEADER.unpack(header)
+    model = f.read(model_length)
+    if magic != MAGIC or version != VERSION or dims == 0 or len(model) < model_length or not os.path.exists(self.keys_path):
+      f.close()
+      return
+    if model != self.model_name.encode("utf-8"):
+      f.close()
+      self.disk_enabled = False
+      return
+
+    self.__file = f
+    self.__dims = dims
+    self.__records_start = HEADER.size + model_length
+    keys = np.fromfile(self.keys_path, dtype=np.uint64)
+    records = (os.fstat(f.fileno()).st_size - self.__records_start) // self.__record_size()
+    # an interrupted append can leave one file a record ahead of the other
+    self.__rows = {key: row for row, key in enumerate(keys[:min(len(keys), records)].tolist())}
+
+  def __replaced(self) -> bool:
+    """Whether the disk file was compacted, cleared or created since it was opened."""
+    if self.__file is None:
+      return True
+    try:
+      return os.stat(self.path).st_ino != os.fstat(self.__file.fileno()).st_ino
+    except FileNotFoundError:
+      return True
+
+  def __read(self, row: int) -> np.ndarray:
+    size = self.__record_size()
+    # the open file, so rows stay valid if another process replaces it
+    return np.frombuffer(os.pread(self.__file.fileno(), size, self.__records_start + row * size), dtype=np.float32)
+
+  def __append(self, key: int, embedding: np.ndarray) -> None:
+    with self.__locked():
+      if self.__replaced():
+        self.__load()
+        if not self.disk_enabled:
+          return
+      if self.__file is None or self.__dims != len(embedding):
+        self.__create(len(embedding))
+
+      record_size = self.__record_size()
+      records = (os.path.getsize(self.path) - self.__records_start) // record_size
+      count = min(records, os.path.getsize(self.keys_path) // 8)
+      with open(self.path, "r+b") as f, open(self.keys_path, "r+b") as keys:
+        f.truncate(self.__records_start + count * record_size)
+        keys.truncate(count * 8)
+        f.seek(0, os.SEEK_END)
+        f.write(embedding.tobytes())
+        keys.seek(0, os.SEEK_END)
+        keys.write(np.uint64(key).tobytes())
+      self.__rows[key] = count
+
+      if count + 1 >= self.disk_entries:
+        self.__compact()
+
+  def __create(self, dims: int) -> None:
+    model = self.model_name.encode("utf-8")
+    with open(self.path + ".tmp", "wb") as f:
+      f.write(HEADER.pack(MAGIC, VERSION, dims, len(model)))
+      f.write(model)
+    os.replace(self.path + ".tmp", self.path)
+    # after the swap, so a crash never leaves keys without their file
+    open(self.keys_path, "wb").close()
+    self.__load()
+
+  def __compact(self) -> None:
+    """Rewrites the disk files with the newest half of the records, under the lock."""
+    keys = np.fromfile(self.keys_path, dtype=np.uint64)
+    first = max(0, len(keys) - max(1, self.disk_entries // 2))
+    record_size = self.__record_size()
+    self.__file.seek(0)
+    head = self.__file.read(self.__records_start)
+    records = os.pread(self.__file.fileno(), (len(keys) - first) * record_size, self.__records_start + first * record_size)
+
+    # write aside and swap, so other processes keep reading the old file
+    with open(self.path + ".tmp", "wb") as f:
+      f.write(head)
+      f.write(records)
+    keys[first:].tofile(self.keys_path + ".tmp")
+    # old keys would index the new records wrongly, so a crash between the
+    # swaps must find the keys emptied
+    open(self.keys_path, "wb").close()
+    os.replace(self.path + ".tmp", self.path)
+    os.replace(self.keys_path + ".tmp", self.keys_path)
+    self.__load()
@@ -1,29 +1,78 @@
 from collections import defaultdict
+from collections.abc import Sequence
+import heapq
 import math
 from typing import Counter
 from .search_utils import (
+  BM25_B,
+  BM25_K1,
   CACHE_DIR,
+  DEFAULT_FIELD_WEIGHTS,
   DEFAULT_SEARCH_LIMIT,
   DOCMAP_PATH,
+  INDEX_DOCS_PATH,
   INDEX_PATH,
+  LEGACY_INDEX_PATH,
   TERM_FREQUENCIES_PATH,
   DOCS_LENGTHS_PATH,
   load_movies,
-  load_stop_words,
 )
+from .autocomplete import TitleCompleter
+from .bm25_matrix import BM25Matrix
+from .doc_store import DocStore, write_doc_store
+from .index_build import build_postings
+from .index_format import IndexFile, write_index
+from .boolean_query import QueryParser, compile_query
+from .postings import ListCursor, PostingsSource, intersect, phrase_frequency
+from .spelling import CORRECTION_DISCOUNT, MAX_CORRECTIONS, TermCorrector
+from .segments import (
+  MAX_DELTA_SEGMENTS,
+  TERM_CACHE_SIZE,
+  LazyTermMapping,
+  SegmentSet,
+  clear_segments,
+  is_single_segment,
+  live_locations,
+  load_manifest,
+  merge_live_postings,
+  open_segments,
+  remove_segment_files,
+  save_manifest,
+  segment_paths,
+)
+from .tokenizer import get_tokenizer
+from .wand import END_OF_POSTINGS, TermCursor, wand_top_k
 
 import string
 from nltk.stem import PorterStemmer
 
+import bisect
+import functools
+import json
 import os
 import pickle
 
 
-def bm25_search_cmd(query: str, limit: int) -> list[dict]:
+def bm25_search_cmd(query: str, limit: int, engine: str = "wand", fuzzy: bool = False) -> tuple[list[dict], dict]:
+  idx = InvertedIndex()
+  idx.load()
+  
+  results = idx.bm25_search(query, limit, engine, fuzzy)
+  return results, idx.last_query_stats
+
+def bm25f_search_cmd(query: str, limit: int, field_weights: dict[str, float]) -> tuple[list[dict], dict[str, int]]:
   idx = InvertedIndex()
   idx.load()
   
-  return idx.bm25_search(query, limit)
+  results = idx.bm25f_search(query, limit, field_weights)
+  return results, idx.last_query_stats
+
+def phrase_search_cmd(phrase: str, limit: int, slop: int = 0) -> tuple[list[dict], dict[str, int]]:
+  idx = InvertedIndex()
+  idx.load()
+  
+  results = idx.phrase_search(phrase, limit, slop)
+  return results, idx.last_query_stats
 
 def bm25tf_cmd(doc_id: int, term: str, k1: float, b: float) -> float:
   idx = InvertedIndex()
@@ -64,84 +113,276 @@ def term_frequency_cmd(doc_id: int, term: str) -> int:
 def search_cmd(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
   idx = InvertedIndex()
   idx.load()
-  stop_words = load_stop_words()
-  
-  query_tokens = tokenize_text(query, stop_words)
-  
-  results = []
-  for t in query_tokens:
-    docs = idx.get_documents(t)
-    results.extend(docs)
-    if len(results) > limit:
-      break
   
-  return results[:limit]
+  return idx.boolean_search(query, limit)
 
-def build_cmd() -> None:
+def build_cmd(workers: int = 1, with_positions: bool = False) -> None:
     idx = InvertedIndex()
-    idx.build()
+    idx.build(workers, with_positions)
     idx.save()
+
+def convert_cmd() -> None:
+    idx = InvertedIndex()
+    idx.load_legacy()
+    idx.save()
+
+def ingest_cmd(path: str) -> int:
+  with open(path, "r") as f:
+    data = json.load(f)
+  movies = data["movies"] if isinstance(data, dict) else data
+  
+  idx = InvertedIndex()
+  idx.ingest(movies)
+  return len(movies)
+
+def delete_cmd(doc_ids: list[int]) -> int:
+  idx = InvertedIndex()
+  return idx.delete(doc_ids)
+
+def compact_cmd() -> None:
+  idx = InvertedIndex()
+  idx.compact()
   
 
-# basic comparison to query iterating movie
+def autocomplete_cmd(prefix: str, limit: int = DEFAULT_SEARCH_LIMIT) -> tuple[list[str], list[dict]]:
+  idx = InvertedIndex()
+  idx.load()
+  
+  return idx.complete_words(prefix, limit), idx.autocomplete(prefix, limit)
+
+# movies with a title word starting with any query word
 def search_cmd_basic(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
-  movies = load_movies()
-  stops_words = load_stop_words()
-  results = []
+  idx = InvertedIndex()
+  idx.load()
   
-  query_tokens = tokenize_text(query, stops_words)
-  for movie in movies:
-    title_tokens = tokenize_text(movie["title"], stops_words)
-    
-    if has_matching_token(query_tokens, title_tokens):
-      results.append(movie)
-      if len(results) >= limit:
-        break
-      
-  return results
+  words = [w for w in idx.tokenizer.words(query) if w not in idx.tokenizer.stop_words]
+  matches = idx.title_completer().match_any(words, limit)
+  return [idx.documents[ordinal] for ordinal, _ in matches]
 
 
 class InvertedIndex:
   def __init__(self):
+    # movie records by ordinal; after load() a DocStore read on demand
+    self.documents: Sequence[dict] = []
+    self.tokenizer = get_tokenizer()
+
+    # legacy pickled layout, only filled by load_legacy()
     self.index: dict[str, set[int]] = defaultdict(set)
-    self.docmap: dict[int, object] = {}
     self.term_frequencies: dict[int, Counter] = defaultdict(Counter)
     self.doc_lengths: dict[int, int] = {}
 
-  def __add_document(self, doc_id: int, text: str, stop_words: list[str]) -> None:
-    tokens = tokenize_text(text, stop_words)
-    for t in set(tokens):
-      self.index[t].add(doc_id)
-    
-    # count frequency
-    self.term_frequencies[doc_id].update(tokens)
-    self.doc_lengths[doc_id] = len(tokens)
+    # query-time structures and statistics, computed once at build time.
+    # documents are addressed by ordinal (their position in documents) so
+    # that postings are sorted arrays and ties keep document order.
+    # after load() these are views over the memory-mapped index file.
+    self.doc_ids: list[int] = []
+    self.lengths: list[int] = []
+    self.length_norms: list[float] = []
+    self.postings: dict[str, tuple[list[int], list[int]]] = {}
+    self.doc_freqs: dict[str, int] = {}
+    self.idf: dict[str, float] = {}
+    self.max_impacts: dict[str, float] = {}
+    self.avg_doc_length: float = 0.0
+
+    # token positions per posting, only recorded when built with_positions
+    self.positions: dict[str, list[list[int]]] | None = None
+    self.has_positions = False
+    # title/description statistics for bm25f_search, description lengths and
+    # tfs are the totals minus the title's
+    self.has_fields = False
+    self.title_lengths: list[int] = []
+    self.title_norms: list[float] = []
+    self.description_norms: list[float] = []
+    self.title_tfs: dict[str, list[int]] = {}
+    self.field_max_tfs: dict[str, tuple[float, float]] = {}
+
+    # runs of postings cursors can walk: the in-memory index, the index
+    # file or each segment
+    self.postings_sources: list[PostingsSource] = []
+
+    # ordinals with a tombstone, only non-empty when delta segments are loaded
+    self.deleted: set[int] = set()
+
+    # postings work done by the last bm25_search, to see what pruning saves
+    self.last_query_stats: dict[str, int] = {}
+    self.__ordinals: dict[int, int] | None = None
+    self.__matrix: BM25Matrix | None = None
+    self.__completer: TitleCompleter | None = None
+    self.__corrector: TermCorrector | None = None
+    # served from delta segments, so caches keyed on index.bin are stale
+    self.segmented = False
 
   def get_documents(self, term: str) -> list[object]:
     results = []
-    doc_ids = self.index.get(term, set())
-    for doc_id in doc_ids:
-      doc = self.docmap.get(doc_id)
-      if doc:
-        results.append(doc)
+    ordinals = self.postings.get(term, ([], []))[0]
+    for ordinal in ordinals:
+      if ordinal not in self.deleted:
+        results.append(self.documents[ordinal])
 
     # sort results by ID (optional)
     results.sort(key=lambda d: d["id"])
     return results
   
+  def __live_doc_count(self) -> int:
+    return len(self.doc_ids) - len(self.deleted)
+
   def __get_avg_doc_length(self) -> float:
-    if len(self.doc_lengths) == 0:
+    if self.__live_doc_count() == 0:
       return 0.0
     
-    lengths = self.doc_lengths.values()
-    total_sum = sum(lengths)
-    n = len(lengths)
+    if self.deleted:
+      total_sum = sum(l for o, l in enumerate(self.lengths) if o not in self.deleted)
+    else:
+      total_sum = sum(self.lengths)
+    n = self.__live_doc_count()
     return total_sum / n
 
+  def _compute_stats(self) -> None:
+    # ordinal postings from the dict-of-sets layout the legacy pickles use
+    self.__ordinals = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+    lengths = [self.doc_lengths[doc_id] for doc_id in self.doc_ids]
+
+    postings = {}
+    for term, doc_ids in self.index.items():
+      term_ordinals = sorted(self.__ordinals[doc_id] for doc_id in doc_ids)
+      tfs = [self.term_frequencies[self.doc_ids[o]][term] for o in term_ordinals]
+      postings[term] = (term_ordinals, tfs)
+
+    self._set_postings(lengths, postings)
+
+  def _set_postings(
+    self,
+    lengths: list[int],
+    postings: dict[str, tuple[list[int], list[int]]],
+    positions: dict[str, list[list[int]]] | None = None,
+  ) -> None:
+    """
+    Precomputes everything bm25_search needs so a query only touches the
+    postings of its own terms: BM25 IDF per term, avgdl, the per-document
+    length normalization k1 * (1 - b + b * dl/avgdl) and each term's max
+    score contribution (its WAND upper bound).
+    """
+    self.lengths = lengths
+    self.postings = postings
+    self.positions = positions
+    self.has_positions = positions is not None
+    self.postings_sources = [PostingsSource(self.__memory_cursor, 0, len(lengths), set())]
+    self.avg_doc_length = self.__get_avg_doc_length()
+
+    self.length_norms = []
+    for doc_length in self.lengths:
+      length_norm = 1 - BM25_B + BM25_B * (doc_length / self.avg_doc_length)
+      self.length_norms.append(BM25_K1 * length_norm)
+
+    self.doc_freqs = {}
+    self.idf = {}
+    self.max_impacts = {}
+    for term, (term_ordinals, tfs) in self.postings.items():
+      df, idf, max_impact = self.__term_stats(term_ordinals, tfs)
+      self.doc_freqs[term] = df
+      self.idf[term] = idf
+      self.max_impacts[term] = max_impact
+
+  def _set_fields(self, title_lengths: list[int] | None, title_tfs: dict[str, list[int]] | None) -> None:
+    """
+    Precomputes the BM25F statistics: each field's length normalization
+    1 - b + b * len/avglen per document, and per term the largest tf/norm in
+    each field, which bound the term's BM25F score for any field weights.
+    """
+    self.has_fields = title_lengths is not None
+    if not self.has_fields:
+      return
+    
+    self.title_lengths = title_lengths
+    self.title_tfs = title_tfs
+    self.title_norms = self.__field_norms(title_lengths)
+    self.description_norms = self.__field_norms([l - t for l, t in zip(self.lengths, title_lengths)])
+    self.field_max_tfs = {term: self.__field_max_tfs(term) for term in self.postings}
+
+  def __field_norms(self, field_lengths: list[int]) -> list[float]:
+    live = [l for o, l in enumerate(field_lengths) if o not in self.deleted]
+    avg_length = sum(live) / len(live) if len(live) > 0 else 0
+    if avg_length == 0:
+      return [1.0] * len(field_lengths)
+    return [1 - BM25_B + BM25_B * (l / avg_length) for l in field_lengths]
+
+  def __field_max_tfs(self, term: str) -> tuple[float, float] | None:
+    if term not in self.postings:
+      return None
+    ordinals, tfs = self.postings[term]
+    title_tfs = self.title_tfs[term]
+    max_title = max(tt / self.title_norms[o] for o, tt in zip(ordinals, title_tfs))
+    max_description = max((tf - tt) / self.description_norms[o] for o, tf, tt in zip(ordinals, tfs, title_tfs))
+    return max_title, max_description
+
+  def __term_stats(self, term_ordinals, tfs) -> tuple[int, float, float]:
+    N = self.__live_doc_count()
+    df = len(term_ordinals)
+    idf = math.log((N - df + 0.5) / (df + 0.5) + 1)
+    max_impact = max(
+      idf * self.__bm25_tf_component(tf, o) for o, tf in zip(term_ordinals, tfs)
+    )
+    return df, idf, max_impact
+
+  def __set_segments(self, segment_set: SegmentSet) -> None:
+    """
+    Serves queries from several segments at once. Global N and avgdl are
+    computed here; df, IDF and upper bounds of a term are computed from its
+    merged live postings the first time a query uses it.
+    """
+    self.segmented = True
+    self.documents = segment_set.documents
+    self.doc_ids = segment_set.doc_ids
+    self.deleted = segment_set.deleted
+    self.__ordinals = None
+    self._set_postings(segment_set.lengths, {})
+    self._set_fields(segment_set.title_lengths, {})
+    self.postings = segment_set.postings
+
+    stats = functools.lru_cache(maxsize=TERM_CACHE_SIZE)(self.__segment_term_stats)
+    terms = lambda: iter(self.postings)
+    self.doc_freqs = LazyTermMapping(terms, lambda term: stats(term)[0])
+    self.idf = LazyTermMapping(terms, lambda term: stats(term)[1])
+    self.max_impacts = LazyTermMapping(terms, lambda term: stats(term)[2])
+    self.has_positions = all(s.index_file.has_positions for s in segment_set.segments)
+    if self.has_fields:
+      self.title_tfs = segment_set.title_tfs
+      self.field_max_tfs = LazyTermMapping(terms, functools.lru_cache(maxsize=TERM_CACHE_SIZE)(self.__field_max_tfs))
+    self.postings_sources = [
+      PostingsSource(s.index_file.cursor, s.offset, s.index_file.num_docs, s.deleted)
+      for s in segment_set.segments
+    ]
+
+  def __segment_term_stats(self, term: str) -> tuple:
+    if term not in self.postings:
+      return None, None, None
+    return self.__term_stats(*self.postings[term])
+
+  def __memory_cursor(self, term: str) -> ListCursor | None:
+    if term not in self.postings:
+      return None
+    positions = self.positions[term] if self.positions is not None else None
+    return ListCursor(*self.postings[term], positions)
+
+  def __ordinal(self, doc_id: int) -> int:
+    # only the per-document helpers need this, so it is built on first use
+    if self.__ordinals is None:
+      self.__ordinals = {
+        doc_id: i for i, doc_id in enumerate(self.doc_ids) if i not in self.deleted
+      }
+    return self.__ordinals[doc_id]
+
+  def __term_frequency(self, ordinal: int, term: str) -> int:
+    if term not in self.postings:
+      return 0
+    ordinals, tfs = self.postings[term]
+    i = bisect.bisect_left(ordinals, ordinal)
+    if i < len(ordinals) and ordinals[i] == ordinal:
+      return tfs[i]
+    return 0
   
   def get_tf(self, doc_id, term):
-    stop_words = load_stop_words()
-    tokens = tokenize_text(term, stop_words)
+    tokens = self.tokenizer.tokenize(term)
     
     if len(tokens) == 0:
       return 0
@@ -150,35 +391,27 @@ class InvertedIndex:
       raise ValueError(f"Error at get_tf(): term has too many tokens.")
       
     t = tokens[0]
-    return self.term_frequencies[doc_id][t]
+    return self.__term_frequency(self.__ordinal(doc_id), t)
   
   
   def get_idf(self, term) -> float:
-    stop_words = load_stop_words()
-    tokens = tokenize_text(term, stop_words)
+    tokens = self.tokenizer.tokenize(term)
     
-    doc_count = len(self.docmap)
+    doc_count = self.__live_doc_count()
     term_doc_count = 0
     if len(tokens) == 1:
-      t = tokens[0]
-      doc_ids_set = self.index.get(t)
-      if (doc_ids_set):
-        term_doc_count = len(doc_ids_set)
+      term_doc_count = self.doc_freqs.get(tokens[0], 0)
     
     return math.log((doc_count + 1) / (term_doc_count + 1))
   
   def get_bm25_idf(self, term: str) -> float:
-    N = len(self.docmap)
+    N = self.__live_doc_count()
     
-    stop_words = load_stop_words()
-    tokens = tokenize_text(term, stop_words)
+    tokens = self.tokenizer.tokenize(term)
     if len(tokens) != 1:
       raise ValueError(f"Error at get_bm25_idf(): term has not a single token")
     
-    doc_ids = self.index.get(tokens[0])
-    df = 0
-    if doc_ids:
-      df = len(doc_ids)
+    df = self.doc_freqs.get(tokens[0], 0)
       
     return math.log((N - df + 0.5) / (df + 0.5) + 1)
   
@@ -186,8 +419,8 @@ class InvertedIndex:
   def get_bm25_tf(self, doc_id: int, term: str, k1: float, b: float) -> float:
     tf = self.get_tf(doc_id, term)
     
-    avg_doc_length = self.__get_avg_doc_length()
-    doc_length = self.doc_lengths[doc_id]
+    avg_doc_length = self.avg_doc_length
+    doc_length = self.lengths[self.__ordinal(doc_id)]
     
     # Length normalization factor
     length_norm = 1 - b + b * (doc_length /avg_doc_length)
@@ -204,65 +437,467 @@ class InvertedIndex:
     return bm25idf * bm25tf
   
   
-  def bm25_search(self, query, limit):
-    stop_words = load_stop_words()
-    q_tokens = tokenize_text(query, stop_words)
+  def __bm25_tf_component(self, tf: int, ordinal: int) -> float:
+    return (tf * (BM25_K1 + 1)) / (tf + self.length_norms[ordinal])
+
+  def _exhaustive_top_k(self, q_terms: list[tuple[str, float]], limit: int) -> list[tuple[int, float]]:
+    # term-at-a-time: accumulate scores only for docs in the query postings,
+    # adding term contributions in query order like the per-doc sum did
+    scores: dict[int, float] = {}
+    postings_scored = 0
+    for t, weight in q_terms:
+      postings = self.postings.get(t)
+      if postings is None:
+        continue
+      
+      idf = self.idf[t]
+      for ordinal, tf in zip(*postings):
+        scores[ordinal] = scores.get(ordinal, 0) + weight * (idf * self.__bm25_tf_component(tf, ordinal))
+      postings_scored += len(postings[0])
+    
+    self.last_query_stats["postings_scored"] = postings_scored
     
-    scores = {}
-    for doc_id in self.docmap:
+    # bounded heap; ties are broken by document order (lower ordinal first)
+    return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+  def _wand_top_k(self, q_terms: list[tuple[str, float]], limit: int) -> list[tuple[int, float]]:
+    term_weights: dict[str, float] = {}
+    for t, weight in q_terms:
+      if t in self.postings:
+        term_weights[t] = term_weights.get(t, 0) + weight
+    idf = {t: self.idf[t] for t in term_weights}
+    cursors = [
+      TermCursor(t, *self.postings[t], weight * self.max_impacts[t])
+      for t, weight in term_weights.items()
+    ]
+    
+    def score_doc(ordinal: int, on_doc: list[TermCursor]) -> float:
+      contributions = {
+        c.term: idf[c.term] * self.__bm25_tf_component(c.tf(), ordinal) for c in on_doc
+      }
+      # same summation order as the exhaustive path, so scores are identical
+      score = 0
+      for t, weight in q_terms:
+        if t in contributions:
+          score += weight * contributions[t]
+      return score
+    
+    top_results, postings_scored = wand_top_k(cursors, limit, score_doc)
+    self.last_query_stats["postings_scored"] = postings_scored
+    return top_results
+
+  def term_corrector(self) -> TermCorrector:
+    if self.__corrector is None:
+      self.__corrector = TermCorrector.load_or_create(self)
+    return self.__corrector
+
+  def __weighted_query(self, q_tokens: list[str], fuzzy: bool) -> list[tuple[str, float]]:
+    """
+    Query terms paired with their weight, 1 for the typed terms. With fuzzy,
+    a term missing from the index is replaced by up to MAX_CORRECTIONS close
+    vocabulary terms, weighted CORRECTION_DISCOUNT per edit.
+    """
+    q_terms = []
+    corrections = {}
+    for t in q_tokens:
+      if not fuzzy or t in self.postings:
+        q_terms.append((t, 1.0))
+        continue
+      
+      found = [(c, d) for c, d in self.term_corrector().candidates(t) if c in self.postings]
+      # closest first, then the most common
+      best = heapq.nsmallest(MAX_CORRECTIONS, found, key=lambda item: (item[1], -self.doc_freqs[item[0]], item[0]))
+      corrections[t] = [c for c, _ in best]
+      q_terms.extend((c, CORRECTION_DISCOUNT ** d) for c, d in best)
+    
+    self.last_query_stats["corrections"] = corrections
+    return q_terms
+
+  def bm25_matrix(self) -> BM25Matrix:
+    if self.__matrix is None:
+      self.__matrix = BM25Matrix.load_or_create(self)
+    return self.__matrix
+
+  def title_completer(self) -> TitleCompleter:
+    if self.__completer is None:
+      self.__completer = TitleCompleter.load_or_create(self)
+    return self.__completer
+
+  def complete_words(self, prefix: str, limit: int) -> list[str]:
+    """Title words the last word of prefix could complete to."""
+    words = self.tokenizer.words(prefix)
+    if len(words) == 0:
+      return []
+    return self.title_completer().complete_words(words[-1], limit)
+
+  def autocomplete(self, prefix: str, limit: int) -> list[dict]:
+    """
+    Top titles for partially typed input: the last word is a prefix and
+    the words before it must appear in the title. Ranked by the completer's
+    document prior, read from its per-prefix table for common prefixes, so
+    the cost follows the matches, not the corpus.
+    """
+    completions = self.title_completer().complete(self.tokenizer.words(prefix), limit)
+    return self.__enrich(completions)
+
+  def bm25_search(self, query, limit, engine: str = "wand", fuzzy: bool = False):
+    """
+    BM25 top-k with one of three engines that return identical results:
+    "wand" (pruned postings traversal), "exhaustive" (term-at-a-time over
+    all postings) or "matrix" (NumPy CSR, see bm25_matrix). fuzzy expands
+    terms the index does not know to their likely corrections.
+    """
+    self.last_query_stats = {}
+    q_terms = self.__weighted_query(self.tokenizer.tokenize(query), fuzzy)
+    self.last_query_stats["postings_total"] = sum(self.doc_freqs.get(t, 0) for t, _ in q_terms)
+    
+    match engine:
+      case "wand":
+        top_results = self._wand_top_k(q_terms, limit)
+      case "exhaustive":
+        top_results = self._exhaustive_top_k(q_terms, limit)
+      case "matrix":
+        top_results = self.bm25_matrix().search_many([q_terms], limit)[0]
+        self.last_query_stats["postings_scored"] = self.last_query_stats["postings_total"]
+      case _:
+        raise ValueError(f"Unknown BM25 engine: '{engine}'")
+    
+    return self.__enrich(self.__pad_results(top_results, limit))
+
+  def bm25f_search(self, query: str, limit: int, field_weights: dict[str, float] | None = None) -> list[dict]:
+    """
+    BM25F top-k. A term's title and description tfs are each divided by
+    their field's length normalization, weighted and summed before the k1
+    saturation, so a title hit outweighs a passing mention in a long
+    description. Runs on WAND like bm25_search, at the same postings cost.
+    """
+    if not self.has_fields:
+      raise ValueError("BM25F needs field statistics, rebuild the index.")
+    weights = {**DEFAULT_FIELD_WEIGHTS, **(field_weights or {})}
+    title_weight, description_weight = weights["title"], weights["description"]
+    if title_weight < 0 or description_weight < 0:
+      raise ValueError("Field weights must not be negative.")
+    
+    q_tokens = self.tokenizer.tokenize(query)
+    self.last_query_stats = {
+      "postings_total": sum(self.doc_freqs.get(t, 0) for t in q_tokens),
+    }
+    
+    term_counts = Counter(t for t in q_tokens if t in self.postings)
+    idf = {t: self.idf[t] for t in term_counts}
+    title_tfs = {t: self.title_tfs[t] for t in term_counts}
+    cursors = []
+    for t, count in term_counts.items():
+      max_title, max_description = self.field_max_tfs[t]
+      upper_bound = idf[t] * bm25f_saturation(title_weight * max_title + description_weight * max_description)
+      cursors.append(TermCursor(t, *self.postings[t], count * upper_bound))
+    
+    def score_doc(ordinal: int, on_doc: list[TermCursor]) -> float:
+      contributions = {}
+      for c in on_doc:
+        title_tf = title_tfs[c.term][c.pos]
+        pseudo_tf = (
+          title_weight * title_tf / self.title_norms[ordinal]
+          + description_weight * (c.tf() - title_tf) / self.description_norms[ordinal]
+        )
+        contributions[c.term] = idf[c.term] * bm25f_saturation(pseudo_tf)
       score = 0
       for t in q_tokens:
-        score += self.bm25(doc_id, t)
-      scores[doc_id] = score
+        if t in contributions:
+          score += contributions[t]
+      return score
     
-    sorted_docs = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    top_results, postings_scored = wand_top_k(cursors, limit, score_doc)
+    self.last_query_stats["postings_scored"] = postings_scored
+    # a zero field weight can zero a posting's score, such docs pad like the rest
+    top_results = [(ordinal, score) for ordinal, score in top_results if score > 0]
+    return self.__enrich(self.__pad_results(top_results, limit))
+
+  def phrase_search(self, phrase: str, limit: int, slop: int = 0) -> list[dict]:
+    """
+    Movies containing the phrase's terms in order, with at most slop extra
+    tokens in between (0 for an exact phrase), ranked by their BM25 score.
+    Postings are intersected by galloping from the rarest term and positions
+    are only decoded for documents that contain every term.
+    """
+    if not self.has_positions:
+      raise ValueError("Phrase search needs token positions, rebuild the index with 'build --positions'.")
     
-    top_results = sorted_docs[:limit]
+    q_tokens = self.tokenizer.tokenize(phrase)
+    terms = list(dict.fromkeys(q_tokens))
+    self.last_query_stats = {"candidates": 0, "matches": 0}
+    if len(terms) == 0 or any(t not in self.idf for t in terms):
+      return []
+    idf = {t: self.idf[t] for t in terms}
     
-    enriched_results = [
-      {"id": doc_id, "score": score, "movie": self.docmap[doc_id]}
-      for doc_id, score in top_results
-    ]
+    matches = []
+    for open_cursor, offset, _, deleted in self.postings_sources:
+      cursors = {t: open_cursor(t) for t in terms}
+      if any(c is None for c in cursors.values()):
+        continue
+      
+      for ordinal in intersect(list(cursors.values())):
+        self.last_query_stats["candidates"] += 1
+        if ordinal in deleted:
+          continue
+        if phrase_frequency([cursors[t].positions() for t in q_tokens], slop) == 0:
+          continue
+        
+        ordinal += offset
+        score = 0
+        for t in q_tokens:
+          score += idf[t] * self.__bm25_tf_component(cursors[t].tf(), ordinal)
+        matches.append((ordinal, score))
+    
+    self.last_query_stats["matches"] = len(matches)
+    top_results = heapq.nlargest(limit, matches, key=lambda item: (item[1], -item[0]))
+    return self.__enrich(top_results)
+
+  def boolean_search(self, query: str, limit: int) -> list[dict]:
+    """
+    First limit movies, in document order, matching a Boolean query (see
+    boolean_query). Cursors are advanced lazily, so the search stops as soon
+    as limit matches are found.
+    """
+    node = QueryParser(self.tokenizer).parse(query)
+    if node is None:
+      return []
+    
+    results = []
+    for source in self.postings_sources:
+      if len(results) >= limit:
+        break
+      cursor = compile_query(node, source.open_cursor, source.num_docs, self.has_positions)
+      while cursor.doc != END_OF_POSTINGS and len(results) < limit:
+        if cursor.doc not in source.deleted:
+          results.append(self.documents[source.offset + cursor.doc])
+        cursor.next()
+    return results
+
+  def bm25_search_many(self, queries: list[str], limit: int) -> list[list[dict]]:
+    """Scores a batch of queries at once with the matrix engine."""
+    token_lists = self.tokenizer.tokenize_many(queries)
+    q_terms = [[(t, 1.0) for t in tokens] for tokens in token_lists]
+    batch = self.bm25_matrix().search_many(q_terms, limit)
+    return [self.__enrich(top_results) for top_results in batch]
+
+  def __pad_results(self, top_results: list[tuple[int, float]], limit: int) -> list[tuple[int, float]]:
+    # docs without any query term score 0, pad with them in document order
+    if len(top_results) < limit:
+      scored = {ordinal for ordinal, _ in top_results}
+      ordinal = 0
+      while len(top_results) < limit and ordinal < len(self.doc_ids):
+        if ordinal not in scored and ordinal not in self.deleted:
+          top_results.append((ordinal, 0.0))
+        ordinal += 1
+    return top_results
+
+  def __enrich(self, top_results: list[tuple[int, float]]) -> list[dict]:
+    enriched_results = []
+    for ordinal, score in top_results:
+      doc_id = self.doc_ids[ordinal]
+      enriched_results.append({"id": doc_id, "score": score, "movie": self.documents[ordinal]})
 
     return enriched_results
 
-  def build(self) -> None:
-    movies = load_movies()
-    stop_words = load_stop_words()
+  def build(self, workers: int = 1, with_positions: bool = False) -> None:
+    """
+    Tokenizes every movie and builds the postings, optionally sharded over a
+    process pool. The index is the same whatever the number of workers.
+    with_positions also records token positions, needed by phrase_search.
+    """
+    self._index_movies(load_movies(), workers, with_positions)
 
-    for movie in movies:
-      doc_id = movie["id"]
-      text = f"{movie['title']} {movie['description']}"
-      self.__add_document(doc_id, text, stop_words)
-      self.docmap[doc_id] = movie
+  def _index_movies(self, movies: list[dict], workers: int = 1, with_positions: bool = False) -> None:
+    docs = [(movie["title"], movie["description"]) for movie in movies]
 
-  def save(self) -> None:
-    """Save index and docmap to disk using pickle."""
-    os.makedirs(CACHE_DIR, exist_ok=True)
+    self.documents = movies
+    self.doc_ids = [movie["id"] for movie in movies]
+    self.__ordinals = None
 
-    with open(INDEX_PATH, "wb") as f:
-      pickle.dump(self.index, f)
+    data = build_postings(docs, workers, with_positions)
+    self._set_postings(data.lengths, data.postings, data.positions)
+    self._set_fields(data.title_lengths, data.title_tfs)
 
-    with open(DOCMAP_PATH, "wb") as f:
-      pickle.dump(self.docmap, f)
-      
-    with open(TERM_FREQUENCIES_PATH, "wb") as f:
-      pickle.dump(self.term_frequencies, f)
-      
-    with open(DOCS_LENGTHS_PATH, "wb") as f:
-      pickle.dump(self.doc_lengths, f)
+  def save(self) -> None:
+    """
+    Save the binary index (see index_format) and the document store (see
+    doc_store) as the base segment. Any delta segments and tombstones are
+    dropped.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    self.__write(INDEX_PATH, INDEX_DOCS_PATH)
+    clear_segments()
+
+  def __write(self, index_path: str, docs_path: str) -> None:
+    write_index(
+      index_path,
+      doc_ids=self.doc_ids,
+      doc_lengths=self.lengths,
+      length_norms=self.length_norms,
+      avg_doc_length=self.avg_doc_length,
+      k1=BM25_K1,
+      b=BM25_B,
+      postings=self.postings,
+      idf=self.idf,
+      max_impacts=self.max_impacts,
+      positions=self.positions,
+      **self.__field_sections(),
+    )
+
+    write_doc_store(docs_path, self.documents)
+
+  def __field_sections(self) -> dict:
+    if not self.has_fields:
+      return {}
+    return {
+      "title_lengths": self.title_lengths,
+      "title_norms": self.title_norms,
+      "description_norms": self.description_norms,
+      "title_tfs": self.title_tfs,
+      "field_max_tfs": self.field_max_tfs,
+    }
 
   def load(self) -> None:
-    """Load index, docmap, term_frequencies from disk if they exist."""
-    if os.path.exists(INDEX_PATH):
-      with open(INDEX_PATH, "rb") as f:
+    """Memory-map the binary index and its document store."""
+    if not os.path.exists(INDEX_PATH):
+      raise ValueError(f"Loading failed: '{INDEX_PATH}' is missing.")
+
+    index_file = IndexFile(INDEX_PATH)
+    if (index_file.k1, index_file.b) != (BM25_K1, BM25_B):
+      raise ValueError(f"Loading failed: '{INDEX_PATH}' was built with other BM25 parameters, rebuild it.")
+
+    manifest = load_manifest()
+    if not is_single_segment(manifest):
+      self.__set_segments(SegmentSet(manifest))
+      return
+
+    self.documents = DocStore(INDEX_DOCS_PATH)
+    if len(self.documents) != index_file.num_docs:
+      raise ValueError(f"Loading failed: '{INDEX_DOCS_PATH}' does not match '{INDEX_PATH}', rebuild the index.")
+
+    self.doc_ids = index_file.doc_ids
+    self.lengths = index_file.doc_lengths
+    self.length_norms = index_file.length_norms
+    self.avg_doc_length = index_file.avg_doc_length
+    self.postings = index_file.postings
+    self.doc_freqs = index_file.doc_freq
+    self.idf = index_file.idf
+    self.max_impacts = index_file.max_impact
+    self.has_positions = index_file.has_positions
+    self.postings_sources = [PostingsSource(index_file.cursor, 0, index_file.num_docs, set())]
+    self.has_fields = index_file.has_fields
+    if self.has_fields:
+      self.title_lengths = index_file.title_lengths
+      self.title_norms = index_file.title_norms
+      self.description_norms = index_file.description_norms
+      self.title_tfs = index_file.title_tfs
+      self.field_max_tfs = index_file.field_max_tf
+
+  def ingest(self, movies: list[dict]) -> None:
+    """
+    Adds or replaces movies without a rebuild. They are indexed into a new
+    delta segment and older copies of the same ids get a tombstone.
+    """
+    movies = list({movie["id"]: movie for movie in movies}.values())
+    if len(movies) == 0:
+      return
+    
+    manifest = load_manifest()
+    segments = open_segments(manifest)
+    locations = live_locations(segments)
+    
+    name = f"seg-{manifest['next_segment']:06d}"
+    segment = InvertedIndex()
+    # deltas record positions when the base does, so phrases see every segment
+    segment._index_movies(movies, with_positions=segments[0].index_file.has_positions)
+    os.makedirs(os.path.dirname(segment_paths(name)[0]), exist_ok=True)
+    segment.__write(*segment_paths(name))
+    
+    for movie in movies:
+      if movie["id"] in locations:
+        number, ordinal = locations[movie["id"]]
+        manifest["segments"][number]["deleted"].append(ordinal)
+    manifest["segments"].append({"name": name, "deleted": []})
+    manifest["next_segment"] += 1
+    
+    obsolete = []
+    if len(manifest["segments"]) - 1 > MAX_DELTA_SEGMENTS:
+      obsolete = self.__merge_deltas(manifest)
+    save_manifest(manifest)
+    # only safe once the saved manifest no longer lists them
+    remove_segment_files(obsolete)
+
+  def delete(self, doc_ids: list[int]) -> int:
+    """Tombstones the live copy of each doc id. Returns how many were found."""
+    manifest = load_manifest()
+    locations = live_locations(open_segments(manifest))
+    
+    deleted = 0
+    for doc_id in set(doc_ids):
+      if doc_id in locations:
+        number, ordinal = locations[doc_id]
+        manifest["segments"][number]["deleted"].append(ordinal)
+        deleted += 1
+    
+    if deleted > 0:
+      save_manifest(manifest)
+    return deleted
+
+  def compact(self) -> None:
+    """
+    Merges every segment into a new base index, dropping tombstones. The
+    merge is first written as a segment and the manifest switched to it
+    alone, so the old base is unlisted before save() replaces its files
+    and drops the manifest; a crash in between leaves the merged segment
+    live, and the next compact finishes the job.
+    """
+    manifest = load_manifest()
+    if is_single_segment(manifest):
+      return
+    
+    merged = InvertedIndex()
+    merged.__set_merged(open_segments(manifest))
+    name = f"seg-{manifest['next_segment']:06d}"
+    merged.__write(*segment_paths(name))
+    save_manifest({"next_segment": manifest["next_segment"] + 1, "segments": [{"name": name, "deleted": []}]})
+    remove_segment_files([s["name"] for s in manifest["segments"]])
+    merged.save()
+
+  def __merge_deltas(self, manifest: dict) -> list[str]:
+    # ingest-time merge of the small segments, the base is left as it is.
+    # returns the names of the segments that were merged away.
+    deltas = manifest["segments"][1:]
+    merged = InvertedIndex()
+    merged.__set_merged(open_segments(manifest)[1:])
+    
+    manifest["segments"] = manifest["segments"][:1]
+    if len(merged.doc_ids) > 0:
+      name = f"seg-{manifest['next_segment']:06d}"
+      merged.__write(*segment_paths(name))
+      manifest["segments"].append({"name": name, "deleted": []})
+      manifest["next_segment"] += 1
+    return [d["name"] for d in deltas]
+
+  def __set_merged(self, segments) -> None:
+    self.doc_ids, self.documents, data = merge_live_postings(segments)
+    self.__ordinals = None
+    self._set_postings(data.lengths, data.postings, data.positions)
+    self._set_fields(data.title_lengths, data.title_tfs)
+
+  def load_legacy(self) -> None:
+    """Load the old pickled index, docmap, term_frequencies and doc_lengths."""
+    if os.path.exists(LEGACY_INDEX_PATH):
+      with open(LEGACY_INDEX_PATH, "rb") as f:
         self.index = pickle.load(f)
     else:
-      raise ValueError(f"Loading failed: '{INDEX_PATH}' is missing.")
+      raise ValueError(f"Loading failed: '{LEGACY_INDEX_PATH}' is missing.")
 
     if os.path.exists(DOCMAP_PATH):
       with open(DOCMAP_PATH, "rb") as f:
-        self.docmap = pickle.load(f)
+        docmap = pickle.load(f)
+      self.doc_ids = list(docmap)
+      self.documents = list(docmap.values())
     else:
       raise ValueError(f"Loading failed: '{DOCMAP_PATH}' is missing.")
     
@@ -277,11 +912,12 @@ class InvertedIndex:
         self.doc_lengths = pickle.load(f)
     else:
       raise ValueError(f"Loading failed: '{DOCS_LENGTHS_PATH}' is missing.")
-    
-def has_matching_token(query_tokens: list[str], title_tokens: list[str]) -> bool:
-  # Check if any token in list1 is a substring of any token in list2
-  return any(q_token in t_token for q_token in query_tokens for t_token in title_tokens)
 
+    self._compute_stats()
+    
+def bm25f_saturation(pseudo_tf: float) -> float:
+  # BM25 tf saturation; the length normalization is already in pseudo_tf
+  return (pseudo_tf * (BM25_K1 + 1)) / (BM25_K1 + pseudo_tf)
 
 def preprocess_text(text: str) -> str:
   """
@@ -4,6 +4,19 @@ import os
 DEFAULT_SEARCH_LIMIT = 5
 BM25_K1 = 1.5
 BM25_B = 0.75
+# BM25F field weights, a title hit counts this much more than a description one
+DEFAULT_FIELD_WEIGHTS = {"title": 2.0, "description": 1.0}
+
+# semantic search settings the CLIs offer, here so parsing arguments needs
+# neither numpy nor the model
+MODEL_NAME = "all-MiniLM-L6-v2"
+# encoder backends (see encoders)
+ENCODERS = ("sentence-transformers", "pool", "int8", "hash")
+DEFAULT_ENCODER = "sentence-transformers"
+# compressed embedding formats (see quantization)
+QUANTIZATIONS = ("int8", "pq")
+# inverted lists scanned per query; more lists, better recall, slower search
+DEFAULT_NPROBE = 8
 
 # Define project-level paths
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
@@ -13,15 +26,39 @@ STOP_WORDS_PATH = os.path.join(PROJECT_ROOT,"data", "stopwords.txt")
 
 CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
 
-INDEX_PATH = os.path.join(CACHE_DIR, "index.pkl")
+INDEX_PATH = os.path.join(CACHE_DIR, "index.bin")
+# records of the indexed movies, in index ordinal order (see doc_store)
+INDEX_DOCS_PATH = os.path.join(CACHE_DIR, "index_docs.bin")
+# records of movies.json, in file order, for the semantic and hybrid search
+DOCS_PATH = os.path.join(CACHE_DIR, "docs.bin")
+
+# delta segments and tombstones added by the keyword CLI `ingest`/`delete`
+SEGMENTS_DIR = os.path.join(CACHE_DIR, "segments")
+SEGMENTS_MANIFEST_PATH = os.path.join(SEGMENTS_DIR, "manifest.json")
+# BM25 weights compiled from index.bin for the matrix engine
+BM25_MATRIX_PATH = os.path.join(CACHE_DIR, "bm25_matrix.npz")
+# title word prefix dictionary for the keyword CLI `autocomplete`
+AUTOCOMPLETE_PATH = os.path.join(CACHE_DIR, "autocomplete.npz")
+# character n-grams of the index vocabulary for bm25search --fuzzy
+SPELLING_PATH = os.path.join(CACHE_DIR, "spelling.npz")
+
+# legacy pickled index, only read by the keyword CLI `convert` command
+LEGACY_INDEX_PATH = os.path.join(CACHE_DIR, "index.pkl")
 DOCMAP_PATH = os.path.join(CACHE_DIR, "docmap.pkl")
 TERM_FREQUENCIES_PATH = os.path.join(CACHE_DIR, "term_frequencies.pkl")
 DOCS_LENGTHS_PATH = os.path.join(CACHE_DIR, "doc_lengths.pkl")
 
-EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "movie_embeddings.npy")
+# unit-length embeddings keyed by content hash (see embedding_file)
+EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "movie_embeddings.bin")
 
-CHUNK_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "chunk_embeddings.npy")
-CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.json")
+CHUNK_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "chunk_embeddings.bin")
+# int32 movie_idx, chunk_idx and total_chunks of each chunk embedding
+CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.npz")
+# IVF (approximate nearest neighbour) index over the chunk embeddings
+CHUNK_IVF_PATH = os.path.join(CACHE_DIR, "chunk_ivf.npz")
+# embeddings of past search queries, one file per encoder name next to a
+# .keys and a .lock file (see query_cache)
+QUERY_CACHE_PATH = os.path.join(CACHE_DIR, "query_embeddings.{name}.bin")
 
 
 def load_movies() -> list[dict]:
@@ -0,0 +1,274 @@
+"""
+Segmented (LSM-style) layout for InvertedIndex.
+
+The base segment is the regular index.bin + index_docs.bin. Ingested movies
+go to small delta segments written in the same formats, and removals or
+replaced movies are recorded as tombstones (deleted local ordinals) in a JSON
+manifest. Segments are addressed by one global ordinal space: each segment's
+ordinals are shifted by the number of documents in the segments before it.
+
+The manifest is the commit point. New segment files are written before a
+manifest lists them and removed only after it stops listing them, so after
+a crash the saved manifest always describes files that exist.
+"""
+from collections.abc import Mapping
+import functools
+import heapq
+import itertools
+import json
+import os
+
+from .doc_store import ChainedDocs, DocStore
+from .index_build import IndexData
+from .index_format import IndexFile
+from .search_utils import INDEX_DOCS_PATH, INDEX_PATH, SEGMENTS_DIR, SEGMENTS_MANIFEST_PATH
+
+BASE_SEGMENT = "base"
+
+# once there are more delta segments than this, ingest merges them into one
+MAX_DELTA_SEGMENTS = 8
+
+# merged postings of recently queried terms, per loaded segment set
+TERM_CACHE_SIZE = 1024
+
+
+def load_manifest() -> dict:
+  if not os.path.exists(SEGMENTS_MANIFEST_PATH):
+    return {"next_segment": 1, "segments": [{"name": BASE_SEGMENT, "deleted": []}]}
+
+  with open(SEGMENTS_MANIFEST_PATH, "r") as f:
+    return json.load(f)
+
+
+def save_manifest(manifest: dict) -> None:
+  os.makedirs(SEGMENTS_DIR, exist_ok=True)
+  tmp_path = SEGMENTS_MANIFEST_PATH + ".tmp"
+  with open(tmp_path, "w") as f:
+    json.dump(manifest, f, indent=2)
+  # atomic swap so a crash never leaves a half-written manifest
+  os.replace(tmp_path, SEGMENTS_MANIFEST_PATH)
+
+
+def is_single_segment(manifest: dict) -> bool:
+  """Whether the base index alone is live, so it can be served directly."""
+  segments = manifest["segments"]
+  return len(segments) == 1 and segments[0]["name"] == BASE_SEGMENT and len(segments[0]["deleted"]) == 0
+
+
+def segment_paths(name: str) -> tuple[str, str]:
+  """Paths of a segment's index file and document store."""
+  if name == BASE_SEGMENT:
+    return INDEX_PATH, INDEX_DOCS_PATH
+  return os.path.join(SEGMENTS_DIR, f"{name}.bin"), os.path.join(SEGMENTS_DIR, f"{name}.docs.bin")
+
+
+def remove_segment_files(names: list[str]) -> None:
+  for name in names:
+    if name == BASE_SEGMENT:
+      continue
+    for path in segment_paths(name):
+      if os.path.exists(path):
+        os.remove(path)
+
+
+def clear_segments() -> None:
+  """Drops every delta segment and tombstone, leaving the base index alone."""
+  if os.path.exists(SEGMENTS_MANIFEST_PATH):
+    manifest = load_manifest()
+    # the manifest goes first, a crash then leaves unlisted files, not a
+    # manifest listing missing ones
+    os.remove(SEGMENTS_MANIFEST_PATH)
+    remove_segment_files([s["name"] for s in manifest["segments"]])
+
+
+class Segment:
+  def __init__(self, name: str, deleted: list[int], offset: int):
+    index_path, docs_path = segment_paths(name)
+    if not os.path.exists(index_path):
+      raise ValueError(f"Loading failed: '{index_path}' is missing.")
+    if not os.path.exists(docs_path):
+      raise ValueError(f"Loading failed: '{docs_path}' is missing.")
+
+    self.name = name
+    self.index_file = IndexFile(index_path)
+    self.docs_path = docs_path
+    self.deleted = set(deleted)
+    self.offset = offset
+
+  @functools.cached_property
+  def docs(self) -> DocStore:
+    return DocStore(self.docs_path)
+
+  def live_ordinals(self):
+    for ordinal in range(self.index_file.num_docs):
+      if ordinal not in self.deleted:
+        yield ordinal
+
+
+def open_segments(manifest: dict) -> list[Segment]:
+  segments = []
+  offset = 0
+  for entry in manifest["segments"]:
+    segment = Segment(entry["name"], entry["deleted"], offset)
+    segments.append(segment)
+    offset += segment.index_file.num_docs
+  return segments
+
+
+def live_locations(segments: list[Segment]) -> dict[int, tuple[int, int]]:
+  """doc_id -> (segment number, local ordinal) of every live document."""
+  found = {}
+  for number, segment in enumerate(segments):
+    for ordinal in segment.live_ordinals():
+      found[segment.index_file.doc_ids[ordinal]] = (number, ordinal)
+  return found
+
+
+def vocabulary(segments: list[Segment]):
+  """Sorted union of the segments' term dictionaries."""
+  merged = heapq.merge(*[segment.index_file.postings for segment in segments])
+  for term, _ in itertools.groupby(merged):
+    yield term
+
+
+def merge_live_postings(segments: list[Segment]):
+  """
+  Copies the live documents of segments into one ordinal space, in segment
+  order, dropping tombstones. Returns (doc_ids, docs, IndexData); positions
+  and field statistics are kept only if every segment recorded them.
+  """
+  with_positions = all(segment.index_file.has_positions for segment in segments)
+  with_fields = all(segment.index_file.has_fields for segment in segments)
+
+  doc_ids: list[int] = []
+  docs: list[dict] = []
+  lengths: list[int] = []
+  title_lengths: list[int] | None = [] if with_fields else None
+  new_ordinals: list[dict[int, int]] = []
+  for segment in segments:
+    renumbered = {}
+    for ordinal in segment.live_ordinals():
+      renumbered[ordinal] = len(lengths)
+      lengths.append(segment.index_file.doc_lengths[ordinal])
+      if with_fields:
+        title_lengths.append(segment.index_file.title_lengths[ordinal])
+      doc_ids.append(segment.index_file.doc_ids[ordinal])
+      docs.append(segment.docs[ordinal])
+    new_ordinals.append(renumbered)
+
+  postings: dict[str, tuple[list[int], list[int]]] = {}
+  positions: dict[str, list[list[int]]] | None = {} if with_positions else None
+  title_tfs: dict[str, list[int]] | None = {} if with_fields else None
+  for term in vocabulary(segments):
+    ordinals, tfs, term_positions, term_title_tfs = [], [], [], []
+    for segment, renumbered in zip(segments, new_ordinals):
+      i = segment.index_file.find(term)
+      if i is None:
+        continue
+      segment_title_tfs = segment.index_file.title_tfs_at(i) if with_fields else None
+      for posting, (ordinal, tf) in enumerate(zip(*segment.index_file.postings_at(i))):
+        if ordinal in renumbered:
+          ordinals.append(renumbered[ordinal])
+          tfs.append(tf)
+          if with_positions:
+            term_positions.append(segment.index_file.positions_at(i, posting))
+          if with_fields:
+            term_title_tfs.append(segment_title_tfs[posting])
+    if len(ordinals) > 0:
+      postings[term] = (ordinals, tfs)
+      if with_positions:
+        positions[term] = term_positions
+      if with_fields:
+        title_tfs[term] = term_title_tfs
+
+  return doc_ids, docs, IndexData(lengths, postings, positions, title_lengths, title_tfs)
+
+
+class SegmentSet:
+  """
+  Live view over the segments listed in a manifest. Postings of a term are
+  the concatenation of each segment's postings, shifted to global ordinals,
+  minus tombstones; they are merged on first use and cached.
+  """
+  def __init__(self, manifest: dict):
+    self.segments = open_segments(manifest)
+
+    self.doc_ids: list[int] = []
+    self.lengths: list[int] = []
+    self.deleted: set[int] = set()
+    self.has_fields = all(segment.index_file.has_fields for segment in self.segments)
+    self.title_lengths: list[int] | None = [] if self.has_fields else None
+    for segment in self.segments:
+      self.doc_ids.extend(segment.index_file.doc_ids)
+      self.lengths.extend(segment.index_file.doc_lengths)
+      if self.has_fields:
+        self.title_lengths.extend(segment.index_file.title_lengths)
+      self.deleted.update(segment.offset + o for o in segment.deleted)
+    # by global ordinal, tombstoned documents included
+    self.documents = ChainedDocs([segment.docs for segment in self.segments])
+
+    self.__term_postings = functools.lru_cache(maxsize=TERM_CACHE_SIZE)(self.__merge_term_postings)
+    self.postings = LazyTermMapping(lambda: vocabulary(self.segments), self.__term_postings)
+    self.title_tfs = LazyTermMapping(
+      lambda: iter(self.postings),
+      functools.lru_cache(maxsize=TERM_CACHE_SIZE)(self.__merge_title_tfs),
+    )
+
+  def __merge_term_postings(self, term: str):
+    ordinals, tfs = [], []
+    for segment in self.segments:
+      if term not in segment.index_file.postings:
+        continue
+      for ordinal, tf in zip(*segment.index_file.postings[term]):
+        if ordinal not in segment.deleted:
+          ordinals.append(segment.offset + ordinal)
+          tfs.append(tf)
+
+    if len(ordinals) == 0:
+      return None
+    return ordinals, tfs
+
+  def __merge_title_tfs(self, term: str):
+    # aligned with the merged postings of term
+    if not self.has_fields:
+      return None
+    title_tfs = []
+    for segment in self.segments:
+      i = segment.index_file.find(term)
+      if i is None:
+        continue
+      ordinals = segment.index_file.postings_at(i)[0]
+      for ordinal, title_tf in zip(ordinals, segment.index_file.title_tfs_at(i)):
+        if ordinal not in segment.deleted:
+          title_tfs.append(title_tf)
+
+    if len(title_tfs) == 0:
+      return None
+    return title_tfs
+
+
+class LazyTermMapping(Mapping):
+  """
+  Read-only term -> value mapping whose values are computed on access.
+  compute returns None for terms that are not in the mapping.
+  """
+  def __init__(self, keys, compute):
+    self.keys_source = keys
+    self.compute = compute
+
+  def __getitem__(self, term: str):
+    value = self.compute(term)
+    if value is None:
+      raise KeyError(term)
+    return value
+
+  def __contains__(self, term) -> bool:
+    return self.compute(term) is not None
+
+  def __iter__(self):
+    for term in self.keys_source():
+      if term in self:
+        yield term
+
+  def __len__(self) -> int:
+    return sum(1 for _ in self)
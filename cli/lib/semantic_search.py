@@ -1,19 +1,41 @@
 
+import hashlib
 import os
-import re
 import textwrap
-from sentence_transformers import SentenceTransformer
+from array import array
+from collections.abc import Iterable, Sequence
 import numpy as np
 
-from cli.lib.search_utils import EMBEDDINGS_PATH, load_movies
+from cli.lib.doc_store import DocStore, load_documents
+from cli.lib.embedding_file import EmbeddingFile, EmbeddingWriter, write_embeddings
+from cli.lib.encoders import DEFAULT_ENCODER, Encoder, SentenceTransformerEncoder, make_encoder
+from cli.lib.quantization import RESCORE_FACTOR, SCORE_BLOCK_ROWS, QuantizedEmbeddings
+from cli.lib.query_cache import QueryEmbeddingCache
+from cli.lib.search_utils import EMBEDDINGS_PATH
+
+# what a movie embedding is encoded from, part of its content key
+DOCUMENT_PARAMS = "title: description"
+# queries scored by one matrix product in the batch searches, bounds the
+# (rows, queries) score matrix
+QUERY_BATCH = 256
+# texts encoded per model call while building, and batches between
+# checkpoints of an interrupted build
+ENCODE_BATCH = 256
+CHECKPOINT_BATCHES = 16
 
 class SemanticSearch:
-  def __init__(self):
-    # Load the model (downloads automatically the first time)
-    self.model = SentenceTransformer('all-MiniLM-L6-v2')
+  def __init__(self, quantization: str | None = None, encoder: Encoder | None = None):
+    # the model, or another backend (see encoders)
+    self.encoder = encoder if encoder is not None else make_encoder()
+    # unit-length float32 or float16 rows, so cosine similarity is a dot
+    # product, memory-mapped read-only from the embeddings file. with a
+    # quantization they are only read to rescore a shortlist, see quantization
     self.embeddings = None
+    self.quantization = quantization
+    self.quantized: QuantizedEmbeddings | None = None
+    # movie records by position, usually a DocStore read on demand
     self.documents = None
-    self.document_map = {}
+    self.query_cache = QueryEmbeddingCache(self.encoder.name)
     pass
   
   def generate_embedding(self, text: str):
@@ -21,73 +43,102 @@ class SemanticSearch:
     if len(text) == 0:
       raise ValueError("Invalid text input: empty text.")
     
-    output = self.model.encode(text)
+    output = self.encoder.encode(text)
     if len(output) == 0:
       raise ValueError("Error creating embedding. No output was returned.")
     
     return output
   
-  def build_embeddings(self, documents: list[dict]):
+  def embed_query(self, query: str) -> np.ndarray:
+    """Unit-length embedding of a search query, from the query cache when it was embedded before."""
+    embedding = self.query_cache.get(query)
+    if embedding is None:
+      embedding = normalize_rows(self.generate_embedding(query))
+      self.query_cache.put(query, embedding)
+    return embedding
+  
+  def embed_queries(self, queries: list[str]) -> np.ndarray:
+    """
+    Unit-length embeddings of queries, one row each. The queries missing
+    from the query cache are encoded in a single batch.
+    """
+    embeddings = {query: self.query_cache.get(query) for query in queries}
+    missing = [query for query, embedding in embeddings.items() if embedding is None]
+    if len(missing) > 0:
+      if any(len(query.strip()) == 0 for query in missing):
+        raise ValueError("Invalid text input: empty text.")
+      encoded = normalize_rows(self.encoder.encode([query.strip() for query in missing]))
+      for query, embedding in zip(missing, encoded):
+        embeddings[query] = embedding
+        self.query_cache.put(query, embedding)
+    return np.stack([embeddings[query] for query in queries])
+  
+  def build_embeddings(self, documents: Sequence[dict], float16: bool = False):
+    """
+    Embeds the documents, encoding only those whose title or description
+    changed since the embeddings file was written.
+    """
     self.documents = documents
-    for doc in documents:
-      self.document_map[doc["id"]] = doc
 
-    doc_strings = []
-    for doc in documents:
-      doc_strings.append(f"{doc['title']}: {doc['description']}")
-    
-    self.embeddings = self.model.encode(doc_strings, show_progress_bar=True)
-    
-    with open(EMBEDDINGS_PATH, 'wb') as f:
-      np.save(f, self.embeddings)
+    doc_strings = (f"{doc['title']}: {doc['description']}" for doc in documents)
+    encoded = build_embeddings_file(EMBEDDINGS_PATH, self.encoder, doc_strings, DOCUMENT_PARAMS, np.float16 if float16 else np.float32)
+    print(f"Encoded {encoded} new or changed documents, reused {len(documents) - encoded}")
+    self.embeddings = EmbeddingFile(EMBEDDINGS_PATH).vectors
     
     return self.embeddings
   
-  def load_or_create_embeddings(self, documents: list[dict]):
+  def load_or_create_embeddings(self, documents: Sequence[dict], float16: bool = False):
     self.documents = documents
-    for doc in documents:
-      self.document_map[doc["id"]] = doc
       
-    if os.path.exists(EMBEDDINGS_PATH):
-      with open(EMBEDDINGS_PATH, 'rb') as f:
-        self.embeddings = np.load(f)
-
-      if len(self.embeddings) == len(self.documents):
-        return self.embeddings
+    self.embeddings = None
+    if not modified_since(documents, EMBEDDINGS_PATH):
+      self.embeddings = load_embeddings(EMBEDDINGS_PATH, len(documents), self.encoder.name, float16)
+    if self.embeddings is None:
+      self.build_embeddings(documents, float16)
     
-    return self.build_embeddings(documents)
+    if self.quantization is not None:
+      self.quantized = QuantizedEmbeddings.load_or_create(self.quantization, EMBEDDINGS_PATH, self.embeddings)
+    return self.embeddings
 
   def search(self, query, limit):
     if self.embeddings is None or self.embeddings.size == 0:
       raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
     
-    query_embedding = self.generate_embedding(query)
-    
-    similarities = []
-    for i, doc_embedding in enumerate(self.embeddings):
-      similarity = cosine_similarity(query_embedding,doc_embedding)
-      doc = self.documents[i]
-      similarities.append((similarity, doc))
-      
-    
-    similarities.sort(key=lambda x: x[0], reverse=True)
+    query_embedding = self.embed_query(query)
+    return self.__results(*score_rows(self.embeddings, self.quantized, query_embedding, limit), limit)
+
+  def search_many(self, queries: list[str], limit: int) -> list[list[dict]]:
+    """search for each of queries, embedded in one batch and scored by matrix products."""
+    if self.embeddings is None or self.embeddings.size == 0:
+      raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
+    if len(queries) == 0:
+      return []
     
+    query_embeddings = self.embed_queries(queries)
+    return [self.__results(ids, similarities, limit) for ids, similarities in score_rows_many(self.embeddings, self.quantized, query_embeddings, limit)]
+
+  def __results(self, ids: np.ndarray, similarities: np.ndarray, limit: int) -> list[dict]:
+    # only the documents shown are read from the store
     results = []
-    for item in similarities[:limit]:
+    for i in top_k_indices(similarities, limit):
+      doc = self.documents[ids[i]]
       results.append({
-        "score": item[0],
-        "title": item[1]["title"],
-        "description":  item[1]["description"]
+        "score": float(similarities[i]),
+        "title": doc["title"],
+        "description":  doc["description"],
+        "doc_id": int(ids[i]),
       })
       
     return results
     
     
 
-def verify_model():
-  ss = SemanticSearch()
-  print(f"Model loaded: {ss.model._model_config}")
-  print(f"Max sequence length: {ss.model.max_seq_length}")  
+def verify_model(encoder: str = DEFAULT_ENCODER):
+  ss = SemanticSearch(encoder=make_encoder(encoder))
+  print(f"Encoder: {ss.encoder.name} ({ss.encoder.get_sentence_embedding_dimension()} dimensions)")
+  if isinstance(ss.encoder, SentenceTransformerEncoder):
+    print(f"Model loaded: {ss.encoder.model._model_config}")
+    print(f"Max sequence length: {ss.encoder.model.max_seq_length}")  
 
 def embed_text(text: str):
   ss = SemanticSearch()
@@ -98,13 +149,13 @@ def embed_text(text: str):
   print(f"First 3 dimensions: {embedding[:3]}")
   print(f"Dimensions: {embedding.shape[0]}")
   
-def verify_embeddings():
-  ss = SemanticSearch()
-  documents = load_movies()  
-  embeddings = ss.load_or_create_embeddings(documents)
+def verify_embeddings(float16: bool = False, encoder: str = DEFAULT_ENCODER):
+  ss = SemanticSearch(encoder=make_encoder(encoder))
+  documents = load_documents()
+  embeddings = ss.load_or_create_embeddings(documents, float16)
 
   print(f"Number of docs:   {len(documents)}")
-  print(f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions")
+  print(f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions ({embeddings.dtype})")
   
   
 def embed_query_text(query: str):
@@ -116,6 +167,273 @@ def embed_query_text(query: str):
   print(f"Shape: {embedding.shape}")
   
   
+def query_cache_cmd(clear: bool = False, encoder: str = DEFAULT_ENCODER):
+  # the encoder only names the cache, its model is not loaded
+  cache = QueryEmbeddingCache(make_encoder(encoder).name)
+  if clear:
+    cache.clear()
+    print("Query embedding cache cleared")
+    return
+  
+  print(f"Model:          {cache.model_name}")
+  print(f"Cached queries: {cache.disk_size} of at most {cache.disk_entries}")
+  if os.path.exists(cache.path):
+    print(f"Size:           {os.path.getsize(cache.path) / 2**20:.2f} MiB")
+  
+  
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+  """
+  float32 copy of a vector, or of each row of a matrix, scaled to unit
+  length. Zero vectors stay zero, so their similarity is 0 like in
+  cosine_similarity.
+  """
+  vectors = np.asarray(vectors, dtype=np.float32)
+  norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+  return vectors / np.where(norms == 0, 1, norms)
+
+
+def content_keys(texts: Iterable[str], params: str, model_name: str) -> np.ndarray:
+  """
+  64-bit key of each text's embedding: a hash of the model name, the params
+  that turned a document into the text (how it was chunked) and the text.
+  """
+  prefix = f"{model_name}\0{params}\0".encode("utf-8")
+  return np.fromiter(
+    (int.from_bytes(hashlib.blake2b(prefix + text.encode("utf-8"), digest_size=8).digest(), "little") for text in texts),
+    dtype=np.uint64,
+  )
+
+
+def modified_since(documents: Sequence[dict], path: str) -> bool:
+  """
+  Whether documents may have changed since the file at path was built from
+  them: a DocStore when its file is newer, any other sequence always.
+  """
+  if not isinstance(documents, DocStore) or not os.path.exists(path):
+    return True
+  return os.path.getmtime(documents.path) > os.path.getmtime(path)
+
+
+def load_embeddings(path: str, rows: int, model_name: str, float16: bool = False) -> np.ndarray | None:
+  """
+  Embeddings at path mapped read-only, or None when they are missing or
+  were made by another model than model_name or for another number of
+  rows. Only the header is read to tell. With float16 a float32 file is
+  converted to half precision.
+  """
+  if not os.path.exists(path):
+    return None
+
+  stored = EmbeddingFile(path)
+  if stored.model_name != model_name or stored.rows != rows:
+    return None
+  if float16 and stored.dtype != np.float16:
+    if stored.keys is None:
+      return None
+    write_embeddings(path, stored.vectors, stored.keys, model_name, np.float16)
+    stored = EmbeddingFile(path)
+  return stored.vectors
+
+
+class KeyLookup:
+  """Finds the row of an embeddings file holding each of a batch of keys."""
+  def __init__(self, stored_keys: np.ndarray):
+    self.order = np.argsort(stored_keys)
+    self.sorted_keys = stored_keys[self.order]
+
+  def rows(self, keys: np.ndarray) -> np.ndarray:
+    """Row holding each of keys, -1 where none does."""
+    if len(self.order) == 0:
+      return np.full(len(keys), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(self.sorted_keys, keys), len(self.order) - 1)
+    return np.where(self.sorted_keys[positions] == keys, self.order[positions], -1)
+
+
+def build_embeddings_file(path: str, encoder: Encoder, texts: Iterable[str], params: str, dtype=np.float32) -> int:
+  """
+  Writes the unit-length embeddings of texts to path, keyed with
+  content_keys(texts, params, encoder.name), and returns how many were
+  encoded. texts are read once, as a stream: each ENCODE_BATCH of them is
+  hashed as it arrives, rows whose key is in the current file at path are
+  copied from it and the others encoded ENCODE_BATCH at a time, so the
+  number of rows need not be known up front and texts can be produced
+  while the encoder runs.
+
+  Rows are appended in order to path.partial (see EmbeddingWriter). Every
+  CHECKPOINT_BATCHES batches they are flushed and their keys appended to
+  path.progress: a later build keeps the rows of path.partial while its
+  keys agree with path.progress, and re-encodes from the first that does
+  not. Memory holds the keys and a few batches of texts and vectors,
+  whatever the number of rows. When every key and the dtype match the
+  current file, it is left as it is.
+  """
+  partial_path = path + ".partial"
+  progress_path = path + ".progress"
+  dtype = np.dtype(dtype)
+  
+  stored = EmbeddingFile(path) if os.path.exists(path) else None
+  if stored is not None and (stored.model_name != encoder.name or stored.keys is None):
+    stored = None
+  lookup = KeyLookup(stored.keys if stored is not None else np.zeros(0, dtype=np.uint64))
+  
+  # keys of the rows an interrupted build left in path.partial
+  done_keys = np.zeros(0, dtype=np.uint64)
+  if os.path.exists(partial_path) and os.path.exists(progress_path):
+    partial = EmbeddingFile(partial_path)
+    if partial.model_name == encoder.name and partial.dtype == dtype:
+      with open(progress_path, "rb") as f:
+        progress = f.read()
+      # a torn last key is dropped
+      done_keys = np.frombuffer(progress, dtype=np.uint64, count=len(progress) // 8)
+  if len(done_keys) > 0:
+    writer = EmbeddingWriter(partial_path, partial.dims, encoder.name, dtype, len(done_keys))
+  else:
+    dims = stored.dims if stored is not None else encoder.get_sentence_embedding_dimension()
+    writer = EmbeddingWriter(partial_path, dims, encoder.name, dtype)
+  progress_file = open(progress_path, "r+b" if len(done_keys) > 0 else "wb")
+  progress_file.truncate(len(done_keys) * 8)
+  progress_file.seek(len(done_keys) * 8)
+  
+  keys = array("Q")
+  # rows read but not written yet: where each is copied from, -1 for the
+  # rows to encode, whose texts are kept
+  pending_sources, pending_texts = [], []
+  checkpointed = writer.rows
+  encoded = 0
+  
+  def write_pending() -> None:
+    nonlocal checkpointed, encoded
+    sources = np.array(pending_sources, dtype=np.int64)
+    vectors = np.empty((len(sources), writer.dims), dtype=dtype)
+    reused = sources >= 0
+    if reused.any():
+      vectors[reused] = stored.vectors[sources[reused]]
+    if len(pending_texts) > 0:
+      vectors[sources < 0] = normalize_rows(encoder.encode(pending_texts))
+      encoded += len(pending_texts)
+    writer.append(vectors)
+    pending_sources.clear()
+    pending_texts.clear()
+    
+    if writer.rows - checkpointed >= ENCODE_BATCH * CHECKPOINT_BATCHES:
+      writer.flush()
+      progress_file.write(np.frombuffer(keys, dtype=np.uint64)[checkpointed:writer.rows].tobytes())
+      progress_file.flush()
+      checkpointed = writer.rows
+  
+  def read_batch(batch: list[str]) -> None:
+    nonlocal checkpointed
+    first = len(keys)
+    batch_keys = content_keys(batch, params, encoder.name)
+    keys.frombytes(batch_keys.tobytes())
+    
+    # rows path.partial already holds, up to the first whose text changed
+    kept = 0
+    if first < writer.rows:
+      held = min(len(batch_keys), writer.rows - first)
+      same = batch_keys[:held] == done_keys[first:first + held]
+      kept = len(same) if same.all() else int(np.argmin(same))
+      if kept < held:
+        writer.truncate(first + kept)
+        progress_file.truncate((first + kept) * 8)
+        progress_file.seek((first + kept) * 8)
+        checkpointed = first + kept
+    
+    sources = lookup.rows(batch_keys[kept:])
+    pending_sources.extend(sources.tolist())
+    pending_texts.extend(batch[kept + i] for i in np.flatnonzero(sources < 0).tolist())
+    if len(pending_texts) >= ENCODE_BATCH or len(pending_sources) >= ENCODE_BATCH * CHECKPOINT_BATCHES:
+      write_pending()
+  
+  if writer.rows > 0:
+    print(f"Resuming with {writer.rows} rows already embedded")
+  batch = []
+  for text in texts:
+    batch.append(text)
+    if len(batch) == ENCODE_BATCH:
+      read_batch(batch)
+      batch = []
+  if len(batch) > 0:
+    read_batch(batch)
+  write_pending()
+  # fewer rows than the interrupted build got to
+  if writer.rows > len(keys):
+    writer.truncate(len(keys))
+  
+  progress_file.close()
+  keys = np.frombuffer(keys, dtype=np.uint64)
+  if stored is not None and stored.dtype == dtype and np.array_equal(stored.keys, keys):
+    writer.close()
+    os.remove(partial_path)
+  else:
+    writer.finish(keys)
+    os.replace(partial_path, path)
+  os.remove(progress_path)
+  return encoded
+
+
+def dot_rows(vectors: np.ndarray, query: np.ndarray) -> np.ndarray:
+  """
+  vectors @ query in float32, query a vector or a (dims, queries) matrix.
+  float16 rows are widened a block at a time, numpy has no fast half
+  precision product and widening the whole matrix would copy it.
+  """
+  if vectors.dtype == np.float32:
+    return vectors @ query
+  scores = np.empty((len(vectors),) + query.shape[1:], dtype=np.float32)
+  for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+    block = vectors[start:start + SCORE_BLOCK_ROWS]
+    scores[start:start + len(block)] = block.astype(np.float32) @ query
+  return scores
+
+
+def score_rows(vectors: np.ndarray, quantized: QuantizedEmbeddings | None, query: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray]:
+  """
+  (row ids, exact scores) to pick the top limit rows from: every row, or
+  with quantized codes a shortlist of RESCORE_FACTOR * limit rows.
+  """
+  if quantized is None:
+    return np.arange(len(vectors)), dot_rows(vectors, query)
+  return quantized.search(vectors, query, limit * RESCORE_FACTOR)
+
+
+def score_rows_many(vectors: np.ndarray, quantized: QuantizedEmbeddings | None, queries: np.ndarray, limit: int):
+  """
+  Yields score_rows for each row of queries. Without quantized codes,
+  QUERY_BATCH queries at a time are scored by one matrix product.
+  """
+  if quantized is not None:
+    for query in queries:
+      yield quantized.search(vectors, query, limit * RESCORE_FACTOR)
+    return
+  
+  ids = np.arange(len(vectors))
+  for start in range(0, len(queries), QUERY_BATCH):
+    # (queries, rows), so each query's scores are contiguous
+    scores = np.ascontiguousarray(dot_rows(vectors, queries[start:start + QUERY_BATCH].T).T)
+    for query_scores in scores:
+      yield ids, query_scores
+
+
+def top_k_indices(scores: np.ndarray, limit: int) -> np.ndarray:
+  """
+  Indices of the limit highest scores, best first and ties by lower index.
+  argpartition finds them in linear time, only those are sorted.
+  """
+  limit = min(limit, len(scores))
+  if limit <= 0:
+    return np.zeros(0, dtype=np.int64)
+  
+  if limit < len(scores):
+    kth = scores[np.argpartition(-scores, limit - 1)[limit - 1]]
+    candidates = np.flatnonzero(scores >= kth)
+  else:
+    candidates = np.arange(len(scores))
+  
+  order = np.lexsort((candidates, -scores[candidates]))[:limit]
+  return candidates[order]
+
+
 def cosine_similarity(vec1, vec2) -> float:
   dot_product = np.dot(vec1, vec2)
   norm1 = np.linalg.norm(vec1)
@@ -127,9 +445,9 @@ def cosine_similarity(vec1, vec2) -> float:
   return dot_product / (norm1 * norm2)
 
 
-def search_query(query, limit):
-  ss = SemanticSearch()
-  documents = load_movies()  
+def search_query(query, limit, quantization: str | None = None, encoder: str = DEFAULT_ENCODER):
+  ss = SemanticSearch(quantization, make_encoder(encoder))
+  documents = load_documents()
   ss.load_or_create_embeddings(documents)
   
   results = ss.search(query, limit)
@@ -145,63 +463,3 @@ def search_query(query, limit):
 
     print(f"   {short_desc}")
     print()
-    
-  
-def chunk_text(text: str, chunk_size: int, overlap: int):
-  if overlap > chunk_size:
-    raise ValueError("Overlap cannot be greater than the chunk_size")
-  
-  print(f"Chunking {len(text)} characters")
-  
-  list_of_words = text.rsplit()
-  
-  chunks = []
-  if len(list_of_words) > 0:
-    chunk = " ".join(list_of_words[0:chunk_size])
-    chunks.append(chunk)
-    
-  start = chunk_size - overlap
-  while start+overlap < len(list_of_words):
-    end = start + chunk_size
-    chunk = " ".join(list_of_words[start:end])
-    chunks.append(chunk)
-    start = end - overlap
-
-  for i, w in enumerate(chunks,1):
-    print(f"{i}. {w}")
-    
-    
-def semantic_chunk_text(text: str, max_chunk_size: int, overlap: int):
-  print(f"Semantically chunking {len(text)} characters")
-  
-  # remove leading and trailing whitespace
-  text = text.strip()
-  if len(text) == 0:
-    return []
-  
-  raw_list_of_sentences = re.split(r"(?<=[.!?])\s+", text)
-  list_of_sentences = []
-  for s in raw_list_of_sentences:
-    # remove leading and trailing whitespace
-    sentence = s.strip()
-    if len(sentence) > 0:
-      list_of_sentences.append(sentence)
-  
-  chunks = []
-  if len(list_of_sentences) > 0:
-    chunk = " ".join(list_of_sentences[0:max_chunk_size])
-    chunks.append(chunk)
-    
-  start = max_chunk_size - overlap
-  while start+overlap < len(list_of_sentences):
-    end = start + max_chunk_size
-    chunk = " ".join(list_of_sentences[start:end])
-    chunks.append(chunk)
-    start = end - overlap
-
-  for i, w in enumerate(chunks,1):
-    print(f"{i}. {w}")
-    
-  return chunks
-    
-   
\ No newline at end of file
@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+
+from .search_utils import INDEX_PATH, SPELLING_PATH
+
+# corrections kept per misspelled query term
+MAX_CORRECTIONS = 3
+# a correction's BM25 contribution is scaled by this per edit
+CORRECTION_DISCOUNT = 0.5
+
+
+def max_edit_distance(term: str) -> int:
+  """Edits tolerated for a term of this length: none for 1-2 chars, 1 up to 5, else 2."""
+  if len(term) <= 2:
+    return 0
+  if len(term) <= 5:
+    return 1
+  return 2
+
+
+def bigrams(term: str) -> set[str]:
+  # padded, so the first and last characters get grams of their own
+  padded = f"^{term}$"
+  return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+  """Levenshtein distance of a and b, or max_distance + 1 if it is larger."""
+  if abs(len(a) - len(b)) > max_distance:
+    return max_distance + 1
+
+  previous = list(range(len(b) + 1))
+  for i, char_a in enumerate(a, 1):
+    current = [i] + [0] * len(b)
+    for j, char_b in enumerate(b, 1):
+      current[j] = min(
+        previous[j] + 1,
+        current[j - 1] + 1,
+        previous[j - 1] + (char_a != char_b),
+      )
+    if min(current) > max_distance:
+      return max_distance + 1
+    previous = current
+  return min(previous[-1], max_distance + 1)
+
+
+class TermCorrector:
+  """
+  Finds vocabulary terms within a small edit distance of a query term without
+  scanning the vocabulary. Terms are indexed by (length, character bigram);
+  one edit changes at most two of a term's distinct bigrams, so a term within
+  k edits of the query has a length within k of it and shares at least
+  len(bigrams(query)) - 2k bigrams with it. Only terms passing both filters
+  get an exact edit distance check.
+  """
+  def __init__(self, terms: list[str], keys: list[str], indptr: np.ndarray, term_ids: np.ndarray):
+    self.terms = terms
+    self.slots = {key: i for i, key in enumerate(keys)}
+    self.indptr = indptr
+    self.term_ids = term_ids
+
+  @classmethod
+  def compile(cls, idx) -> "TermCorrector":
+    # a segmented index lists every segment's terms, even fully deleted ones;
+    # corrections are checked against the live postings when used
+    terms = sorted(idx.postings.keys_source() if idx.segmented else idx.postings)
+
+    grams: dict[str, list[int]] = {}
+    for term_id, term in enumerate(terms):
+      for gram in bigrams(term):
+        grams.setdefault(f"{len(term)}:{gram}", []).append(term_id)
+
+    keys = sorted(grams)
+    indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    for i, key in enumerate(keys):
+      indptr[i + 1] = indptr[i] + len(grams[key])
+    term_ids = np.array([term_id for key in keys for term_id in grams[key]], dtype=np.int32)
+    return cls(terms, keys, indptr, term_ids)
+
+  @classmethod
+  def load_or_create(cls, idx) -> "TermCorrector":
+    """
+    Loads the cached n-gram index if it was built from the current index.bin,
+    otherwise builds it. Segmented indexes are built in memory only, since
+    they change with every ingest.
+    """
+    if idx.segmented or not os.path.exists(INDEX_PATH):
+      return cls.compile(idx)
+
+    stat = os.stat(INDEX_PATH)
+    stamp = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    if os.path.exists(SPELLING_PATH):
+      with np.load(SPELLING_PATH) as f:
+        if np.array_equal(f["index_stamp"], stamp):
+          return cls(f["terms"].tolist(), f["keys"].tolist(), f["indptr"], f["term_ids"])
+
+    corrector = cls.compile(idx)
+    with open(SPELLING_PATH, "wb") as f:
+      np.savez(
+        f,
+        terms=np.array(corrector.terms, dtype=str),
+        keys=np.array(list(corrector.slots), dtype=str),
+        indptr=corrector.indptr,
+        term_ids=corrector.term_ids,
+        index_stamp=stamp,
+      )
+    return corrector
+
+  def candidates(self, term: str) -> list[tuple[str, int]]:
+    """
+    (vocabulary term, edit distance) pairs within max_edit_distance(term) of
+    term, term itself excluded. The tolerated distance grows with the length
+    so that the shared bigram bound always filters.
+    """
+    max_distance = max_edit_distance(term)
+    if max_distance == 0:
+      return []
+
+    query_grams = bigrams(term)
+    # only terms with repeated bigrams ("aaaaaa") bring the bound below 1
+    min_shared = max(1, len(query_grams) - 2 * max_distance)
+    slices = []
+    for length in range(max(1, len(term) - max_distance), len(term) + max_distance + 1):
+      for gram in query_grams:
+        slot = self.slots.get(f"{length}:{gram}")
+        if slot is not None:
+          slices.append(self.term_ids[self.indptr[slot]:self.indptr[slot + 1]])
+    if len(slices) == 0:
+      return []
+
+    # counted over the candidates only, not a vocabulary-sized array
+    term_ids, shared = np.unique(np.concatenate(slices), return_counts=True)
+    found = []
+    for term_id in term_ids[shared >= min_shared].tolist():
+      candidate = self.terms[term_id]
+      distance = edit_distance(term, candidate, max_distance)
+      if 0 < distance <= max_distance:
+        found.append((candidate, distance))
+    return found
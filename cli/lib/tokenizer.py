@@ -0,0 +1,47 @@
+import functools
+import string
+
+from nltk.stem import PorterStemmer
+
+from .search_utils import load_stop_words
+
+# distinct words seen when indexing are far fewer than this, so the memo keeps
+# the whole movies vocabulary while staying bounded on larger corpora
+DEFAULT_STEM_CACHE_SIZE = 100_000
+
+
+class Tokenizer:
+  """
+  Reusable tokenizer producing the same tokens as tokenize_text, with all the
+  per-call setup hoisted out: stop words are read once into a frozenset, the
+  punctuation table is built once and stems are memoized in a bounded cache.
+  """
+  def __init__(self, stop_words: list[str] | None = None, stem_cache_size: int = DEFAULT_STEM_CACHE_SIZE):
+    if stop_words is None:
+      stop_words = load_stop_words() or []
+    self.stop_words = frozenset(stop_words)
+    self.translation_table = str.maketrans("", "", string.punctuation)
+    self.stemmer = PorterStemmer()
+    self.stem = functools.lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+  def words(self, text: str) -> list[str]:
+    """Lowercased words without punctuation, before stop word removal and stemming."""
+    return text.lower().translate(self.translation_table).split()
+
+  def tokenize(self, text: str) -> list[str]:
+    words = self.words(text)
+    stop_words = self.stop_words
+    stem = self.stem
+    return [stem(w) for w in words if w not in stop_words]
+
+  def tokenize_many(self, texts) -> list[list[str]]:
+    return [self.tokenize(text) for text in texts]
+
+  def cache_info(self):
+    return self.stem.cache_info()
+
+
+@functools.cache
+def get_tokenizer() -> Tokenizer:
+  """Process-wide tokenizer shared by the build and query paths."""
+  return Tokenizer()
@@ -0,0 +1,118 @@
+import bisect
+import heapq
+from typing import Callable
+
+# sentinel ordinal for an exhausted cursor
+END_OF_POSTINGS = float("inf")
+
+# upper bounds are sums of per-term maxima taken in a different order than the
+# real score, so they get a tiny relative slack to survive float rounding
+UPPER_BOUND_SLACK = 1e-9
+
+
+class TermCursor:
+  """
+  Iterates the ordinal-sorted postings of one query term.
+
+  Args:
+    term: The (stemmed) query term
+    ordinals: Sorted doc ordinals containing the term
+    tfs: Term frequencies aligned with ordinals
+    upper_bound: Max score contribution of this term to any document
+  """
+  def __init__(self, term: str, ordinals, tfs, upper_bound: float):
+    self.term = term
+    self.ordinals = ordinals
+    self.tfs = tfs
+    self.upper_bound = upper_bound * (1 + UPPER_BOUND_SLACK)
+    self.pos = 0
+    self.doc = ordinals[0] if len(ordinals) > 0 else END_OF_POSTINGS
+
+  def tf(self) -> int:
+    return self.tfs[self.pos]
+
+  def next(self) -> None:
+    self.pos += 1
+    self.__update_doc()
+
+  def seek(self, target: int) -> None:
+    # skip every posting below target without scoring it
+    self.pos = bisect.bisect_left(self.ordinals, target, self.pos)
+    self.__update_doc()
+
+  def __update_doc(self) -> None:
+    if self.pos < len(self.ordinals):
+      self.doc = self.ordinals[self.pos]
+    else:
+      self.doc = END_OF_POSTINGS
+
+
+def wand_top_k(
+  cursors: list[TermCursor],
+  limit: int,
+  score_doc: Callable[[int, list[TermCursor]], float],
+) -> tuple[list[tuple[int, float]], int]:
+  """
+  WAND top-k evaluation. A document is only scored when the upper bounds of
+  the terms that can still reach it beat the current k-th best score.
+
+  Ordinals are visited in increasing order and ties keep the lower ordinal, so
+  once the heap is full a candidate has to score strictly above the threshold.
+  The result is the same top-k an exhaustive scan produces.
+
+  Args:
+    cursors: One cursor per distinct query term
+    limit: Number of results to keep
+    score_doc: Computes the exact score of an ordinal given the cursors on it
+
+  Returns:
+    (ordinal, score) pairs sorted best first, and the number of postings scored
+  """
+  heap: list[tuple[float, int]] = []  # (score, -ordinal), weakest on top
+  postings_scored = 0
+  if limit <= 0:
+    return [], postings_scored
+
+  cursors = [c for c in cursors if c.doc != END_OF_POSTINGS]
+  while cursors:
+    threshold = heap[0][0] if len(heap) >= limit else None
+    cursors.sort(key=lambda c: c.doc)
+
+    # find the pivot: first cursor where the accumulated bound beats threshold
+    pivot = None
+    acc = 0.0
+    for i, cursor in enumerate(cursors):
+      acc += cursor.upper_bound
+      if threshold is None or acc > threshold:
+        pivot = i
+        break
+
+    if pivot is None:
+      break
+
+    pivot_doc = cursors[pivot].doc
+    if cursors[0].doc == pivot_doc:
+      # every cursor up to the pivot sits on pivot_doc, score it fully
+      on_doc = [c for c in cursors if c.doc == pivot_doc]
+      postings_scored += len(on_doc)
+      score = score_doc(pivot_doc, on_doc)
+
+      entry = (score, -pivot_doc)
+      if len(heap) < limit:
+        heapq.heappush(heap, entry)
+      elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+      for cursor in on_doc:
+        cursor.next()
+    else:
+      # the docs before pivot_doc cannot make it into the top-k
+      for cursor in cursors[:pivot]:
+        cursor.seek(pivot_doc)
+
+    if any(c.doc == END_OF_POSTINGS for c in cursors):
+      cursors = [c for c in cursors if c.doc != END_OF_POSTINGS]
+
+  results = [(-neg_ordinal, score) for score, neg_ordinal in heap]
+  results.sort(key=lambda item: (item[1], -item[0]), reverse=True)
+  return results, postings_scored
@@ -10,19 +10,25 @@ if str(project_root) not in sys.path:
   sys.path.insert(0, str(project_root))
 
 
-from cli.lib.chunked_semantic_search import embed_chunks_cmd, search_chunked_cmd
-from cli.lib.semantic_search import chunk_text, embed_query_text, embed_text, search_query, semantic_chunk_text, verify_embeddings, verify_model
+from cli.lib.chunking import CHUNK_WORKERS
+from cli.lib.search_utils import DEFAULT_ENCODER, DEFAULT_NPROBE, ENCODERS, QUANTIZATIONS
+
+# command modules are imported by their case below, so a command only pays
+# for numpy, the indexes or the model when it uses them
 
 def main():
   parser = argparse.ArgumentParser(description="Semantic Search CLI")
   subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-  subparsers.add_parser("verify", help="Verifies model is loaded")
+  verify_parser = subparsers.add_parser("verify", help="Verifies model is loaded")
+  verify_parser.add_argument("--encoder", choices=ENCODERS, default=DEFAULT_ENCODER, help=f"Encoder backend; int8 and hash make their own embeddings (default: {DEFAULT_ENCODER})")
  
   embed_text_parser = subparsers.add_parser("embed_text", help="Created embedding for the given text")
   embed_text_parser.add_argument("text", type=str, help="Input text for the embedding")
  
-  subparsers.add_parser("verify_embeddings", help="Verifies embeddings exist if not creates them")
+  verify_embeddings_parser = subparsers.add_parser("verify_embeddings", help="Verifies embeddings exist if not creates them")
+  verify_embeddings_parser.add_argument("--float16", action="store_true", help="Store the embeddings in half precision, half the size on disk")
+  verify_embeddings_parser.add_argument("--encoder", choices=ENCODERS, default=DEFAULT_ENCODER, help=f"Encoder backend; int8 and hash make their own embeddings (default: {DEFAULT_ENCODER})")
  
   embedquery_parser = subparsers.add_parser("embedquery", help="Created embedding for the given query")
   embedquery_parser.add_argument("query", type=str, help="Input query to embed")
@@ -35,6 +41,8 @@ def main():
     default=5,
     help="Number of results to show (default: 5)"
   )
+  search_parser.add_argument("--quantization", choices=QUANTIZATIONS, help="Search compressed embeddings, rescoring a shortlist exactly")
+  search_parser.add_argument("--encoder", choices=ENCODERS, default=DEFAULT_ENCODER, help=f"Encoder backend; int8 and hash make their own embeddings (default: {DEFAULT_ENCODER})")
   
   chunk_parser = subparsers.add_parser("chunk", help="Split long text into smaller pieces for embedding")
   chunk_parser.add_argument("text", type=str, help="Text to chunk")
@@ -46,46 +54,73 @@ def main():
   semantic_chunk_parser.add_argument("--max-chunk-size", type=int, default=4,help="Size in sentences of the chunk (default: 4)")
   semantic_chunk_parser.add_argument("--overlap", type=int, default=0, help="Number sentences to overlap between chunks")
   
-  subparsers.add_parser("embed_chunks", help="Verifies chunked embeddings exist if not creates them")
+  embed_chunks_parser = subparsers.add_parser("embed_chunks", help="Verifies chunked embeddings exist if not creates them")
+  embed_chunks_parser.add_argument("--float16", action="store_true", help="Store the embeddings in half precision, half the size on disk")
+  embed_chunks_parser.add_argument("--workers", type=int, default=CHUNK_WORKERS, help=f"Processes chunking descriptions while the main one encodes (default: {CHUNK_WORKERS})")
+  embed_chunks_parser.add_argument("--encoder", choices=ENCODERS, default=DEFAULT_ENCODER, help=f"Encoder backend; int8 and hash make their own embeddings (default: {DEFAULT_ENCODER})")
   
   search_chunked_parser = subparsers.add_parser("search_chunked", help="Search among all the documents/movies")
   search_chunked_parser.add_argument("query", type=str, help="Input query to search for")
   search_chunked_parser.add_argument("--limit", type=int, default=5, help="Number of results to show (default: 5)")
+  search_chunked_parser.add_argument("--engine", choices=["exact", "ivf"], default="exact", help="Score every chunk, or only the closest IVF lists (default: exact)")
+  search_chunked_parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help=f"IVF lists scanned per query, more is slower with better recall (default: {DEFAULT_NPROBE})")
+  search_chunked_parser.add_argument("--quantization", choices=QUANTIZATIONS, help="Search compressed embeddings, rescoring a shortlist exactly")
+  search_chunked_parser.add_argument("--encoder", choices=ENCODERS, default=DEFAULT_ENCODER, help=f"Encoder backend; int8 and hash make their own embeddings (default: {DEFAULT_ENCODER})")
+  
+  ann_recall_parser = subparsers.add_parser("ann_recall", help="Measure IVF chunk search recall and latency against exact search")
+  ann_recall_parser.add_argument("--queries", type=int, default=100, help="Number of sample queries (default: 100)")
+  ann_recall_parser.add_argument("--limit", type=int, default=10, help="Top results compared per query (default: 10)")
+  ann_recall_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, DEFAULT_NPROBE, 16, 32], help="nprobe values to try")
+  
+  quantization_recall_parser = subparsers.add_parser("quantization_recall", help="Measure size and recall of the quantized movie and chunk embeddings")
+  quantization_recall_parser.add_argument("--queries", type=int, default=100, help="Number of sample queries (default: 100)")
+  quantization_recall_parser.add_argument("--limit", type=int, default=10, help="Top results compared per query (default: 10)")
+  
+  query_cache_parser = subparsers.add_parser("query_cache", help="Show the cached query embeddings shared by the search commands")
+  query_cache_parser.add_argument("--clear", action="store_true", help="Remove every cached query embedding of the encoder")
+  query_cache_parser.add_argument("--encoder", choices=ENCODERS, default=DEFAULT_ENCODER, help=f"Encoder whose cached queries to show, each has its own (default: {DEFAULT_ENCODER})")
   
   args = parser.parse_args()
 
   match args.command:
     case "verify":
-      verify_model()
+      from cli.lib.semantic_search import verify_model
+      verify_model(args.encoder)
       pass
     
     case "embed_text":
+      from cli.lib.semantic_search import embed_text
       text = args.text
       embed_text(text)
       pass
     
     case "verify_embeddings":
-      verify_embeddings()
+      from cli.lib.semantic_search import verify_embeddings
+      verify_embeddings(args.float16, args.encoder)
       pass
     
     case "embedquery":
+      from cli.lib.semantic_search import embed_query_text
       query = args.query
       embed_query_text(query)
       pass
     
     case "search":
+      from cli.lib.semantic_search import search_query
       query = args.query
       limit = args.limit
-      search_query(query, limit)
+      search_query(query, limit, args.quantization, args.encoder)
       pass
     
     case "chunk":
+      from cli.lib.chunking import chunk_text
       text = args.text
       chunk_size = args.chunk_size
       overlap = args.overlap
       chunk_text(text, chunk_size, overlap)
       pass
     case "semantic_chunk":
+      from cli.lib.chunking import semantic_chunk_text
       text = args.text
       max_chunk_size = args.max_chunk_size
       overlap = args.overlap
@@ -93,13 +128,30 @@ def main():
       pass
     
     case "embed_chunks":
-      embed_chunks_cmd()
+      from cli.lib.chunked_semantic_search import embed_chunks_cmd
+      embed_chunks_cmd(args.float16, args.workers, args.encoder)
       pass
     
     case "search_chunked":
+      from cli.lib.chunked_semantic_search import search_chunked_cmd
       query = args.query
       limit = args.limit
-      search_chunked_cmd(query, limit)
+      search_chunked_cmd(query, limit, args.engine, args.nprobe, args.quantization, args.encoder)
+      pass
+    
+    case "ann_recall":
+      from cli.lib.chunked_semantic_search import ann_recall_cmd
+      ann_recall_cmd(args.queries, args.limit, args.nprobe)
+      pass
+    
+    case "quantization_recall":
+      from cli.lib.chunked_semantic_search import quantization_recall_cmd
+      quantization_recall_cmd(args.queries, args.limit)
+      pass
+    
+    case "query_cache":
+      from cli.lib.semantic_search import query_cache_cmd
+      query_cache_cmd(args.clear, args.encoder)
       pass
     
     case _:
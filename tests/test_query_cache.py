@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+
+from cli.lib.query_cache import QueryEmbeddingCache, query_cache_path
+
+
+def test_other_model_leaves_entries_alone(tmp_path):
+  path = os.path.join(tmp_path, "query_embeddings.bin")
+  embedding = np.arange(8, dtype=np.float32)
+
+  cache_a = QueryEmbeddingCache("model-a", path)
+  cache_a.put("space pirates", embedding)
+
+  # opened and written to with another model, the disk tier is left alone
+  cache_b = QueryEmbeddingCache("model-b", path)
+  assert not cache_b.disk_enabled
+  assert cache_b.get("space pirates") is None
+  cache_b.put("love story", embedding + 1)
+  assert cache_b.get("love story") is not None
+
+  cache_a = QueryEmbeddingCache("model-a", path)
+  assert cache_a.disk_enabled
+  assert cache_a.disk_size == 1
+  assert np.array_equal(cache_a.get("space pirates"), embedding)
+  assert cache_a.get("love story") is None
+
+
+def test_clear_removes_entries(tmp_path):
+  path = os.path.join(tmp_path, "query_embeddings.bin")
+  cache = QueryEmbeddingCache("model-a", path)
+  cache.put("space pirates", np.ones(8, dtype=np.float32))
+  cache.clear()
+
+  assert not os.path.exists(path)
+  assert QueryEmbeddingCache("model-a", path).get("space pirates") is None
+
+
+def test_each_model_has_its_own_file():
+  paths = {query_cache_path(name) for name in ("all-MiniLM-L6-v2", "all-MiniLM-L6-v2+int8", "hash-384")}
+  assert len(paths) == 3
+  assert os.path.basename(query_cache_path("org/model")) == "query_embeddings.org_model.bin"
+
+
+def test_broken_files_are_recreated(tmp_path):
+  path = os.path.join(tmp_path, "query_embeddings.bin")
+  keys_path = os.path.join(tmp_path, "query_embeddings.keys")
+  embedding = np.arange(8, dtype=np.float32)
+
+  # keys left without their file, then a file cut inside its header
+  open(keys_path, "wb").close()
+  for contents in (None, b"HQRY\x01"):
+    if contents is not None:
+      with open(path, "wb") as f:
+        f.write(contents)
+    cache = QueryEmbeddingCache("model-a", path)
+    assert cache.disk_enabled
+    cache.put("space pirates", embedding)
+    assert QueryEmbeddingCache("model-a", path).disk_size == 1
+    os.remove(path)